@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Mailing, Message, Recipient, SendingAttempt
+from .models import Bounce, DeliveryRetry, Mailing, MailingJob, Message, Recipient, SendingAttempt, Suppression
 
 
 @admin.register(Recipient)
@@ -32,26 +32,122 @@ class MailingAdmin(admin.ModelAdmin):
     """
     Представление для работы администратора для управления рассылкой
     Вывод на дисплей:
-        id, start_time(дата начала), end_time(дата окончания), status(статус), message(сообщение), owner(владелец)
+        id, start_time(дата начала), end_time(дата окончания), status(статус), message(сообщение), owner(владелец),
+        счетчики total_count(получателей), sent_count(отправлено), failed_count(не отправлено)
     Фильтрация по status(статус)
     Сортировка по end_time(дата окончания)
+    Счетчики и аренда отправки(Mailing.MAINTAINED_FIELDS) только для чтения, изменение рассылки сохраняет
+    только измененные поля формы
+    Методы:
+        save_model(self, request, obj, form, change) -> None:
+            Сохраняет рассылку, изменение - только по измененным полям формы(Mailing.settings_fields).
     """
 
-    list_display = ("id", "start_time", "end_time", "status", "message", "owner")
+    list_display = (
+        "id",
+        "start_time",
+        "end_time",
+        "status",
+        "message",
+        "owner",
+        "total_count",
+        "sent_count",
+        "failed_count",
+    )
     list_filter = ("status",)
     ordering = ("-end_time",)
+    readonly_fields = Mailing.MAINTAINED_FIELDS
+
+    def save_model(self, request, obj, form, change) -> None:
+        """Сохраняет рассылку, изменение - только по измененным полям формы(Mailing.settings_fields)."""
+        if change:
+            obj.save(update_fields=Mailing.settings_fields(form.changed_data))
+        else:
+            obj.save()
 
 
 @admin.register(SendingAttempt)
 class SendingAttemptAdmin(admin.ModelAdmin):
     """
     Представление для работы администратора для управления попыткой рассылки
-    Вывод на дисплей: id, created_at(дата создания), status(статус), answer(ответ почтового сервера)
-    и mailing(рассылка)
+    Вывод на дисплей: id, created_at(дата создания), status(статус), answer(ответ почтового сервера),
+    mailing(рассылка) и recipient(получатель)
     Фильтрация по status(статус)
     Сортировка по created_at(дата и время создания)
     """
 
-    list_display = ("id", "created_at", "status", "answer", "mailing")
+    list_display = ("id", "created_at", "status", "answer", "mailing", "recipient")
+    list_select_related = ("mailing__message", "recipient")
     list_filter = ("status",)
     ordering = ("created_at",)
+
+
+@admin.register(MailingJob)
+class MailingJobAdmin(admin.ModelAdmin):
+    """
+    Представление для работы администратора для управления очередью заданий рассылки
+    Вывод на дисплей: id, mailing(рассылка), status(статус), engine(движок), created_at(дата постановки),
+    started_at(дата начала), finished_at(дата окончания), worker(исполнитель), attempts(запуски)
+    Фильтрация по status(статус)
+    Сортировка по created_at(дата постановки в очередь)
+    """
+
+    list_display = (
+        "id",
+        "mailing",
+        "status",
+        "engine",
+        "created_at",
+        "started_at",
+        "finished_at",
+        "worker",
+        "attempts",
+    )
+    list_filter = ("status",)
+    ordering = ("-created_at",)
+
+
+@admin.register(DeliveryRetry)
+class DeliveryRetryAdmin(admin.ModelAdmin):
+    """
+    Представление для работы администратора для управления повторными отправками
+    Вывод на дисплей: id, mailing(рассылка), recipient(получатель), attempts(попытки),
+    next_attempt_at(дата следующей попытки), last_answer(последний ответ почтового сервера)
+    Фильтрация по mailing(рассылка)
+    Сортировка по next_attempt_at(дата следующей попытки)
+    """
+
+    list_display = ("id", "mailing", "recipient", "attempts", "next_attempt_at", "last_answer")
+    list_select_related = ("mailing__message", "recipient")
+    list_filter = ("mailing",)
+    ordering = ("next_attempt_at",)
+
+
+@admin.register(Suppression)
+class SuppressionAdmin(admin.ModelAdmin):
+    """
+    Представление для работы администратора для управления списком исключений
+    Вывод на дисплей: id, email(эл.почта), reason(причина), created_at(дата добавления), comment(комментарий)
+    Поиск по email(эл.почта)
+    Фильтрация по reason(причина)
+    """
+
+    list_display = ("id", "email", "reason", "created_at", "comment")
+    search_fields = ("email",)
+    list_filter = ("reason",)
+
+
+@admin.register(Bounce)
+class BounceAdmin(admin.ModelAdmin):
+    """
+    Представление для работы администратора для просмотра уведомлений о недоставке
+    Вывод на дисплей: id, email(эл.почта), mailing(рассылка), action(действие), status(код состояния),
+    diagnostic(ответ почтового сервера), received_at(дата уведомления)
+    Поиск по email(эл.почта)
+    Фильтрация по action(действие)
+    """
+
+    list_display = ("id", "email", "mailing", "action", "status", "diagnostic", "received_at")
+    list_select_related = ("mailing__message",)
+    search_fields = ("email",)
+    list_filter = ("action",)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ClientConnectConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "client_connect"
+
+    def ready(self) -> None:
+        """Подключает обработчики сигналов приложения."""
+        from client_connect import signals  # noqa: F401
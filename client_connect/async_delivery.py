@@ -0,0 +1,695 @@
+import asyncio
+import base64
+import re
+import smtplib
+import ssl
+import time
+from typing import AsyncIterable, Callable, Iterable, Optional, Union
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.mail.utils import DNS_NAME
+from django.db.models import QuerySet
+
+from client_connect.cancellation import CancellationToken
+from client_connect.circuit import CircuitBreaker
+from client_connect.delivery import (MAILING_ID_HEADER, DeliveryReport, DeliveryResult, MessageTemplate, batch_results,
+                                     save_attempts)
+from client_connect.lanes import DomainLane, DomainLanes
+from client_connect.models import Mailing
+from client_connect.pipelining import SMTPDataDisconnected, SMTPRoundTrips, transaction_commands
+from client_connect.progress import record_progress
+from client_connect.rate_limit import RateLimiter
+from client_connect.relays import RelayBalancer, RelayConfig, is_connection_error, parse_relays, relay_group_name
+from client_connect.retries import schedule_retries
+from client_connect.smtp_pool import BackendPool, uses_smtp_backend
+from client_connect.suppression import SUPPRESSED_ANSWER, SUPPRESSED_CODE, ascreen_recipients
+from client_connect.unsubscribe import unsubscribe_links
+from config import settings
+
+
+class AsyncSMTPClient:
+    """
+    SMTP клиент поверх потоков asyncio(asyncio streams)
+    Атрибуты:
+        host(str): Хост SMTP сервера
+        port(int): Порт SMTP сервера
+        username(str): Логин для авторизации
+        password(str): Пароль для авторизации
+        use_tls(bool): Использовать STARTTLS
+        use_ssl(bool): Использовать SSL соединение
+        timeout(float): Таймаут ожидания ответа сервера в секундах
+        pipelining(bool): Отправлять конверт письма одним пакетом, если сервер поддерживает ESMTP PIPELINING
+        stats(SMTPRoundTrips): Счетчик обращений к серверу, None - не считать
+        last_used(float): Время последнего использования соединения (time.monotonic)
+    Методы:
+        connect(self) -> None:
+            Подключается к серверу: приветствие, EHLO, STARTTLS и авторизация.
+        sendmail(self, from_email: str, recipients: list, message: bytes) -> dict:
+            Отправляет письмо, возвращает словарь отклоненных получателей как smtplib.SMTP.sendmail.
+        noop(self) -> int:
+            Отправляет команду NOOP, возвращает код ответа.
+        quit(self) -> None:
+            Завершает сессию командой QUIT и закрывает соединение.
+        close(self) -> None:
+            Закрывает соединение без QUIT.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        use_tls: bool = False,
+        use_ssl: bool = False,
+        timeout: Optional[float] = None,
+        pipelining: bool = True,
+        stats: Optional[SMTPRoundTrips] = None,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.pipelining = pipelining
+        self.stats = stats
+        self.last_used = 0.0
+        self.extensions: dict = {}
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    @property
+    def is_connected(self) -> bool:
+        """Соединение открыто"""
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self) -> None:
+        """
+        Подключается к серверу: приветствие, EHLO, STARTTLS и авторизация.
+        Если любой шаг после открытия соединения не удался(в том числе отмена задачи), соединение закрывается.
+        """
+        context = ssl.create_default_context() if self.use_ssl else None
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=context), self.timeout
+        )
+        try:
+            code, reply = await self._read_reply()
+            if code != 220:
+                raise smtplib.SMTPConnectError(code, reply)
+            await self._ehlo()
+            if self.use_tls and not self.use_ssl:
+                code, reply = await self._command("STARTTLS")
+                if code != 220:
+                    raise smtplib.SMTPNotSupportedError("STARTTLS не поддерживается сервером")
+                await self._writer.start_tls(ssl.create_default_context())
+                await self._ehlo()
+            if self.username and self.password:
+                await self._login()
+        except BaseException:
+            self.close()
+            raise
+        self.last_used = time.monotonic()
+
+    async def sendmail(self, from_email: str, recipients: list, message: bytes) -> dict:
+        """
+        Отправляет письмо, возвращает словарь отклоненных получателей как smtplib.SMTP.sendmail.
+        Если сервер объявил ESMTP PIPELINING, MAIL FROM, все RCPT TO и DATA отправляются одним пакетом(RFC 2920):
+        транзакция занимает два ожидания ответа сервера вместо N + 3.
+        :param from_email: Адрес отправителя
+        :param recipients: Список адресов получателей
+        :param message: Письмо в виде байтов
+        :return: Словарь отклоненных получателей {адрес: (код, ответ)}
+        :raise smtplib.SMTPSenderRefused: Если сервер отклонил отправителя
+        :raise smtplib.SMTPRecipientsRefused: Если сервер отклонил всех получателей
+        :raise smtplib.SMTPDataError: Если сервер не принял письмо
+        :raise SMTPDataDisconnected: Если соединение оборвано после того, как сервер принял DATA
+        """
+        commands = transaction_commands(recipients)
+        if self.pipelining and "pipelining" in self.extensions:
+            mail_reply, rcpt_replies, data_reply = await self._pipeline(
+                [f"MAIL FROM:<{from_email}>", *(f"RCPT TO:<{recipient}>" for recipient in recipients), "DATA"]
+            )
+            round_trips = 2
+        else:
+            mail_reply = await self._command(f"MAIL FROM:<{from_email}>")
+            rcpt_replies, data_reply = [], None
+            if mail_reply[0] == 250:
+                rcpt_replies = [await self._command(f"RCPT TO:<{recipient}>") for recipient in recipients]
+            round_trips = commands
+        refused = {
+            recipient: reply for recipient, reply in zip(recipients, rcpt_replies) if reply[0] not in (250, 251)
+        }
+        all_refused = len(refused) == len(recipients)
+        if data_reply is not None and data_reply[0] == 354 and (mail_reply[0] != 250 or all_refused):
+            # сервер уже ждет текст письма: завершаем его пустым, транзакция будет отклонена
+            await self._command(".")
+        if mail_reply[0] != 250:
+            await self._reset()
+            raise smtplib.SMTPSenderRefused(*mail_reply, from_email)
+        if all_refused:
+            await self._reset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+        if data_reply is None:
+            data_reply = await self._command("DATA")
+        if data_reply[0] != 354:
+            await self._reset()
+            raise smtplib.SMTPDataError(*data_reply)
+        self._writer.write(self._quote_data(message))
+        try:
+            code, reply = await self._read_reply()
+        except smtplib.SMTPServerDisconnected as exc_info:
+            raise SMTPDataDisconnected(f"Соединение оборвано после команды DATA: {exc_info}") from exc_info
+        if code != 250:
+            await self._reset()
+            raise smtplib.SMTPDataError(code, reply)
+        self.last_used = time.monotonic()
+        if self.stats is not None:
+            self.stats.add(commands, round_trips)
+        return refused
+
+    async def noop(self) -> int:
+        """Отправляет команду NOOP, возвращает код ответа."""
+        code, _ = await self._command("NOOP")
+        return code
+
+    async def quit(self) -> None:
+        """Завершает сессию командой QUIT и закрывает соединение."""
+        try:
+            await self._command("QUIT")
+        except (smtplib.SMTPException, OSError, asyncio.TimeoutError):
+            pass
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """Закрывает соединение без QUIT."""
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def _ehlo(self) -> None:
+        """Отправляет EHLO и запоминает расширения сервера."""
+        code, reply = await self._command(f"EHLO {DNS_NAME}")
+        if code != 250:
+            raise smtplib.SMTPHeloError(code, reply)
+        self.extensions = {}
+        for line in reply.decode("latin-1").splitlines()[1:]:
+            name, _, params = line.partition(" ")
+            self.extensions[name.lower()] = params
+
+    async def _login(self) -> None:
+        """Авторизация AUTH PLAIN, либо AUTH LOGIN, если PLAIN не поддерживается."""
+        methods = self.extensions.get("auth", "").upper().split()
+        if "PLAIN" in methods or not methods:
+            token = base64.b64encode(f"\0{self.username}\0{self.password}".encode()).decode()
+            code, reply = await self._command(f"AUTH PLAIN {token}")
+        else:
+            await self._command("AUTH LOGIN")
+            await self._command(base64.b64encode(self.username.encode()).decode())
+            code, reply = await self._command(base64.b64encode(self.password.encode()).decode())
+        if code not in (235, 503):
+            raise smtplib.SMTPAuthenticationError(code, reply)
+
+    async def _reset(self) -> None:
+        """Сбрасывает транзакцию командой RSET, ошибки игнорируются."""
+        try:
+            await self._command("RSET")
+        except (smtplib.SMTPException, OSError, asyncio.TimeoutError):
+            self.close()
+
+    async def _pipeline(self, lines: list) -> tuple:
+        """
+        Отправляет команды одним пакетом и читает ответы по порядку.
+        :return: (ответ на первую команду, ответы на промежуточные команды, ответ на последнюю команду)
+        """
+        if not self.is_connected:
+            raise smtplib.SMTPServerDisconnected("Соединение не открыто")
+        self._writer.write(b"".join(line.encode() + b"\r\n" for line in lines))
+        replies = [await self._read_reply() for _ in lines]
+        return replies[0], replies[1:-1], replies[-1]
+
+    async def _command(self, line: str) -> tuple:
+        """Отправляет команду и возвращает ответ сервера (код, текст)."""
+        if not self.is_connected:
+            raise smtplib.SMTPServerDisconnected("Соединение не открыто")
+        self._writer.write(line.encode() + b"\r\n")
+        return await self._read_reply()
+
+    async def _read_reply(self) -> tuple:
+        """Читает ответ сервера, в том числе многострочный, возвращает (код, текст)."""
+        lines = []
+        while True:
+            try:
+                raw = await asyncio.wait_for(self._reader.readline(), self.timeout)
+            except (OSError, asyncio.IncompleteReadError) as exc_info:
+                self.close()
+                raise smtplib.SMTPServerDisconnected(str(exc_info))
+            if not raw:
+                self.close()
+                raise smtplib.SMTPServerDisconnected("Соединение закрыто сервером")
+            lines.append(raw[4:].strip())
+            if raw[3:4] != b"-":
+                break
+        try:
+            code = int(raw[:3])
+        except ValueError:
+            code = -1
+        return code, b"\n".join(lines)
+
+    @staticmethod
+    def _quote_data(message: bytes) -> bytes:
+        """Приводит переводы строк к CRLF, экранирует точки в начале строк и добавляет завершение DATA."""
+        data = re.sub(rb"(?:\r\n|\n|\r(?!\n))", b"\r\n", message)
+        data = re.sub(rb"(?m)^\.", b"..", data)
+        if not data.endswith(b"\r\n"):
+            data += b"\r\n"
+        return data + b".\r\n"
+
+
+class AsyncSMTPConnectionPool:
+    """
+    Пул соединений AsyncSMTPClient в пределах одного цикла событий
+    Атрибуты:
+        size(int): Максимальное количество открытых соединений
+        noop_interval(float): Время простоя в секундах, после которого соединение проверяется командой NOOP
+        connection_kwargs(dict): Параметры для создания AsyncSMTPClient
+        stats(SMTPRoundTrips): Счетчик обращений к серверу всех соединений пула
+    Методы:
+        acquire(self) -> AsyncSMTPClient:
+            Выдает живое соединение из пула, при необходимости открывает новое.
+        release(self, client: AsyncSMTPClient, discard: bool = False) -> None:
+            Возвращает соединение в пул, либо закрывает его при discard=True.
+        send(self, from_email: str, recipients: list, message: bytes) -> dict:
+            Отправляет письмо через соединение из пула, при обрыве соединения до DATA переподключается один раз.
+        close_all(self) -> None:
+            Закрывает все свободные соединения пула командой QUIT.
+    """
+
+    def __init__(self, size: int, noop_interval: float = 30, **connection_kwargs) -> None:
+        self.size = size
+        self.noop_interval = noop_interval
+        self.connection_kwargs = connection_kwargs
+        self.stats = SMTPRoundTrips()
+        self._idle: list = []
+        self._slots = asyncio.Semaphore(size)
+
+    async def acquire(self) -> AsyncSMTPClient:
+        """Выдает живое соединение из пула, при необходимости открывает новое."""
+        await self._slots.acquire()
+        try:
+            while self._idle:
+                client = self._idle.pop()
+                if await self._is_alive(client):
+                    return client
+                client.close()
+            client = AsyncSMTPClient(stats=self.stats, **self.connection_kwargs)
+            await client.connect()
+            return client
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, client: AsyncSMTPClient, discard: bool = False) -> None:
+        """Возвращает соединение в пул, либо закрывает его при discard=True."""
+        if discard or not client.is_connected:
+            client.close()
+        else:
+            self._idle.append(client)
+        self._slots.release()
+
+    async def send(self, from_email: str, recipients: list, message: bytes) -> dict:
+        """
+        Отправляет письмо через соединение из пула, при обрыве соединения до команды DATA переподключается
+        один раз. Обрыв после DATA не повторяется: сервер мог принять письмо, повтор - по расписанию(DeliveryRetry).
+        """
+        for attempt in range(2):
+            client = await self.acquire()
+            discard = False
+            try:
+                return await client.sendmail(from_email, recipients, message)
+            except smtplib.SMTPServerDisconnected as exc_info:
+                discard = True
+                if attempt or isinstance(exc_info, SMTPDataDisconnected):
+                    raise
+            except smtplib.SMTPException:
+                raise
+            except (OSError, asyncio.TimeoutError):
+                discard = True
+                raise
+            finally:
+                self.release(client, discard=discard)
+        return {}
+
+    async def close_all(self) -> None:
+        """Закрывает все свободные соединения пула командой QUIT."""
+        idle, self._idle = self._idle, []
+        await asyncio.gather(*(client.quit() for client in idle))
+
+    async def _is_alive(self, client: AsyncSMTPClient) -> bool:
+        """Проверяет соединение командой NOOP, если оно простаивало дольше noop_interval."""
+        if not client.is_connected:
+            return False
+        if time.monotonic() - client.last_used < self.noop_interval:
+            return True
+        try:
+            return await client.noop() == 250
+        except (smtplib.SMTPException, OSError, asyncio.TimeoutError):
+            return False
+
+
+class AsyncRelayPool:
+    """
+    Группа SMTP серверов(EMAIL_RELAYS) с отдельным пулом AsyncSMTPConnectionPool на каждый сервер
+    в пределах одного цикла событий. Письма распределяются между серверами(RelayBalancer), при ошибке сервера
+    (недоступен, обрыв соединения, таймаут, ответ 421) письмо отправляется через следующий сервер.
+    Атрибуты:
+        balancer(RelayBalancer): Распределение писем между серверами
+        stats(SMTPRoundTrips): Счетчик обращений к серверам всех соединений группы
+    Методы:
+        send(self, from_email: str, recipients: list, message: bytes) -> dict:
+            Отправляет письмо через выбранный сервер, при ошибке сервера - через следующий.
+        relay_stats(self) -> dict:
+            Статистика отправки по серверам.
+        close_all(self) -> None:
+            Закрывает все свободные соединения со всеми серверами командой QUIT.
+    """
+
+    def __init__(
+        self, relays: list, strategy: Optional[str] = None, noop_interval: float = 30, **connection_kwargs
+    ) -> None:
+        self.stats = SMTPRoundTrips()
+
+        def make_pool(relay: RelayConfig) -> AsyncSMTPConnectionPool:
+            pool = AsyncSMTPConnectionPool(
+                relay.concurrency, noop_interval, host=relay.host, port=relay.port, **connection_kwargs
+            )
+            pool.stats = self.stats
+            return pool
+
+        self.balancer = RelayBalancer.for_relays(relays, make_pool, strategy)
+
+    async def send(self, from_email: str, recipients: list, message: bytes) -> dict:
+        """
+        Отправляет письмо через выбранный сервер, при ошибке сервера - через следующий.
+        Отказы получателям, ошибки письма(ответы 5xx) и обрыв соединения после DATA другому серверу не передаются.
+        :raise smtplib.SMTPServerDisconnected: Если доступных серверов нет
+        """
+        tried, error = [], None
+        while True:
+            relay = self.balancer.choose(tuple(tried))
+            if relay is None:
+                raise error or smtplib.SMTPServerDisconnected("Нет доступных SMTP серверов")
+            started = time.monotonic()
+            try:
+                refused = await relay.pool.send(from_email, recipients, message)
+            except (smtplib.SMTPException, OSError) as exc_info:
+                if not is_connection_error(exc_info):
+                    self.balancer.record(relay, started, (0, len(recipients)))
+                    raise
+                self.balancer.record(relay, started)
+                if isinstance(exc_info, SMTPDataDisconnected):
+                    raise  # сервер мог принять письмо: другому серверу не передается
+                tried.append(relay)
+                error = exc_info
+            else:
+                self.balancer.record(relay, started, (len(recipients) - len(refused), len(refused)))
+                return refused
+            finally:
+                self.balancer.release(relay)
+
+    def relay_stats(self) -> dict:
+        """Статистика отправки по серверам {сервер: показатели}."""
+        return self.balancer.stats()
+
+    async def close_all(self) -> None:
+        """Закрывает все свободные соединения со всеми серверами командой QUIT."""
+        await asyncio.gather(*(relay.pool.close_all() for relay in self.balancer.relays))
+
+
+class AsyncBackendPool:
+    """
+    Отправка писем через почтовый бэкенд Django(BackendPool) из цикла событий: бэкенд синхронный,
+    поэтому письмо отправляется в потоке, не блокируя цикл событий.
+    Атрибуты:
+        backend_pool(BackendPool): Отправка через почтовый бэкенд
+        stats(SMTPRoundTrips): Счетчик обращений к SMTP серверу(для бэкенда всегда пустой)
+    Методы:
+        send(self, from_email: str, recipients: list, message: bytes) -> dict:
+            Отправляет письмо через почтовый бэкенд в потоке.
+        close_all(self) -> None:
+            Закрывать нечего.
+    """
+
+    def __init__(self, backend: str, size: int) -> None:
+        self.backend_pool = BackendPool(backend, size)
+        self.stats = self.backend_pool.stats
+
+    async def send(self, from_email: str, recipients: list, message: bytes) -> dict:
+        """Отправляет письмо через почтовый бэкенд в потоке."""
+        return await sync_to_async(self.backend_pool.send, thread_sensitive=False)(from_email, recipients, message)
+
+    async def close_all(self) -> None:
+        """Закрывать нечего: соединение бэкенда открывается на каждое письмо."""
+
+
+class AsyncDeliveryEngine:
+    """
+    Движок отправки рассылки на asyncio: тысячи одновременных отправок в одном цикле событий.
+    Попытки рассылки(SendingAttempt) записываются пачками через асинхронный ORM Django.
+    Атрибуты:
+        concurrency(int): Максимальное количество одновременных отправок (и открытых SMTP соединений)
+        batch_size(int): Размер пачки для записи попыток рассылки в БД
+        rate_limiter(RateLimiter): Ограничитель скорости отправки, None - без ограничения
+        rcpt_batch_size(int): Сколько получателей отправлять одной SMTP транзакцией(RCPT TO), 1 - по одному.
+                              Для писем с подстановками всегда 1
+        circuit_breaker(CircuitBreaker): Автоматический выключатель SMTP сервера, None - без выключателя
+    Методы:
+        adeliver(self, recipients, subject: str, body: str, from_email: str, mailing: Mailing,
+                 on_result: Optional[Callable] = None) -> DeliveryReport:
+            Асинхронно отправляет письмо всем получателям и записывает попытки рассылки.
+        deliver(self, recipients, subject: str, body: str, from_email: str, mailing: Mailing,
+                on_result: Optional[Callable] = None) -> DeliveryReport:
+            Синхронная обертка над adeliver для вызова из синхронного кода.
+    """
+
+    def __init__(
+        self,
+        concurrency: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        rcpt_batch_size: int = 1,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+    ) -> None:
+        self.concurrency = concurrency or settings.MAILING_ASYNC_CONCURRENCY
+        self.batch_size = batch_size or settings.MAILING_ATTEMPTS_BATCH_SIZE
+        self.rate_limiter = rate_limiter
+        self.rcpt_batch_size = max(1, rcpt_batch_size)
+        self.circuit_breaker = circuit_breaker or CircuitBreaker.for_relay(relay_group_name())
+
+    def deliver(
+        self,
+        recipients: Union[Iterable[dict], AsyncIterable[dict]],
+        subject: str,
+        body: str,
+        from_email: str,
+        mailing: Mailing,
+        on_result: Optional[Callable[[DeliveryResult], None]] = None,
+    ) -> DeliveryReport:
+        """Синхронная обертка над adeliver для вызова из синхронного кода."""
+        return async_to_sync(self.adeliver)(recipients, subject, body, from_email, mailing, on_result)
+
+    async def adeliver(
+        self,
+        recipients: Union[Iterable[dict], AsyncIterable[dict]],
+        subject: str,
+        body: str,
+        from_email: str,
+        mailing: Mailing,
+        on_result: Optional[Callable[[DeliveryResult], None]] = None,
+    ) -> DeliveryReport:
+        """
+        Асинхронно отправляет письмо всем получателям и записывает попытки рассылки.
+        Отправка останавливается, если рассылка отключена(status 'disable'): флаг отмены проверяется
+        раз в MAILING_CANCEL_CHECK_EVERY писем или MAILING_CANCEL_CHECK_INTERVAL секунд, без запроса на каждое письмо.
+        При заданном ограничителе скорости задача отправки создается только после получения разрешения.
+        При rcpt_batch_size > 1 письмо без подстановок отправляется пачке получателей одной SMTP транзакцией,
+        результат записывается для каждого получателя отдельно.
+        Получатели распределяются по очередям доменов(DomainLanes) с собственными ограничениями, очереди
+        обслуживаются по кругу в пределах окна из MAILING_RECIPIENTS_CHUNK_SIZE прочитанных получателей,
+        окно расширяется, если все домены окна ждут своих ограничений.
+        Пока автоматический выключатель SMTP сервера разомкнут, новые отправки не начинаются(пауза рассылки),
+        после успешных пробных отправок рассылка продолжается.
+        Получателям из списка исключений(Suppression) письмо не отправляется, попытка записывается как неудачная.
+        :param recipients: Строки получателей {'id': ID получателя, 'email': адрес}(обычный или асинхронный итератор).
+        :param subject: Тема письма.
+        :param body: Текст письма.
+        :param from_email: Адрес отправителя.
+        :param mailing: Модель рассылки, к которой относятся попытки.
+        :param on_result: Функция, вызываемая для каждого результата отправки.
+        :return: Итог отправки рассылки.
+        """
+        report = DeliveryReport()
+        cancellation = CancellationToken(mailing.pk)
+        pending: list = []
+        slots = asyncio.Semaphore(self.concurrency)
+        tasks: set = set()
+        # письмо кодируется один раз на рассылку
+        template = MessageTemplate(
+            subject,
+            body,
+            from_email,
+            headers={MAILING_ID_HEADER: str(mailing.pk)},
+            unsubscribe=unsubscribe_links(mailing.pk),
+        )
+        pool = self._make_pool()
+
+        lanes = DomainLanes(self.rcpt_batch_size if template.is_batchable else 1)
+        changed = asyncio.Event()  # завершилась отправка: у домена освободилось место
+
+        async def send_batch(lane: DomainLane, rows: list) -> None:
+            recipients = [row["email"] for row in rows]
+            try:
+                message = template.render(recipients[0], rows[0]) if len(rows) == 1 else template.render_batch()
+                refused = await pool.send(from_email, recipients, message)
+            except (smtplib.SMTPException, OSError, asyncio.TimeoutError) as exc_info:
+                results = batch_results(rows, exc_info=exc_info)
+            else:
+                results = batch_results(rows, refused)
+            finally:
+                slots.release()
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.record(results)
+            lanes.release(lane, results)
+            changed.set()
+            for result in results:
+                if self.rate_limiter is not None:
+                    self.rate_limiter.record(result.code)
+                report.add(result)
+                pending.append(result)
+                if on_result is not None:
+                    on_result(result)
+
+        def on_suppressed(row: dict) -> None:
+            result = DeliveryResult.for_row(row, "fail", SUPPRESSED_ANSWER, SUPPRESSED_CODE)
+            report.suppressed += 1
+            report.add(result)
+            pending.append(result)
+            if on_result is not None:
+                on_result(result)
+
+        async def dispatch(keep: int) -> None:
+            # отправляет готовые пачки по кругу доменов, пока в очередях больше keep получателей
+            while lanes.buffered > keep:
+                if await cancellation.ais_cancelled():
+                    report.stopped = True
+                    return
+                changed.clear()
+                paused = self.circuit_breaker.wait_time() if self.circuit_breaker is not None else 0
+                if paused:
+                    # SMTP сервер недоступен: ждем, проверяя отмену рассылки, и записываем готовые результаты
+                    started = time.monotonic()
+                    try:
+                        await asyncio.wait_for(changed.wait(), min(paused, settings.MAILING_CANCEL_CHECK_INTERVAL))
+                    except asyncio.TimeoutError:
+                        pass
+                    report.paused += time.monotonic() - started
+                    await self._flush(pending, mailing)
+                    continue
+                lane, rows, wait = lanes.next_batch()
+                if lane is None:
+                    if keep and lanes.read_ahead():
+                        return  # все домены окна ждут: читаются следующие получатели
+                    try:
+                        await asyncio.wait_for(changed.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await slots.acquire()
+                if self.circuit_breaker is not None:
+                    self.circuit_breaker.start()
+                if self.rate_limiter is not None:
+                    for _ in rows:
+                        await self.rate_limiter.aacquire()
+                task = asyncio.create_task(send_batch(lane, rows))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                if len(pending) >= self.batch_size:
+                    await self._flush(pending, mailing)
+
+        try:
+            async for row in ascreen_recipients(self._iterate(recipients), on_suppressed):
+                lanes.add(row)
+                await dispatch(lanes.limit - 1)
+                if report.stopped:
+                    break
+            else:
+                await dispatch(0)
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            await pool.close_all()
+        await self._flush(pending, mailing)
+        report.round_trips_saved = pool.stats.saved
+        if isinstance(pool, AsyncRelayPool):
+            report.relays = pool.relay_stats()
+        return report
+
+    def _make_pool(self) -> Union[AsyncSMTPConnectionPool, AsyncRelayPool, AsyncBackendPool]:
+        """
+        Создает пул соединений для одной рассылки по настройкам config.settings: группу серверов(AsyncRelayPool),
+        если задан EMAIL_RELAYS, иначе пул соединений с сервером EMAIL_HOST на concurrency соединений.
+        Если EMAIL_BACKEND - не SMTP бэкенд, письма отправляются через него(AsyncBackendPool).
+        """
+        if not uses_smtp_backend():
+            return AsyncBackendPool(settings.EMAIL_BACKEND, self.concurrency)
+        connection_kwargs = dict(
+            username=settings.EMAIL_HOST_USER,
+            password=settings.EMAIL_HOST_PASSWORD,
+            use_tls=settings.EMAIL_USE_TLS,
+            use_ssl=settings.EMAIL_USE_SSL,
+            timeout=settings.EMAIL_TIMEOUT,
+            pipelining=settings.EMAIL_PIPELINING,
+        )
+        relays = parse_relays(settings.EMAIL_RELAYS)
+        if relays:
+            return AsyncRelayPool(relays, noop_interval=settings.EMAIL_POOL_NOOP_INTERVAL, **connection_kwargs)
+        return AsyncSMTPConnectionPool(
+            size=self.concurrency,
+            noop_interval=settings.EMAIL_POOL_NOOP_INTERVAL,
+            host=settings.EMAIL_HOST,
+            port=int(settings.EMAIL_PORT),
+            **connection_kwargs,
+        )
+
+    @staticmethod
+    async def _iterate(recipients: Union[Iterable[dict], AsyncIterable[dict]]) -> AsyncIterable[dict]:
+        """
+        Перебирает получателей из обычного или асинхронного итератора.
+        QuerySet читается асинхронно порциями по MAILING_RECIPIENTS_CHUNK_SIZE строк, без загрузки всего списка.
+        """
+        if isinstance(recipients, QuerySet):
+            async for row in recipients.aiterator(chunk_size=settings.MAILING_RECIPIENTS_CHUNK_SIZE):
+                yield row
+        elif hasattr(recipients, "__aiter__"):
+            async for row in recipients:
+                yield row
+        else:
+            for row in recipients:
+                yield row
+
+    @staticmethod
+    async def _flush(pending: list, mailing: Mailing) -> None:
+        """
+        Записывает накопленные результаты в журнал доставки(SendingAttempt) одним запросом.
+        Получателям с временной ошибкой SMTP сервера планируется повторная отправка.
+        Пачка учитывается в счетчиках рассылки и счетчиках прогресса.
+        """
+        if not pending:
+            return
+        batch = pending[:]
+        pending.clear()
+        await sync_to_async(save_attempts)(batch, mailing)
+        await sync_to_async(schedule_retries)(batch, mailing)
+        await sync_to_async(record_progress)(mailing.pk, batch)
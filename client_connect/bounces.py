@@ -0,0 +1,321 @@
+import hashlib
+import os
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+from datetime import timezone as dt_timezone
+from email.message import Message as EmailMessage
+from email.parser import BytesParser, HeaderParser
+from email.utils import parseaddr, parsedate_to_datetime
+from itertools import groupby, islice
+from typing import Iterable, Iterator, Optional
+
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+from django.db.models.functions import Greatest
+
+from client_connect.delivery import MAILING_ID_HEADER
+from client_connect.models import Bounce, Mailing, Recipient, SendingAttempt
+from client_connect.suppression import normalize_email, suppress
+
+BOUNCE_ANSWER = "Уведомление о недоставке {status}: {diagnostic}"
+MAILBOX_FORMATS = ("auto", "mbox", "maildir")
+ORIGINAL_TYPES = ("text/rfc822-headers", "message/rfc822-headers", "message/rfc822")
+
+
+@dataclass
+class BounceRecord:
+    """
+    Уведомление о доставке(DSN) по одному получателю
+    Атрибуты:
+        message_id(str): Message-ID уведомления(или хеш уведомления без Message-ID)
+        email(str): Адрес получателя(Final-Recipient)
+        action(str): Действие почтового сервера('failed', 'delayed', 'delivered', 'relayed', 'expanded')
+        status(str): Код состояния доставки(например, 5.1.1)
+        diagnostic(str): Ответ почтового сервера получателя(Diagnostic-Code)
+        mailing_id(int): ID рассылки из заголовка X-Mailing-Id исходного письма, None - не определена
+        received_at(datetime): Дата уведомления, None - без даты
+    """
+
+    message_id: str
+    email: str
+    action: str
+    status: str
+    diagnostic: str
+    mailing_id: Optional[int] = None
+    received_at: Optional[datetime] = None
+
+    @property
+    def is_failure(self) -> bool:
+        """Письмо не доставлено(Action: failed)."""
+        return self.action == "failed"
+
+    @property
+    def is_hard(self) -> bool:
+        """Постоянная ошибка адреса: адреса нет(5.1.x) или ящик отключен(5.2.1), адрес исключается из рассылок."""
+        return self.is_failure and (self.status.startswith("5.1.") or self.status == "5.2.1")
+
+
+def iter_mbox(path: str) -> Iterator[bytes]:
+    """
+    Читает письма из файла mbox построчно, в памяти только текущее письмо.
+    Письма разделяются строками 'From ' после пустой строки, экранирование '>From ' снимается.
+    :param path: Путь к файлу mbox.
+    :return: Итератор писем в виде байтов.
+    """
+    lines: list = []
+    previous_blank = True
+    with open(path, "rb") as file:
+        for line in file:
+            if previous_blank and line.startswith(b"From "):
+                if lines:
+                    yield b"".join(lines)
+                lines = []
+            else:
+                if line.startswith(b">") and line.lstrip(b">").startswith(b"From "):
+                    line = line[1:]
+                lines.append(line)
+            previous_blank = line in (b"\n", b"\r\n")
+    if lines:
+        yield b"".join(lines)
+
+
+def iter_maildir(path: str) -> Iterator[bytes]:
+    """
+    Читает письма из каталога Maildir(подкаталоги new и cur) по одному файлу.
+    :param path: Путь к каталогу Maildir.
+    :return: Итератор писем в виде байтов.
+    """
+    for folder in ("new", "cur"):
+        directory = os.path.join(path, folder)
+        if not os.path.isdir(directory):
+            continue
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.startswith("."):
+                    with open(entry.path, "rb") as file:
+                        yield file.read()
+
+
+def iter_mailbox(path: str, mailbox_format: str = "auto") -> Iterator[bytes]:
+    """
+    Читает письма почтового ящика возвратов.
+    :param path: Путь к файлу mbox или каталогу Maildir.
+    :param mailbox_format: 'mbox', 'maildir' или 'auto'(каталог - Maildir, файл - mbox).
+    :return: Итератор писем в виде байтов.
+    """
+    if mailbox_format == "auto":
+        mailbox_format = "maildir" if os.path.isdir(path) else "mbox"
+    return iter_maildir(path) if mailbox_format == "maildir" else iter_mbox(path)
+
+
+def _status_blocks(part: EmailMessage) -> list:
+    """Блоки полей части message/delivery-status: сведения об уведомлении и по каждому получателю."""
+    payload = part.get_payload()
+    if isinstance(payload, list):
+        return payload
+    text = (part.get_payload(decode=True) or b"").decode("utf-8", "replace")
+    return [HeaderParser().parsestr(block.strip() + "\n") for block in text.replace("\r\n", "\n").split("\n\n")]
+
+
+def _original_mailing_id(part: Optional[EmailMessage]) -> Optional[int]:
+    """ID рассылки из заголовка X-Mailing-Id исходного письма, приложенного к уведомлению."""
+    if part is None:
+        return None
+    if part.get_content_type() == "message/rfc822":
+        headers = part.get_payload(0)
+    else:
+        headers = HeaderParser().parsestr((part.get_payload(decode=True) or b"").decode("utf-8", "replace"))
+    try:
+        return int(headers.get(MAILING_ID_HEADER, "").strip())
+    except ValueError:
+        return None
+
+
+def _field_value(value: Optional[str]) -> str:
+    """Значение поля вида 'тип; значение' без типа, перенос строк заменяется пробелом."""
+    if not value:
+        return ""
+    kind, separator, rest = value.partition(";")
+    return " ".join((rest if separator else kind).split())
+
+
+def parse_dsn(raw: bytes) -> Optional[list]:
+    """
+    Разбирает уведомление о доставке(DSN, RFC 3464: multipart/report с частью message/delivery-status).
+    :param raw: Письмо в виде байтов.
+    :return: Список уведомлений по получателям(BounceRecord), None - письмо не является уведомлением о доставке.
+    """
+    message = BytesParser().parsebytes(raw)
+    if message.get_content_type() != "multipart/report":
+        return None
+    status_part = original = None
+    for part in message.get_payload():
+        content_type = part.get_content_type()
+        if content_type == "message/delivery-status":
+            status_part = part
+        elif content_type in ORIGINAL_TYPES:
+            original = part
+    if status_part is None:
+        return None
+    message_id = (message.get("Message-ID") or "").strip()[:255] or "sha1:" + hashlib.sha1(raw).hexdigest()
+    try:
+        received_at = parsedate_to_datetime(message.get("Date"))
+    except (TypeError, ValueError):
+        received_at = None
+    if received_at is not None and received_at.tzinfo is None:
+        received_at = received_at.replace(tzinfo=dt_timezone.utc)
+    mailing_id = _original_mailing_id(original)
+    records = []
+    for block in _status_blocks(status_part):
+        recipient = _field_value(block.get("Final-Recipient") or block.get("Original-Recipient"))
+        email = parseaddr(recipient)[1]
+        if not email:
+            continue
+        records.append(
+            BounceRecord(
+                message_id=message_id,
+                email=email,
+                action=(block.get("Action") or "").strip().lower(),
+                status=(block.get("Status") or "").strip().split(" ")[0][:20],
+                diagnostic=_field_value(block.get("Diagnostic-Code")),
+                mailing_id=mailing_id,
+                received_at=received_at,
+            )
+        )
+    return records
+
+
+def fail_attempts(records: list) -> int:
+    """
+    Меняет результат доставки по уведомлениям о недоставке: последняя до уведомления успешная попытка рассылки
+    получателю становится неудачной с ответом из уведомления, счетчики текущего запуска рассылки(попытки
+    с run_started_at) пересчитываются(F()). sent_count не опускается ниже нуля, failed_count(получатели) растет,
+    только если после попытки получателю ничего не отправлялось. Попытки блокируются(SELECT FOR UPDATE),
+    уже неудачная попытка не меняется повторно.
+    :param records: Уведомления с Action: failed и известной рассылкой(BounceRecord).
+    :return: Количество измененных попыток рассылки.
+    """
+    emails = {record.email for record in records} | {normalize_email(record.email) for record in records}
+    recipients = {
+        normalize_email(email): pk
+        for email, pk in Recipient.objects.filter(email__in=emails).values_list("email", "pk")
+    }
+    bounced = {}
+    for record in records:
+        recipient_id = recipients.get(normalize_email(record.email))
+        if recipient_id is not None:
+            bounced[(record.mailing_id, recipient_id)] = record
+    if not bounced:
+        return 0
+    latest = {}
+    attempts = (
+        SendingAttempt.objects.select_for_update()
+        .filter(
+            status="success",
+            mailing_id__in={key[0] for key in bounced},
+            recipient_id__in={key[1] for key in bounced},
+        )
+        .annotate(
+            superseded=Exists(
+                SendingAttempt.objects.filter(
+                    mailing=OuterRef("mailing"), recipient=OuterRef("recipient"), created_at__gt=OuterRef("created_at")
+                )
+            )
+        )
+    )
+    for attempt in attempts.order_by("created_at"):
+        record = bounced.get((attempt.mailing_id, attempt.recipient_id))
+        if record is not None and (record.received_at is None or attempt.created_at <= record.received_at):
+            latest[(attempt.mailing_id, attempt.recipient_id)] = attempt
+    for key, attempt in latest.items():
+        record = bounced[key]
+        attempt.status = "fail"
+        attempt.answer = BOUNCE_ANSWER.format(status=record.status, diagnostic=record.diagnostic)
+    SendingAttempt.objects.bulk_update(latest.values(), ["status", "answer"])
+    runs = dict(Mailing.objects.filter(pk__in={key[0] for key in latest}).values_list("pk", "run_started_at"))
+    current = {  # счетчики относятся к текущему запуску рассылки
+        key: attempt
+        for key, attempt in latest.items()
+        if runs.get(key[0]) is None or attempt.created_at >= runs[key[0]]
+    }
+    failed = Counter(key[0] for key, attempt in current.items() if not attempt.superseded)
+    for mailing_id, count in Counter(key[0] for key in current).items():
+        Mailing.objects.filter(pk=mailing_id).update(
+            sent_count=Greatest(F("sent_count") - count, 0), failed_count=F("failed_count") + failed[mailing_id]
+        )
+    return len(latest)
+
+
+def apply_bounces(records: list) -> dict:
+    """
+    Записывает пачку уведомлений о доставке. Уже обработанные уведомления(Message-ID и получатель есть в Bounce)
+    пропускаются, поэтому повторная обработка того же ящика ничего не меняет.
+    По уведомлениям о недоставке меняются результаты доставки(fail_attempts), адреса с постоянной ошибкой адреса
+    добавляются в список исключений.
+    :param records: Уведомления по получателям(BounceRecord).
+    :return: {'new': новых уведомлений, 'updated': измененных попыток рассылки, 'suppressed': исключенных адресов}
+    """
+    unique = {(record.message_id, normalize_email(record.email)): record for record in records}
+    existing = set(Bounce.objects.filter(message_id__in={key[0] for key in unique}).values_list("message_id", "email"))
+    new = [record for key, record in unique.items() if key not in existing]
+    if not new:
+        return {"new": 0, "updated": 0, "suppressed": 0}
+    mailing_ids = set(
+        Mailing.objects.filter(pk__in={record.mailing_id for record in new if record.mailing_id}).values_list(
+            "pk", flat=True
+        )
+    )
+    for record in new:
+        if record.mailing_id not in mailing_ids:
+            record.mailing_id = None
+    with transaction.atomic():
+        Bounce.objects.bulk_create(
+            (
+                Bounce(
+                    message_id=record.message_id,
+                    email=normalize_email(record.email),
+                    mailing_id=record.mailing_id,
+                    action=record.action[:20],
+                    status=record.status,
+                    diagnostic=record.diagnostic,
+                    received_at=record.received_at,
+                )
+                for record in new
+            ),
+            ignore_conflicts=True,
+        )
+        updated = fail_attempts([record for record in new if record.is_failure and record.mailing_id])
+    suppressed = 0
+    hard = sorted((record for record in new if record.is_hard), key=lambda record: record.status)
+    for status, group in groupby(hard, key=lambda record: record.status):
+        suppressed += suppress((record.email for record in group), reason="bounce", comment=f"DSN {status}")
+    return {"new": len(new), "updated": updated, "suppressed": suppressed}
+
+
+def ingest_mailbox(path: str, mailbox_format: str = "auto", batch_size: int = 1000) -> Counter:
+    """
+    Обрабатывает почтовый ящик возвратов потоком: письма читаются по одному, уведомления записываются пачками
+    по batch_size получателей, память не зависит от размера ящика.
+    :param path: Путь к файлу mbox или каталогу Maildir.
+    :param mailbox_format: 'mbox', 'maildir' или 'auto'.
+    :param batch_size: Размер пачки уведомлений для записи в БД.
+    :return: Итоги: messages - писем, skipped - писем без уведомления о доставке, records - уведомлений
+             по получателям, new, updated, suppressed - итоги apply_bounces.
+    """
+    totals: Counter = Counter()
+
+    def records() -> Iterable[BounceRecord]:
+        for raw in iter_mailbox(path, mailbox_format):
+            totals["messages"] += 1
+            parsed = parse_dsn(raw)
+            if parsed is None:
+                totals["skipped"] += 1
+                continue
+            totals["records"] += len(parsed)
+            yield from parsed
+
+    iterator = iter(records())
+    while batch := list(islice(iterator, batch_size)):
+        totals.update(apply_bounces(batch))
+    return totals
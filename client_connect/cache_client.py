@@ -0,0 +1,12 @@
+import redis
+from django.core.cache import cache
+
+
+def redis_client() -> redis.Redis:
+    """
+    Клиент Redis кеша Django(CACHES["default"], RedisCache) для структур, которых нет в API кеша(списки, скрипты Lua):
+    адрес, параметры и пул соединений берутся из настроек кеша, отдельного подключения нет.
+    Ключи таких структур строятся через cache.make_key, чтобы учитывались KEY_PREFIX и VERSION кеша.
+    :return: Клиент Redis с пулом соединений кеша.
+    """
+    return cache._cache.get_client(write=True)
@@ -0,0 +1,148 @@
+import time
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+
+from client_connect.models import Mailing
+from config import settings
+
+CANCEL_KEY = "mailing:cancel:{}"
+CANCEL_TTL = 60 * 60 * 24
+
+_local_cancels: set = set()  # рассылки, отправка которых остановлена только в этом процессе
+_shared_cancels = None  # остановки, общие для процесса send_mailing --processes и его дочерних процессов
+
+
+def request_cancel(mailing_pk: int) -> None:
+    """
+    Выставляет флаг отмены рассылки, который видят все процессы отправки.
+    При CACHE_ENABLED флаг хранится в Redis, иначе процессы узнают об отмене по статусу рассылки в БД.
+    :param mailing_pk: ID рассылки.
+    """
+    if settings.CACHE_ENABLED:
+        cache.set(CANCEL_KEY.format(mailing_pk), True, CANCEL_TTL)
+
+
+def clear_cancel(mailing_pk: int) -> None:
+    """
+    Снимает флаг отмены рассылки перед новым запуском.
+    :param mailing_pk: ID рассылки.
+    """
+    if settings.CACHE_ENABLED:
+        cache.delete(CANCEL_KEY.format(mailing_pk))
+
+
+def cancel_local(mailing_pk: int) -> None:
+    """
+    Останавливает отправку рассылки только в текущем процессе, не затрагивая другие процессы
+    (например, после потери аренды рассылки: ее отправку продолжает другой исполнитель).
+    :param mailing_pk: ID рассылки.
+    """
+    _local_cancels.add(mailing_pk)
+    if _shared_cancels is not None:
+        _shared_cancels[mailing_pk] = True
+
+
+def clear_local_cancel(mailing_pk: int) -> None:
+    """
+    Снимает остановку отправки рассылки в текущем процессе.
+    :param mailing_pk: ID рассылки.
+    """
+    _local_cancels.discard(mailing_pk)
+    if _shared_cancels is not None:
+        _shared_cancels.pop(mailing_pk, None)
+
+
+def share_cancels(shared=None) -> None:
+    """
+    Делает остановку отправки в текущем процессе общей с дочерними процессами отправки частей рассылки:
+    родитель держит аренды рассылок(send_mailing --processes) и при потере аренды останавливает отправку
+    во всех своих дочерних процессах.
+    :param shared: Словарь multiprocessing.Manager ID рассылки -> True, общий для процессов, None - не делиться.
+    """
+    global _shared_cancels
+    _shared_cancels = shared
+    if shared is not None:
+        shared.update(dict.fromkeys(_local_cancels, True))
+
+
+class CancellationToken:
+    """
+    Признак отмены рассылки для цикла отправки: флаг проверяется не на каждое письмо,
+    а раз в check_every писем или раз в check_interval секунд, что наступит раньше.
+    Отмена запоминается - после нее флаг больше не проверяется.
+    При CACHE_ENABLED флаг в Redis выставляет только MailingService.update_status, поэтому статус рассылки в БД
+    тоже проверяется, но реже - раз в db_check_interval секунд: рассылка, отключенная в обход сервиса(админка,
+    Mailing.objects.update(), правка в БД), останавливается с этой задержкой.
+    Атрибуты:
+        mailing_pk(int): ID рассылки
+        check_every(int): Через сколько писем проверять флаг
+        check_interval(float): Через сколько секунд проверять флаг
+        db_check_interval(float): Через сколько секунд проверять статус в БД при CACHE_ENABLED
+    Методы:
+        is_cancelled(self) -> bool:
+            Проверяет, отменена ли рассылка.
+        ais_cancelled(self) -> bool:
+            Асинхронно проверяет, отменена ли рассылка, не блокируя цикл событий.
+    """
+
+    def __init__(
+        self,
+        mailing_pk: int,
+        check_every: Optional[int] = None,
+        check_interval: Optional[float] = None,
+        db_check_interval: Optional[float] = None,
+    ) -> None:
+        self.mailing_pk = mailing_pk
+        self.check_every = check_every or settings.MAILING_CANCEL_CHECK_EVERY
+        self.check_interval = check_interval or settings.MAILING_CANCEL_CHECK_INTERVAL
+        self.db_check_interval = db_check_interval or settings.MAILING_CANCEL_DB_CHECK_INTERVAL
+        self._cancelled = False
+        self._calls = 0
+        self._checked_at: Optional[float] = None
+        self._db_checked_at: Optional[float] = None
+
+    def is_cancelled(self) -> bool:
+        """Проверяет, отменена ли рассылка. Флаг запрашивается только когда подошел срок проверки."""
+        if not self._cancelled and self._due():
+            self._cancelled = self._poll()
+        return self._cancelled
+
+    async def ais_cancelled(self) -> bool:
+        """Асинхронно проверяет, отменена ли рассылка, не блокируя цикл событий."""
+        if not self._cancelled and self._due():
+            self._cancelled = await sync_to_async(self._poll)()
+        return self._cancelled
+
+    def _due(self) -> bool:
+        """Подошел ли срок проверки флага: первое обращение, check_every писем или check_interval секунд."""
+        self._calls += 1
+        now = time.monotonic()
+        if (
+            self._checked_at is None
+            or self._calls >= self.check_every
+            or now - self._checked_at >= self.check_interval
+        ):
+            self._calls = 0
+            self._checked_at = now
+            return True
+        return False
+
+    def _poll(self) -> bool:
+        """
+        Запрашивает флаг отмены: остановку в текущем процессе или родительском процессе отправки частей,
+        в Redis при CACHE_ENABLED(без флага - статус в БД раз в db_check_interval секунд), иначе статус в БД.
+        """
+        if self.mailing_pk in _local_cancels:
+            return True
+        if _shared_cancels is not None and self.mailing_pk in _shared_cancels:
+            return True
+        if settings.CACHE_ENABLED:
+            if cache.get(CANCEL_KEY.format(self.mailing_pk)):
+                return True
+            now = time.monotonic()
+            if self._db_checked_at is not None and now - self._db_checked_at < self.db_check_interval:
+                return False
+            self._db_checked_at = now
+        return Mailing.objects.filter(pk=self.mailing_pk, status="disable").exists()
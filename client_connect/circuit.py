@@ -0,0 +1,145 @@
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from config import settings
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+def is_relay_failure(result) -> bool:
+    """
+    Проверяет, что неудачная отправка вызвана недоступностью SMTP сервера, а не получателем:
+    обрыв или таймаут соединения(код ответа отсутствует), ответ 421(сервис недоступен).
+    :param result: Результат отправки(DeliveryResult).
+    :return: True для ошибки SMTP сервера.
+    """
+    return result.status == "fail" and result.code in (None, 421)
+
+
+class CircuitBreaker:
+    """
+    Автоматический выключатель отправки через SMTP сервер: если доля ошибок сервера в последних отправках
+    достигла error_rate, выключатель размыкается и отправка приостанавливается на open_time секунд вместо
+    ожидания таймаута соединения на каждом получателе. Затем выключатель полуоткрыт: пропускаются probes
+    пробных отправок, при их успехе отправка продолжается, при ошибке выключатель снова размыкается.
+    Состояние хранится в памяти процесса и общее для всех рассылок процесса, отправляющих через этот сервер.
+    Атрибуты:
+        name(str): Название выключателя(SMTP сервер)
+        error_rate(float): Доля ошибок сервера, при которой выключатель размыкается
+        window(int): Сколько последних отправок учитывать
+        min_calls(int): Минимальное количество отправок в окне для размыкания
+        open_time(float): Пауза в секундах перед пробными отправками
+        probes(int): Количество пробных отправок в полуоткрытом состоянии
+        state(str): Состояние: 'closed' - отправка разрешена, 'open' - пауза, 'half_open' - пробные отправки
+        opened(int): Сколько раз выключатель размыкался
+    Методы:
+        for_relay(name: str) -> Optional[CircuitBreaker]:
+            Возвращает общий для процесса выключатель SMTP сервера, None если выключатель отключен.
+        wait_time(self) -> float:
+            Сколько секунд ждать до следующей отправки, 0 - отправка разрешена.
+        start(self) -> None:
+            Учитывает начатую отправку, в полуоткрытом состоянии занимает место пробной отправки.
+        record(self, results: list) -> None:
+            Учитывает результаты одной отправки(SMTP транзакции).
+        record_call(self, failed: bool) -> None:
+            Учитывает одну отправку: удачную или не выполненную из-за ошибки сервера.
+    """
+
+    _breakers: dict = {}
+    _breakers_lock = threading.Lock()
+
+    def __init__(
+        self,
+        name: str,
+        error_rate: Optional[float] = None,
+        window: Optional[int] = None,
+        min_calls: Optional[int] = None,
+        open_time: Optional[float] = None,
+        probes: Optional[int] = None,
+    ) -> None:
+        self.name = name
+        self.error_rate = settings.MAILING_CIRCUIT_ERROR_RATE if error_rate is None else error_rate
+        self.window = window or settings.MAILING_CIRCUIT_WINDOW
+        self.min_calls = min(min_calls or settings.MAILING_CIRCUIT_MIN_CALLS, self.window)
+        self.open_time = settings.MAILING_CIRCUIT_OPEN_TIME if open_time is None else open_time
+        self.probes = probes or settings.MAILING_CIRCUIT_PROBES
+        self.state = CLOSED
+        self.opened = 0
+        self._calls: deque = deque(maxlen=self.window)  # True - ошибка сервера
+        self._opened_at = 0.0
+        self._probes_started = 0
+        self._probes_passed = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_relay(cls, name: str) -> Optional["CircuitBreaker"]:
+        """
+        Возвращает общий для процесса выключатель SMTP сервера или группы серверов.
+        :param name: Название сервера(<адрес>:<порт>) или группы серверов.
+        :return: Выключатель, None если выключатель отключен(MAILING_CIRCUIT_ERROR_RATE = 0).
+        """
+        if not settings.MAILING_CIRCUIT_ERROR_RATE:
+            return None
+        with cls._breakers_lock:
+            breaker = cls._breakers.get(name)
+            if breaker is None:
+                breaker = cls._breakers[name] = cls(name)
+        return breaker
+
+    def wait_time(self) -> float:
+        """
+        Сколько секунд ждать до следующей отправки, 0 - отправка разрешена.
+        После паузы open_time разомкнутый выключатель переходит в полуоткрытое состояние.
+        """
+        with self._lock:
+            if self.state == OPEN:
+                wait = self._opened_at + self.open_time - time.monotonic()
+                if wait > 0:
+                    return wait
+                self.state, self._probes_started, self._probes_passed = HALF_OPEN, 0, 0
+            if self.state == HALF_OPEN and self._probes_started >= self.probes:
+                return self.open_time  # ждем результатов пробных отправок
+            return 0.0
+
+    def start(self) -> None:
+        """Учитывает начатую отправку, в полуоткрытом состоянии занимает место пробной отправки."""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probes_started += 1
+
+    def record(self, results: list) -> None:
+        """
+        Учитывает результаты одной отправки(SMTP транзакции): отправка неудачна, если хотя бы один
+        получатель не получил письмо из-за ошибки сервера. Результаты отправок, начатых до размыкания,
+        в разомкнутом состоянии не учитываются.
+        :param results: Результаты отправки по получателям(DeliveryResult).
+        """
+        self.record_call(any(is_relay_failure(result) for result in results))
+
+    def record_call(self, failed: bool) -> None:
+        """
+        Учитывает одну отправку: удачную или не выполненную из-за ошибки сервера.
+        :param failed: Отправка не выполнена из-за ошибки сервера.
+        """
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if failed:
+                    self._open()
+                else:
+                    self._probes_passed += 1
+                    if self._probes_passed >= self.probes:
+                        self.state = CLOSED
+                        self._calls.clear()
+            elif self.state == CLOSED:
+                self._calls.append(failed)
+                if len(self._calls) >= self.min_calls and sum(self._calls) / len(self._calls) >= self.error_rate:
+                    self._open()
+
+    def _open(self) -> None:
+        """Размыкает выключатель: отправка приостанавливается на open_time секунд."""
+        self.state = OPEN
+        self.opened += 1
+        self._opened_at = time.monotonic()
+        self._calls.clear()
@@ -0,0 +1,610 @@
+import binascii
+import smtplib
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from email.header import Header
+from email.utils import formatdate, make_msgid
+from functools import partial
+from queue import Empty, Queue
+from typing import Callable, Iterable, Optional, Union
+
+from django.core.mail import EmailMessage
+from django.core.mail.message import sanitize_address
+from django.core.mail.utils import DNS_NAME
+from django.db import transaction
+from django.db.models import F, QuerySet
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from client_connect.cancellation import CancellationToken
+from client_connect.circuit import CircuitBreaker
+from client_connect.lanes import DomainLane, DomainLanes
+from client_connect.models import Mailing, SendingAttempt
+from client_connect.personalization import PersonalizedText
+from client_connect.pipelining import SMTPDataDisconnected
+from client_connect.progress import record_progress
+from client_connect.rate_limit import RateLimiter
+from client_connect.retries import schedule_retries
+from client_connect.smtp_pool import PooledSMTPConnection, RelayPool, SMTPConnectionPool, get_connection_pool
+from client_connect.suppression import SUPPRESSED_ANSWER, SUPPRESSED_CODE, screen_recipients
+from client_connect.unsubscribe import unsubscribe_links
+from config import settings
+
+SUCCESS_ANSWER = "Сообщение успешно отправлено"
+MAILING_ID_HEADER = "X-Mailing-Id"  # по заголовку уведомление о недоставке(DSN) относится к рассылке
+
+
+def make_attempts(results: list, mailing: Mailing) -> list:
+    """
+    Преобразует результаты отправки в записи журнала доставки - попытки рассылки по получателям.
+    :param results: Список результатов отправки(DeliveryResult).
+    :param mailing: Модель рассылки.
+    :return: Список несохраненных SendingAttempt.
+    """
+    return [
+        SendingAttempt(status=result.status, answer=result.answer, mailing=mailing, recipient_id=result.recipient_id)
+        for result in results
+    ]
+
+
+def failed_delta(results: list, mailing: Mailing) -> int:
+    """
+    Изменение счетчика неотправленных(failed_count) по пачке результатов: счетчик хранит получателей, последняя
+    попытка которым в текущем запуске(с run_started_at) неуспешна. Повторная неудача получателю не учитывается,
+    успешный повтор уменьшает счетчик. Прошлые результаты получателей пачки читаются одним запросом.
+    :param results: Список результатов отправки(DeliveryResult).
+    :param mailing: Модель рассылки.
+    :return: На сколько изменить failed_count.
+    """
+    attempts = SendingAttempt.objects.filter(
+        mailing=mailing, recipient_id__in={result.recipient_id for result in results if result.recipient_id}
+    )
+    if mailing.run_started_at is not None:
+        attempts = attempts.filter(created_at__gte=mailing.run_started_at)
+    latest = dict(attempts.order_by("created_at", "pk").values_list("recipient_id", "status"))
+    delta = 0
+    for result in results:
+        failed_before = latest.get(result.recipient_id) == "fail"
+        if result.status == "success":
+            delta -= failed_before
+        elif not failed_before:
+            delta += 1
+        if result.recipient_id is not None:
+            latest[result.recipient_id] = result.status
+    return delta
+
+
+def save_attempts(results: list, mailing: Mailing) -> None:
+    """
+    Записывает пачку результатов в журнал доставки и обновляет счетчики рассылки одной транзакцией:
+    одна вставка попыток и одно атомарное обновление счетчиков(F()) на пачку.
+    sent_count считает успешные попытки, failed_count - получателей, которым письмо не отправлено(failed_delta).
+    :param results: Список результатов отправки(DeliveryResult).
+    :param mailing: Модель рассылки.
+    """
+    sent = sum(1 for result in results if result.status == "success")
+    with transaction.atomic():
+        failed = failed_delta(results, mailing)
+        SendingAttempt.objects.bulk_create(make_attempts(results, mailing))
+        Mailing.objects.filter(pk=mailing.pk).update(
+            sent_count=F("sent_count") + sent,
+            failed_count=Greatest(F("failed_count") + failed, 0),
+            last_attempt_at=timezone.now(),
+        )
+
+
+def stream_recipients(recipients: Iterable[dict]) -> Iterable[dict]:
+    """
+    Перебирает получателей без загрузки всего списка в память.
+    QuerySet читается порциями по MAILING_RECIPIENTS_CHUNK_SIZE строк(в PostgreSQL - серверным курсором),
+    остальные итерируемые объекты возвращаются как есть.
+    :param recipients: QuerySet строк получателей или другой итерируемый объект.
+    :return: Итератор строк получателей.
+    """
+    if isinstance(recipients, QuerySet):
+        return recipients.iterator(chunk_size=settings.MAILING_RECIPIENTS_CHUNK_SIZE)
+    return recipients
+
+
+def smtp_error_code(exc_info: Exception) -> Optional[int]:
+    """
+    Извлекает код ответа SMTP сервера из исключения отправки.
+    :param exc_info: Исключение, возникшее при отправке письма.
+    :return: Код ответа сервера или None, если сервер не вернул код.
+    """
+    if isinstance(exc_info, smtplib.SMTPResponseException):
+        return exc_info.smtp_code
+    if isinstance(exc_info, smtplib.SMTPRecipientsRefused) and exc_info.recipients:
+        return next(iter(exc_info.recipients.values()))[0]
+    return None
+
+
+class MessageTemplate:
+    """
+    Письмо рассылки, собранное и закодированное один раз для всех получателей.
+    MIME представление(заголовки Subject, From, Content-Type и закодированный текст) формируется при создании,
+    для каждого получателя к готовым байтам добавляются только заголовки To, Date и Message-ID.
+    Тема и текст с подстановками({{ full_name }}, {{ email }}) разбираются один раз(PersonalizedText),
+    для каждого получателя кодируются только те из них, что содержат подстановки.
+    Дополнительные заголовки(headers) одинаковы для всех получателей и тоже добавляются один раз.
+    С функцией unsubscribe письму каждого получателя добавляются заголовки отписки в один клик(List-Unsubscribe,
+    List-Unsubscribe-Post, RFC 8058) и подстановка {{ unsubscribe_url }}. Письмо пачке получателей(render_batch)
+    одинаково для всех и не может содержать персональную ссылку отписки, поэтому письмо со ссылками отписки
+    пачкой не отправляется(is_batchable).
+    Атрибуты:
+        from_email(str): Адрес отправителя
+        encoding(str): Кодировка письма
+        subject(PersonalizedText): Тема письма
+        body(PersonalizedText): Текст письма
+        unsubscribe(Callable): Функция адрес получателя -> адрес отписки, None - без ссылки отписки
+    Методы:
+        is_static(self) -> bool:
+            Письмо без подстановок, одинаковое для всех получателей.
+        is_batchable(self) -> bool:
+            Письмо можно отправить пачке получателей одной SMTP транзакцией.
+        render(self, recipient: str, context: Optional[dict] = None) -> bytes:
+            Возвращает письмо для одного получателя.
+        render_batch(self) -> bytes:
+            Возвращает письмо без подстановок для отправки нескольким получателям одной SMTP транзакцией.
+    """
+
+    def __init__(
+        self,
+        subject: str,
+        body: str,
+        from_email: str,
+        encoding: str = "utf-8",
+        headers: Optional[dict] = None,
+        unsubscribe: Optional[Callable[[str], str]] = None,
+    ) -> None:
+        self.from_email = from_email
+        self.encoding = encoding
+        self.unsubscribe = unsubscribe
+        self.subject = PersonalizedText(subject)
+        self.body = PersonalizedText(body)
+        email = EmailMessage(subject=subject, body=body, from_email=from_email, headers=headers)
+        email.encoding = encoding
+        message = email.message()
+        for header in ("To", "Date", "Message-ID"):
+            del message[header]
+        if not self.subject.is_static:
+            del message["Subject"]
+        if not self.body.is_static:
+            # текст кодируется для каждого получателя, всегда quoted-printable
+            del message["Content-Transfer-Encoding"]
+            message["Content-Transfer-Encoding"] = "quoted-printable"
+        head, _, payload = message.as_bytes(linesep="\r\n").partition(b"\r\n\r\n")
+        self._head = head + b"\r\n"
+        self._payload = b"\r\n" + payload
+
+    @property
+    def is_static(self) -> bool:
+        """Письмо без подстановок, одинаковое для всех получателей."""
+        return self.subject.is_static and self.body.is_static
+
+    @property
+    def is_batchable(self) -> bool:
+        """Письмо можно отправить пачке получателей одной SMTP транзакцией: без подстановок и без ссылок отписки."""
+        return self.is_static and self.unsubscribe is None
+
+    def render_batch(self) -> bytes:
+        """
+        Возвращает письмо без подстановок для отправки нескольким получателям одной SMTP транзакцией.
+        Адреса получателей передаются только командами RCPT TO, в заголовке To их не видно.
+        Заголовков отписки в письме нет: ссылка отписки у каждого получателя своя(см. is_batchable).
+        """
+        headers = (
+            "To: undisclosed-recipients:;\r\n"
+            f"Date: {formatdate()}\r\n"
+            f"Message-ID: {make_msgid(domain=DNS_NAME)}\r\n"
+        )
+        return self._head + headers.encode("ascii") + self._payload
+
+    def render(self, recipient: str, context: Optional[dict] = None) -> bytes:
+        """
+        Возвращает письмо для одного получателя.
+        :param recipient: Адрес получателя.
+        :param context: Данные получателя для подстановок {'email': ..., 'full_name': ...}(по умолчанию только email).
+        :return: Письмо в виде байтов, готовое к передаче SMTP серверу.
+        """
+        headers = (
+            f"To: {sanitize_address(recipient, self.encoding)}\r\n"
+            f"Date: {formatdate()}\r\n"
+            f"Message-ID: {make_msgid(domain=DNS_NAME)}\r\n"
+        )
+        context = context or {"email": recipient}
+        if self.unsubscribe is not None:
+            url = self.unsubscribe(recipient)
+            headers += f"List-Unsubscribe: <{url}>\r\nList-Unsubscribe-Post: List-Unsubscribe=One-Click\r\n"
+            context = {**context, "unsubscribe_url": url}
+        if self.is_static:
+            return self._head + headers.encode("ascii") + self._payload
+        if not self.subject.is_static:
+            headers += f"Subject: {self._encode_header(self.subject.render(context))}\r\n"
+        payload = self._payload
+        if not self.body.is_static:
+            # строки приводятся к CRLF, тогда и мягкие переносы binascii.b2a_qp получают CRLF
+            text = "\r\n".join(self.body.render(context).splitlines()) + "\r\n"
+            payload = b"\r\n" + binascii.b2a_qp(text.encode(self.encoding), istext=True)
+        return self._head + headers.encode("ascii") + payload
+
+    def _encode_header(self, value: str) -> str:
+        """Кодирует значение заголовка, переводы строк из данных получателя заменяются пробелами."""
+        value = " ".join(value.splitlines())
+        if value.isascii():
+            return value
+        return Header(value, self.encoding).encode(linesep="\r\n")
+
+
+def batch_results(rows: list, refused: Optional[dict] = None, exc_info: Optional[Exception] = None) -> list:
+    """
+    Результаты отправки одного письма нескольким получателям(одна SMTP транзакция).
+    :param rows: Строки получателей транзакции.
+    :param refused: Отклоненные сервером получатели {адрес: (код, ответ)} из sendmail.
+    :param exc_info: Исключение, если транзакция не удалась. SMTPRecipientsRefused раскладывается по получателям,
+                     остальные ошибки относятся ко всем получателям транзакции.
+    :return: Список результатов(DeliveryResult) в порядке строк.
+    """
+    if isinstance(exc_info, smtplib.SMTPRecipientsRefused):
+        refused, exc_info = exc_info.recipients, None
+    if exc_info is not None:
+        answer, code = str(exc_info) or exc_info.__class__.__name__, smtp_error_code(exc_info)
+        return [DeliveryResult.for_row(row, "fail", answer, code) for row in rows]
+    results = []
+    for row in rows:
+        if refused and row["email"] in refused:
+            code, reply = refused[row["email"]]
+            results.append(DeliveryResult.for_row(row, "fail", str((code, reply)), code))
+        else:
+            results.append(DeliveryResult.for_row(row, "success", SUCCESS_ANSWER))
+    return results
+
+
+def build_message(subject: str, body: str, from_email: str, recipient: str) -> bytes:
+    """
+    Формирует письмо для отправки одному получателю.
+    Для рассылки письмо собирается один раз через MessageTemplate.
+    :param subject: Тема письма.
+    :param body: Текст письма.
+    :param from_email: Адрес отправителя.
+    :param recipient: Адрес получателя.
+    :return: Письмо в виде байтов, готовое к передаче SMTP серверу.
+    """
+    return MessageTemplate(subject, body, from_email).render(recipient)
+
+
+@dataclass
+class DeliveryResult:
+    """
+    Результат отправки письма одному получателю
+    Атрибуты:
+        recipient(str): Адрес получателя
+        status(str): Статус попытки ('success' или 'fail', как в SendingAttempt.STATUS_CHOICES)
+        answer(str): Ответ почтового сервера
+        recipient_id(int): ID получателя(Recipient), None если получатель передан только адресом
+        code(int): Код ответа SMTP сервера при ошибке, None если письмо принято или сервер не вернул код
+    """
+
+    recipient: str
+    status: str
+    answer: str
+    recipient_id: Optional[int] = None
+    code: Optional[int] = None
+
+    @classmethod
+    def for_row(cls, row: dict, status: str, answer: str, code: Optional[int] = None) -> "DeliveryResult":
+        """Создает результат для строки получателя {'id': ..., 'email': ...}"""
+        return cls(row["email"], status, answer, row.get("id"), code)
+
+
+@dataclass
+class DeliveryReport:
+    """
+    Итог отправки рассылки
+    Атрибуты:
+        sent(int): Количество успешно отправленных писем
+        failed(int): Количество не отправленных писем
+        stopped(bool): Отправка остановлена до конца списка получателей
+        round_trips_saved(int): Сколько ожиданий ответа SMTP сервера сэкономлено конвейерной отправкой команд
+        paused(float): Сколько секунд отправка стояла из-за недоступности SMTP сервера(автоматический выключатель)
+        relays(dict): Статистика отправки по SMTP серверам группы(EMAIL_RELAYS), пусто - один сервер
+        suppressed(int): Сколько получателей пропущено по списку исключений(входят в failed)
+    """
+
+    sent: int = 0
+    failed: int = 0
+    stopped: bool = False
+    round_trips_saved: int = 0
+    paused: float = 0.0
+    relays: dict = field(default_factory=dict)
+    suppressed: int = 0
+
+    @property
+    def total(self) -> int:
+        """Количество обработанных получателей"""
+        return self.sent + self.failed
+
+    def add(self, result: DeliveryResult) -> None:
+        """Учитывает результат отправки одному получателю"""
+        if result.status == "success":
+            self.sent += 1
+        else:
+            self.failed += 1
+
+    def merge(self, other: "DeliveryReport") -> None:
+        """Добавляет к отчету результаты другого отчета"""
+        self.sent += other.sent
+        self.failed += other.failed
+        self.stopped = self.stopped or other.stopped
+        self.round_trips_saved += other.round_trips_saved
+        self.paused += other.paused
+        self.relays.update(other.relays)
+        self.suppressed += other.suppressed
+
+
+class ThreadedDeliveryEngine:
+    """
+    Движок отправки рассылки, распределяющий получателей по ограниченному пулу потоков.
+    Потоки только отправляют письма, попытки рассылки(SendingAttempt) записываются в основном потоке пачками.
+    Атрибуты:
+        workers(int): Количество потоков отправки
+        queue_size(int): Максимальное количество писем в очереди и в отправке одновременно
+        connection_per_worker(bool): Закрепить за каждым потоком собственное соединение из пула на всю рассылку
+        batch_size(int): Размер пачки для записи попыток рассылки в БД
+        pool(SMTPConnectionPool): Пул SMTP соединений(RelayPool - группа SMTP серверов)
+        rate_limiter(RateLimiter): Ограничитель скорости отправки, None - без ограничения
+        rcpt_batch_size(int): Сколько получателей отправлять одной SMTP транзакцией(RCPT TO), 1 - по одному.
+                              Для писем с подстановками всегда 1
+        circuit_breaker(CircuitBreaker): Автоматический выключатель SMTP сервера пула, None - без выключателя
+    Методы:
+        deliver(self, recipients: Iterable[dict], subject: str, body: str, from_email: str, mailing: Mailing,
+                on_result: Optional[Callable] = None) -> DeliveryReport:
+            Отправляет письмо всем получателям и записывает попытки рассылки.
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        connection_per_worker: Optional[bool] = None,
+        batch_size: Optional[int] = None,
+        pool: Optional[Union[SMTPConnectionPool, RelayPool]] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        rcpt_batch_size: int = 1,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+    ) -> None:
+        if connection_per_worker is None:
+            connection_per_worker = settings.MAILING_CONNECTION_PER_WORKER
+        self.connection_per_worker = connection_per_worker
+        self.pool = pool or get_connection_pool()
+        self.workers = workers or settings.MAILING_WORKERS
+        if self.connection_per_worker:
+            # поток держит соединение всю рассылку, потоков больше чем соединений в пуле ждали бы бесконечно
+            self.workers = min(self.workers, self.pool.size)
+        self.queue_size = max(queue_size or settings.MAILING_QUEUE_SIZE, self.workers)
+        self.batch_size = batch_size or settings.MAILING_ATTEMPTS_BATCH_SIZE
+        self.rate_limiter = rate_limiter
+        self.rcpt_batch_size = max(1, rcpt_batch_size)
+        self.circuit_breaker = circuit_breaker or CircuitBreaker.for_relay(self.pool.name)
+        self._local = threading.local()
+        self._held: list = []
+        self._held_lock = threading.Lock()
+
+    def deliver(
+        self,
+        recipients: Iterable[dict],
+        subject: str,
+        body: str,
+        from_email: str,
+        mailing: Mailing,
+        on_result: Optional[Callable[[DeliveryResult], None]] = None,
+    ) -> DeliveryReport:
+        """
+        Отправляет письмо всем получателям и записывает попытки рассылки.
+        Отправка останавливается, если рассылка отключена(status 'disable'): флаг отмены проверяется
+        раз в MAILING_CANCEL_CHECK_EVERY писем или MAILING_CANCEL_CHECK_INTERVAL секунд, без запроса на каждое письмо.
+        При заданном ограничителе скорости письмо передается в поток только после получения разрешения.
+        При rcpt_batch_size > 1 письмо без подстановок отправляется пачке получателей одной SMTP транзакцией,
+        результат записывается для каждого получателя отдельно.
+        Получатели распределяются по очередям доменов(DomainLanes) с собственными ограничениями, очереди
+        обслуживаются по кругу в пределах окна из MAILING_RECIPIENTS_CHUNK_SIZE прочитанных получателей,
+        окно расширяется, если все домены окна ждут своих ограничений.
+        Пока автоматический выключатель SMTP сервера разомкнут, новые отправки не начинаются(пауза рассылки),
+        после успешных пробных отправок рассылка продолжается.
+        Получателям из списка исключений(Suppression) письмо не отправляется, попытка записывается как неудачная.
+        :param recipients: Строки получателей {'id': ID получателя, 'email': адрес}, QuerySet читается порциями.
+        :param subject: Тема письма.
+        :param body: Текст письма.
+        :param from_email: Адрес отправителя.
+        :param mailing: Модель рассылки, к которой относятся попытки.
+        :param on_result: Функция, вызываемая в основном потоке для каждого результата отправки.
+        :return: Итог отправки рассылки.
+        """
+        report = DeliveryReport()
+        cancellation = CancellationToken(mailing.pk)
+        done: Queue = Queue()
+        slots = threading.BoundedSemaphore(self.queue_size)
+        pending: list = []
+        changed = threading.Event()  # завершилась отправка: у домена освободилось место
+
+        def on_done(lane: DomainLane, batch: list, future: Future) -> None:
+            try:
+                results = future.result()
+            except Exception as exc_info:
+                results = batch_results(batch, exc_info=exc_info)
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.record(results)
+            for result in results:
+                if self.rate_limiter is not None:
+                    self.rate_limiter.record(result.code)
+                done.put(result)
+            lanes.release(lane, results)
+            slots.release()
+            changed.set()
+
+        def on_suppressed(row: dict) -> None:
+            report.suppressed += 1
+            done.put(DeliveryResult.for_row(row, "fail", SUPPRESSED_ANSWER, SUPPRESSED_CODE))
+
+        def dispatch(keep: int) -> None:
+            # отправляет готовые пачки по кругу доменов, пока в очередях больше keep получателей
+            while lanes.buffered > keep:
+                if cancellation.is_cancelled():
+                    report.stopped = True
+                    return
+                changed.clear()
+                paused = self.circuit_breaker.wait_time() if self.circuit_breaker is not None else 0
+                if paused:
+                    # SMTP сервер недоступен: ждем, проверяя отмену рассылки, и записываем готовые результаты
+                    started = time.monotonic()
+                    changed.wait(min(paused, settings.MAILING_CANCEL_CHECK_INTERVAL))
+                    report.paused += time.monotonic() - started
+                    self._collect(done, pending, report, mailing, on_result)
+                    self._flush(pending, mailing)
+                    continue
+                lane, batch, wait = lanes.next_batch()
+                if lane is None:
+                    if keep and lanes.read_ahead():
+                        return  # все домены окна ждут: читаются следующие получатели
+                    changed.wait(wait)
+                    continue
+                slots.acquire()
+                if self.circuit_breaker is not None:
+                    self.circuit_breaker.start()
+                if self.rate_limiter is not None:
+                    for _ in batch:
+                        self.rate_limiter.acquire()
+                future = executor.submit(self._send_batch, template, batch)
+                future.add_done_callback(partial(on_done, lane, batch))
+                self._collect(done, pending, report, mailing, on_result)
+
+        # письмо кодируется один раз на рассылку
+        template = MessageTemplate(
+            subject,
+            body,
+            from_email,
+            headers={MAILING_ID_HEADER: str(mailing.pk)},
+            unsubscribe=unsubscribe_links(mailing.pk),
+        )
+        lanes = DomainLanes(self.rcpt_batch_size if template.is_batchable else 1)
+        saved_before = self.pool.stats.saved  # пул общий для процесса, считается разница за рассылку
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="mailing")
+        try:
+            for row in screen_recipients(stream_recipients(recipients), on_suppressed):
+                lanes.add(row)
+                dispatch(lanes.limit - 1)
+                if report.stopped:
+                    break
+            else:
+                dispatch(0)
+        finally:
+            executor.shutdown(wait=True)
+            self._release_held()
+        self._collect(done, pending, report, mailing, on_result)
+        self._flush(pending, mailing)
+        report.round_trips_saved = self.pool.stats.saved - saved_before
+        if isinstance(self.pool, RelayPool):
+            report.relays = self.pool.relay_stats()
+        return report
+
+    def _send_batch(self, template: MessageTemplate, rows: list) -> list:
+        """
+        Отправляет письмо одному получателю или пачке получателей(одна SMTP транзакция) в потоке пула.
+        :return: Результаты отправки по получателям, исключения SMTP преобразуются в результаты 'fail'.
+        """
+        recipients = [row["email"] for row in rows]
+        try:
+            if len(rows) == 1:
+                message = template.render(recipients[0], rows[0])
+            else:
+                message = template.render_batch()
+            if self.connection_per_worker:
+                refused = self._send_with_worker_connection(template.from_email, recipients, message)
+            else:
+                refused = self.pool.send(template.from_email, recipients, message)
+        except (smtplib.SMTPException, OSError) as exc_info:
+            return batch_results(rows, exc_info=exc_info)
+        return batch_results(rows, refused)
+
+    def _send_with_worker_connection(self, from_email: str, recipients: list, message: bytes) -> dict:
+        """
+        Отправляет письмо через соединение, закрепленное за текущим потоком, с одним переподключением
+        при обрыве соединения до команды DATA.
+        :return: Словарь отклоненных получателей(smtplib.SMTP.sendmail)
+        """
+        for attempt in range(2):
+            connection = self._worker_connection()
+            try:
+                return connection.sendmail(from_email, recipients, message)
+            except smtplib.SMTPServerDisconnected as exc_info:
+                self._drop_worker_connection(connection)
+                if attempt or isinstance(exc_info, SMTPDataDisconnected):
+                    raise
+            except smtplib.SMTPException:
+                raise
+            except OSError:
+                self._drop_worker_connection(connection)
+                raise
+
+    def _worker_connection(self) -> PooledSMTPConnection:
+        """Возвращает соединение текущего потока, при первом обращении берет его из пула."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self.pool.acquire()
+            self._local.connection = connection
+            with self._held_lock:
+                self._held.append(connection)
+        return connection
+
+    def _drop_worker_connection(self, connection: PooledSMTPConnection) -> None:
+        """Закрывает оборванное соединение текущего потока и возвращает место в пул."""
+        self._local.connection = None
+        with self._held_lock:
+            self._held.remove(connection)
+        self.pool.release(connection, discard=True)
+
+    def _release_held(self) -> None:
+        """Возвращает в пул соединения, закрепленные за потоками."""
+        with self._held_lock:
+            held, self._held = self._held, []
+        for connection in held:
+            self.pool.release(connection)
+        self._local = threading.local()
+
+    def _collect(
+        self,
+        done: Queue,
+        pending: list,
+        report: DeliveryReport,
+        mailing: Mailing,
+        on_result: Optional[Callable[[DeliveryResult], None]],
+    ) -> None:
+        """Забирает готовые результаты из потоков и записывает их пачками."""
+        while True:
+            try:
+                result = done.get_nowait()
+            except Empty:
+                break
+            report.add(result)
+            pending.append(result)
+            if on_result is not None:
+                on_result(result)
+            if len(pending) >= self.batch_size:
+                self._flush(pending, mailing)
+
+    @staticmethod
+    def _flush(pending: list, mailing: Mailing) -> None:
+        """
+        Записывает накопленные результаты в журнал доставки(SendingAttempt) одним запросом.
+        Каждая запись - контрольная точка для продолжения рассылки после сбоя.
+        Получателям с временной ошибкой SMTP сервера планируется повторная отправка.
+        Пачка учитывается в счетчиках рассылки и счетчиках прогресса.
+        """
+        if not pending:
+            return
+        save_attempts(pending, mailing)
+        schedule_retries(pending, mailing)
+        record_progress(mailing.pk, pending)
+        pending.clear()
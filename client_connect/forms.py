@@ -1,6 +1,8 @@
 from django import forms
+from django.utils import timezone
 
 from .models import Mailing, Message, Recipient
+from .personalization import PLACEHOLDER_FIELDS, unknown_placeholders
 
 
 class RecipientForm(forms.ModelForm):
@@ -31,6 +33,9 @@ class MessageForm(forms.ModelForm):
     Методы __init__(self, *args, **kwargs) -> None:
         Инициализация стилизации форм:
         - стилизация полей: subject, body
+        - подсказка о подстановках данных получателя: {{ email }}, {{ full_name }}, {{ unsubscribe_url }}
+    Методы clean_subject(self) -> str, clean_body(self) -> str:
+        Проверка, что в теме и тексте используются только известные подстановки
     """
 
     class Meta:
@@ -42,15 +47,42 @@ class MessageForm(forms.ModelForm):
         super().__init__(*args, **kwargs)
         self.fields["subject"].widget.attrs.update({"class": "form-control", "placeholder": "Введите тему"})
         self.fields["body"].widget.attrs.update({"class": "form-control", "placeholder": "Введите сообщение"})
+        placeholders = ", ".join("{{ %s }}" % field for field in PLACEHOLDER_FIELDS)
+        self.fields["body"].help_text = f"Данные получателя подставляются в тему и текст: {placeholders}"
+
+    def clean_subject(self) -> str:
+        """Проверка, что в теме используются только известные подстановки"""
+        return self._check_placeholders(self.cleaned_data.get("subject"))
+
+    def clean_body(self) -> str:
+        """Проверка, что в тексте используются только известные подстановки"""
+        return self._check_placeholders(self.cleaned_data.get("body"))
+
+    @staticmethod
+    def _check_placeholders(text: str) -> str:
+        """
+        Проверяет подстановки в тексте.
+        :raise forms.ValidationError: Если в тексте есть неизвестные подстановки.
+        """
+        unknown = unknown_placeholders(text)
+        if unknown:
+            raise forms.ValidationError(f"Неизвестные подстановки: {', '.join(unknown)}")
+        return text
 
 
 class MailingForm(forms.ModelForm):
     """
     Форма для создания и редактирования рассылки.
-    Включает поля: сообщение(message), получатели(recipients)
+    Включает поля: сообщение(message), получатели(recipients), ограничение писем в секунду(rate_limit),
+    пакетная отправка(batch_send), время запуска по расписанию(start_time), повтор(repeat)
     Методы __init__(self, *args, **kwargs) -> None:
         Инициализация стилизации форм:
-        - стилизация полей: message, recipients
+        - стилизация полей: message, recipients, rate_limit, batch_send, start_time, repeat
+    Методы clean(self) -> dict:
+        Проверка расписания: новое время запуска в будущем, повтор только вместе со временем запуска
+    Методы save(self, commit: bool = True) -> Mailing:
+        Сохранение рассылки, при изменении расписания статус 'scheduled'(запланирована) или 'created',
+        счетчики и аренда отправки не сохраняются
     """
 
     class Meta:
@@ -58,9 +90,61 @@ class MailingForm(forms.ModelForm):
         fields = (
             "message",
             "recipients",
+            "rate_limit",
+            "batch_send",
+            "start_time",
+            "repeat",
         )
+        widgets = {
+            "start_time": forms.DateTimeInput(attrs={"type": "datetime-local", "step": 1}, format="%Y-%m-%dT%H:%M:%S"),
+        }
 
     def __init__(self, *args, **kwargs):
         """Инициализация стилизации форм"""
         super().__init__(*args, **kwargs)
         self.fields["message"].widget.attrs.update({"class": "form-select"})
+        self.fields["rate_limit"].widget.attrs.update({"class": "form-control"})
+        self.fields["batch_send"].widget.attrs.update({"class": "form-check-input"})
+        self.fields["start_time"].widget.attrs.update({"class": "form-control"})
+        self.fields["start_time"].label = "Запуск по расписанию"
+        self.fields["start_time"].help_text = "Пусто - рассылка запускается вручную"
+        self.fields["repeat"].widget.attrs.update({"class": "form-select"})
+
+    def clean(self) -> dict:
+        """
+        Проверка расписания: новое время запуска в будущем, повтор только вместе со временем запуска
+        :raise forms.ValidationError: Если время запуска в прошлом или повтор указан без времени запуска.
+        """
+        cleaned_data = super().clean()
+        start_time = cleaned_data.get("start_time")
+        schedule_changed = "start_time" in self.changed_data or "repeat" in self.changed_data
+        if schedule_changed and start_time and start_time <= timezone.now():
+            self.add_error("start_time", "Время запуска должно быть в будущем")
+        if cleaned_data.get("repeat") and not start_time:
+            self.add_error("repeat", "Для повтора укажите время запуска")
+        return cleaned_data
+
+    def save(self, commit: bool = True) -> Mailing:
+        """
+        Сохранение рассылки, при изменении расписания статус 'scheduled'(запланирована) или 'created'.
+        Существующая рассылка сохраняется только по полям формы(Mailing.settings_fields), статус - только
+        при изменении расписания: статус, счетчики и аренда идущей отправки не перезаписываются.
+        :param commit: Сохранить рассылку в БД.
+        :return: Рассылка.
+        """
+        adding = self.instance._state.adding
+        mailing = super().save(commit=False)
+        fields = list(self.cleaned_data)
+        if "start_time" in self.changed_data or "repeat" in self.changed_data:
+            fields.append("status")
+            if mailing.start_time and mailing.start_time > timezone.now():
+                mailing.status = "scheduled"
+            elif mailing.status == "scheduled":
+                mailing.status = "created"
+        if commit:
+            if adding:
+                mailing.save()
+            else:
+                mailing.save(update_fields=Mailing.settings_fields(fields))
+            self.save_m2m()  # количество получателей(total_count) пересчитывается по сигналу m2m_changed
+        return mailing
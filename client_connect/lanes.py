@@ -0,0 +1,192 @@
+import threading
+from collections import deque
+from typing import Optional
+
+from client_connect.rate_limit import RateLimiter, TokenBucket
+from config import settings
+
+
+def recipient_domain(email: str) -> str:
+    """
+    Возвращает домен адреса получателя в нижнем регистре.
+    :param email: Адрес получателя.
+    :return: Домен, пустая строка для адреса без '@'.
+    """
+    return email.rpartition("@")[2].lower()
+
+
+def parse_domain_limits(value: Optional[str]) -> dict:
+    """
+    Разбирает ограничения отдельных доменов из строки вида 'gmail.com=10/5,mail.ru=4/1'
+    (домен=одновременных отправок/писем в секунду, 0 - без ограничения).
+    :param value: Строка настройки MAILING_DOMAIN_LIMITS.
+    :return: Словарь {домен: (одновременных отправок, писем в секунду)}.
+    :raise ValueError: Если строка записана с ошибкой.
+    """
+    limits = {}
+    for item in (value or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        domain, _, limit = item.partition("=")
+        concurrency, _, rate = limit.partition("/")
+        try:
+            limits[domain.strip().lower()] = (int(concurrency or 0), float(rate or 0))
+        except ValueError:
+            raise ValueError(f"Неверное ограничение домена в MAILING_DOMAIN_LIMITS: {item}")
+    return limits
+
+
+class DomainLane:
+    """
+    Очередь получателей одного домена со своими ограничениями одновременных отправок и скорости
+    Атрибуты:
+        domain(str): Домен получателей
+        concurrency(int): Максимальное количество одновременных отправок на домен, 0 - без ограничения
+        bucket(TokenBucket): Корзина токенов домена(писем в секунду), None - без ограничения
+        limiter(RateLimiter): Адаптация скорости домена по ответам сервера, None - без ограничения
+        rows(deque): Ожидающие отправки получатели
+        active(int): Количество отправок на домен, выполняющихся сейчас
+    Методы:
+        is_busy(self) -> bool:
+            Достигнуто ли ограничение одновременных отправок на домен.
+    """
+
+    def __init__(self, domain: str, concurrency: int = 0, bucket: Optional[TokenBucket] = None) -> None:
+        self.domain = domain
+        self.concurrency = concurrency
+        self.bucket = bucket
+        self.limiter = RateLimiter([bucket]) if bucket is not None else None
+        self.rows: deque = deque()
+        self.active = 0
+
+    def is_busy(self) -> bool:
+        """Достигнуто ли ограничение одновременных отправок на домен."""
+        return bool(self.concurrency) and self.active >= self.concurrency
+
+
+class DomainLanes:
+    """
+    Получатели рассылки, разделенные по доменам: у каждого домена своя очередь(DomainLane)
+    с ограничениями, очереди обслуживаются по кругу. Домен, упершийся в свои ограничения, пропускается,
+    поэтому медленный почтовый сервис не задерживает отправку остальным доменам.
+    Движки читают получателей в очереди окном из window получателей. Если окно заполнил домен, упершийся
+    в ограничения(все домены окна ждут), окно расширяется(read_ahead), чтобы получатели других доменов
+    не ждали отправки этому домену; в очередях при этом не больше max_buffered получателей.
+    Атрибуты:
+        batch_size(int): Максимальное количество получателей в одной отправке(одна SMTP транзакция)
+        concurrency(int): Одновременных отправок на домен по умолчанию(MAILING_DOMAIN_CONCURRENCY)
+        rate(float): Писем в секунду на домен по умолчанию(MAILING_DOMAIN_RATE_LIMIT)
+        limits(dict): Ограничения отдельных доменов {домен: (одновременных отправок, писем в секунду)}
+        window(int): Окно прочитанных получателей(MAILING_RECIPIENTS_CHUNK_SIZE)
+        max_buffered(int): Наибольшее окно, когда все домены ждут(MAILING_DOMAIN_BUFFER_SIZE)
+        limit(int): Текущее окно: сколько получателей читать в очереди до отправки
+        buffered(int): Количество получателей, ожидающих отправки во всех очередях
+    Методы:
+        add(self, row: dict) -> None:
+            Ставит получателя в очередь его домена.
+        next_batch(self) -> tuple:
+            Выбирает следующую отправку по кругу доменов.
+        read_ahead(self) -> bool:
+            Расширяет окно прочитанных получателей, когда все домены окна ждут.
+        release(self, lane: DomainLane, results: list) -> None:
+            Освобождает место отправки домена и учитывает ответы сервера для скорости домена.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = 1,
+        concurrency: Optional[int] = None,
+        rate: Optional[float] = None,
+        limits: Optional[dict] = None,
+        window: Optional[int] = None,
+        max_buffered: Optional[int] = None,
+    ) -> None:
+        self.batch_size = max(1, batch_size)
+        self.concurrency = settings.MAILING_DOMAIN_CONCURRENCY if concurrency is None else concurrency
+        self.rate = settings.MAILING_DOMAIN_RATE_LIMIT if rate is None else rate
+        self.limits = parse_domain_limits(settings.MAILING_DOMAIN_LIMITS) if limits is None else limits
+        self.window = max(1, window or settings.MAILING_RECIPIENTS_CHUNK_SIZE)
+        self.max_buffered = max(self.window, max_buffered or settings.MAILING_DOMAIN_BUFFER_SIZE)
+        self.limit = self.window
+        self.buffered = 0
+        self._lanes: dict = {}
+        self._ring: deque = deque()  # домены с ожидающими получателями в порядке обхода
+        self._lock = threading.Lock()
+
+    def add(self, row: dict) -> None:
+        """
+        Ставит получателя в очередь его домена.
+        :param row: Строка получателя {'id': ID получателя, 'email': адрес}.
+        """
+        domain = recipient_domain(row["email"])
+        with self._lock:
+            lane = self._lanes.get(domain)
+            if lane is None:
+                lane = self._lanes[domain] = self._make_lane(domain)
+            if not lane.rows:
+                self._ring.append(lane)
+            lane.rows.append(row)
+            self.buffered += 1
+
+    def next_batch(self) -> tuple:
+        """
+        Выбирает следующую отправку по кругу доменов: домен с занятыми местами отправки
+        или без токена в корзине пропускается.
+        :return: (очередь домена, получатели, None) или (None, [], сколько секунд ждать токена), если ни один
+                 домен не готов. Время ожидания None - домены ждут завершения своих отправок.
+        """
+        wait = None
+        with self._lock:
+            for _ in range(len(self._ring)):
+                lane = self._ring[0]
+                self._ring.rotate(-1)
+                if lane.is_busy():
+                    continue
+                if lane.bucket is not None:
+                    lane_wait = lane.bucket.take()
+                    if lane_wait:
+                        wait = lane_wait if wait is None else min(wait, lane_wait)
+                        continue
+                count = min(self.batch_size, len(lane.rows))
+                batch = [lane.rows.popleft() for _ in range(count)]
+                if not lane.rows:
+                    self._ring.pop()
+                lane.active += 1
+                self.buffered -= count
+                if self.buffered < self.window:
+                    self.limit = self.window
+                return lane, batch, None
+        return None, [], wait
+
+    def read_ahead(self) -> bool:
+        """
+        Расширяет окно прочитанных получателей на window, когда все домены окна ждут(next_batch не выбрал отправку):
+        получатели других доменов дальше по списку отправляются, не дожидаясь занятого домена.
+        Окно возвращается к window, когда в очередях остается меньше window получателей.
+        :return: True - окно расширено, читать следующих получателей; False - окно уже max_buffered, ждать домены.
+        """
+        with self._lock:
+            if self.limit >= self.max_buffered:
+                return False
+            self.limit = min(self.max_buffered, self.limit + self.window)
+            return True
+
+    def release(self, lane: DomainLane, results: list) -> None:
+        """
+        Освобождает место отправки домена и учитывает ответы сервера для скорости домена:
+        отложенная доставка(4xx) снижает скорость только этого домена.
+        :param lane: Очередь домена, из которой была отправка.
+        :param results: Результаты отправки(DeliveryResult).
+        """
+        with self._lock:
+            lane.active -= 1
+        if lane.limiter is not None:
+            for result in results:
+                lane.limiter.record(result.code)
+
+    def _make_lane(self, domain: str) -> DomainLane:
+        """Создает очередь домена с ограничениями из MAILING_DOMAIN_LIMITS или ограничениями по умолчанию."""
+        concurrency, rate = self.limits.get(domain, (self.concurrency, self.rate))
+        bucket = RateLimiter.get_bucket(f"domain:{domain}", rate) if rate else None
+        return DomainLane(domain, concurrency, bucket)
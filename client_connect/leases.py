@@ -0,0 +1,188 @@
+import os
+import socket
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Iterator, Optional
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from client_connect.cancellation import cancel_local, clear_local_cancel
+from client_connect.models import Mailing
+from config import settings
+
+
+class MailingLeaseError(Exception):
+    """Рассылку отправляет другой исполнитель, либо аренда рассылки потеряна во время отправки."""
+
+
+@dataclass
+class Lease:
+    """
+    Аренда рассылки исполнителем: пока аренда действует, рассылку не отправляет никто другой
+    Атрибуты:
+        mailing_pk(int): ID рассылки
+        owner(str): Исполнитель
+        ttl(float): Срок аренды в секундах
+        expires_at(datetime): Время окончания аренды
+        taken_over(bool): Аренда забрана у другого исполнителя после истечения срока(рассылка прервана)
+    """
+
+    mailing_pk: int
+    owner: str
+    ttl: float
+    expires_at: datetime
+    taken_over: bool = False
+
+
+def lease_owner_name() -> str:
+    """Имя исполнителя по умолчанию: <хост>-<pid>."""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def lease_available(owner: str, now: datetime, prefix: str = "") -> Q:
+    """
+    Условие свободной для исполнителя аренды: рассылка свободна, аренда истекла или принадлежит исполнителю.
+    :param owner: Исполнитель.
+    :param now: Текущее время.
+    :param prefix: Путь к рассылке в запросе(например 'mailing__').
+    """
+    return (
+        Q(**{f"{prefix}lease_owner": ""})
+        | Q(**{f"{prefix}lease_owner": owner})
+        | Q(**{f"{prefix}lease_expires_at__lt": now})
+    )
+
+
+def acquire_lease(mailing_pk: int, owner: str, ttl: Optional[float] = None) -> Optional[Lease]:
+    """
+    Забирает аренду рассылки. Строка рассылки блокируется через SELECT ... FOR UPDATE SKIP LOCKED, поэтому
+    из нескольких исполнителей аренду получит один, остальные не ждут блокировки.
+    :param mailing_pk: ID рассылки.
+    :param owner: Исполнитель.
+    :param ttl: Срок аренды в секундах(по умолчанию MAILING_LEASE_TTL).
+    :return: Аренда, либо None, если рассылку отправляет другой исполнитель.
+    """
+    ttl = ttl or settings.MAILING_LEASE_TTL
+    now = timezone.now()
+    with transaction.atomic():
+        previous = (
+            Mailing.objects.select_for_update(skip_locked=True)
+            .filter(lease_available(owner, now), pk=mailing_pk)
+            .values_list("lease_owner", flat=True)
+            .first()
+        )
+        if previous is None:
+            return None
+        lease = Lease(mailing_pk, owner, ttl, now + timedelta(seconds=ttl), taken_over=previous not in ("", owner))
+        Mailing.objects.filter(pk=mailing_pk).update(lease_owner=owner, lease_expires_at=lease.expires_at)
+    return lease
+
+
+def renew_lease(lease: Lease) -> bool:
+    """
+    Продлевает аренду рассылки на срок ttl.
+    :param lease: Аренда.
+    :return: False, если аренду забрал другой исполнитель.
+    """
+    expires_at = timezone.now() + timedelta(seconds=lease.ttl)
+    renewed = Mailing.objects.filter(pk=lease.mailing_pk, lease_owner=lease.owner).update(lease_expires_at=expires_at)
+    if renewed:
+        lease.expires_at = expires_at
+    return bool(renewed)
+
+
+def release_lease(lease: Lease) -> None:
+    """
+    Освобождает аренду рассылки, если она еще принадлежит исполнителю.
+    :param lease: Аренда.
+    """
+    Mailing.objects.filter(pk=lease.mailing_pk, lease_owner=lease.owner).update(lease_owner="", lease_expires_at=None)
+
+
+def lease_holder(mailing_pk: int) -> str:
+    """Исполнитель, который отправляет рассылку."""
+    return Mailing.objects.filter(pk=mailing_pk).values_list("lease_owner", flat=True).first() or ""
+
+
+class LeaseHeartbeat:
+    """
+    Фоновый поток продления аренды рассылки: продлевает аренду каждую треть срока.
+    Если аренду забрал другой исполнитель(продление не успело до истечения срока), отправка рассылки
+    в текущем процессе останавливается через флаг отмены(cancel_local).
+    Атрибуты:
+        lease(Lease): Аренда рассылки
+        interval(float): Через сколько секунд продлевать аренду
+        lost(bool): Аренда потеряна
+    Методы:
+        start(self) -> None:
+            Запускает поток продления аренды.
+        stop(self) -> None:
+            Останавливает поток продления аренды.
+    """
+
+    def __init__(self, lease: Lease, interval: Optional[float] = None) -> None:
+        self.lease = lease
+        self.interval = interval or lease.ttl / 3
+        self.lost = False
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "LeaseHeartbeat":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        """Запускает поток продления аренды."""
+        clear_local_cancel(self.lease.mailing_pk)
+        self._thread = threading.Thread(target=self._run, name=f"lease-{self.lease.mailing_pk}", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Останавливает поток продления аренды."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        clear_local_cancel(self.lease.mailing_pk)
+
+    def _run(self) -> None:
+        """Продлевает аренду, пока поток не остановлен или аренда не потеряна."""
+        try:
+            while not self._stopped.wait(self.interval):
+                if not renew_lease(self.lease):
+                    self.lost = True
+                    cancel_local(self.lease.mailing_pk)
+                    break
+        finally:
+            connection.close()  # соединение с БД потока продления
+
+
+@contextmanager
+def mailing_lease(mailing_pk: int, owner: Optional[str] = None, ttl: Optional[float] = None) -> Iterator[Lease]:
+    """
+    Держит аренду рассылки на время отправки: забирает аренду, продлевает ее в фоновом потоке
+    и освобождает после отправки.
+    :param mailing_pk: ID рассылки.
+    :param owner: Исполнитель(по умолчанию <хост>-<pid>).
+    :param ttl: Срок аренды в секундах(по умолчанию MAILING_LEASE_TTL).
+    :raise MailingLeaseError: Если рассылку отправляет другой исполнитель, либо аренда потеряна во время отправки.
+    """
+    lease = acquire_lease(mailing_pk, owner or lease_owner_name(), ttl)
+    if lease is None:
+        raise MailingLeaseError(
+            f"Рассылку с ID {mailing_pk} отправляет другой исполнитель: {lease_holder(mailing_pk)}"
+        )
+    heartbeat = LeaseHeartbeat(lease)
+    try:
+        with heartbeat:
+            yield lease
+    finally:
+        release_lease(lease)
+    if heartbeat.lost:
+        raise MailingLeaseError(f"Аренда рассылки с ID {mailing_pk} потеряна, отправку продолжит другой исполнитель")
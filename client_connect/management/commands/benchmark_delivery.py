@@ -0,0 +1,173 @@
+import math
+import time
+import tracemalloc
+from contextlib import ExitStack
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from client_connect.management.commands.run_smtp_sink import add_sink_arguments, sink_options
+from client_connect.models import DeliveryRetry, Mailing, Message, Recipient, SendingAttempt
+from client_connect.services import MailingService
+from client_connect.smtp_sink import SMTPSink, use_sink
+
+BENCHMARK_DOMAIN = "sink.test"
+
+
+def percentile(values: list, percent: float) -> float:
+    """
+    Возвращает перцентиль выборки(метод ближайшего ранга).
+    :param values: Значения выборки.
+    :param percent: Перцентиль от 0 до 100.
+    :return: Значение перцентиля, 0 для пустой выборки.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(len(ordered) * percent / 100))
+    return ordered[rank - 1]
+
+
+class Command(BaseCommand):
+    """
+    Команда измеряет скорость отправки рассылки от начала до конца: БД, движок отправки, SMTP соединения
+    и журнал попыток, через локальный тестовый SMTP сервер(SMTPSink) с заданной задержкой и ошибками
+    Методы:
+        add_arguments(self, parser):
+            Добавляет аргументы команды.
+        handle(self, *args, **options) -> None:
+            Создает тестовую рассылку, замеряет отправку каждым движком и удаляет тестовые данные.
+        create_mailing(self, count: int, body_size: int, batch_send: bool) -> Mailing:
+            Создает сообщение, получателей и рассылку для замера.
+        measure(self, sinks: list, mailing: Mailing, engine: str, count: int) -> None:
+            Замеряет скорость, задержку и память отправки рассылки движком и выводит результат.
+        clear_results(mailing: Mailing) -> None:
+            Удаляет результаты предыдущего прохода.
+    """
+
+    help = "Замер скорости отправки рассылки через тестовый SMTP сервер: писем в секунду, задержка p50/p99, память"
+
+    def add_arguments(self, parser):
+        """Добавляет аргументы команды."""
+        parser.add_argument(
+            "--recipients", type=int, default=10000, help="Количество получателей (по умолчанию 10000)"
+        )
+        parser.add_argument(
+            "--engine",
+            choices=list(MailingService.ENGINES),
+            action="append",
+            help="Движок отправки, можно указать несколько раз (по умолчанию все движки)",
+        )
+        parser.add_argument(
+            "--body-size", type=int, default=2000, help="Длина текста письма в символах (по умолчанию 2000)"
+        )
+        parser.add_argument(
+            "--batch-send", action="store_true", help="Пакетная отправка: несколько получателей в одном письме"
+        )
+        parser.add_argument(
+            "--relays",
+            type=int,
+            default=1,
+            help="Количество тестовых SMTP серверов: больше 1 - отправка через группу серверов (по умолчанию 1)",
+        )
+        add_sink_arguments(parser)
+
+    def handle(self, *args, **options) -> None:
+        """Создает тестовую рассылку, замеряет отправку каждым движком и удаляет тестовые данные."""
+
+        count = max(1, options["recipients"])
+        engines = options["engine"] or list(MailingService.ENGINES)
+        mailing = self.create_mailing(count, options["body_size"], options["batch_send"])
+        self.stdout.write(
+            f"Получателей: {count}, задержка сервера: {options['latency'] * 1000:.0f} мс, "
+            f"пакетная отправка: {'да' if options['batch_send'] else 'нет'}, "
+            f"SMTP серверов: {max(1, options['relays'])}"
+        )
+        try:
+            with ExitStack() as stack:
+                sinks = [
+                    stack.enter_context(SMTPSink(**sink_options(options))) for _ in range(max(1, options["relays"]))
+                ]
+                stack.enter_context(use_sink(*sinks))
+                for engine in engines:
+                    self.measure(sinks, mailing, engine, count)
+        finally:
+            mailing.message.delete()
+            Recipient.objects.filter(email__endswith=f"@{BENCHMARK_DOMAIN}", owner=None).delete()
+
+    def create_mailing(self, count: int, body_size: int, batch_send: bool) -> Mailing:
+        """Создает сообщение, получателей и рассылку для замера."""
+        text = ("Текст письма рассылки на русском языке. " * (body_size // 40 + 1))[:body_size]
+        message = Message.objects.create(subject="Замер скорости отправки", body=text)
+        Recipient.objects.bulk_create(
+            (
+                Recipient(email=f"bench-{number}@{BENCHMARK_DOMAIN}", full_name=f"Получатель {number}")
+                for number in range(count)
+            ),
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+        mailing = Mailing.objects.create(message=message, batch_send=batch_send)
+        recipients = Recipient.objects.filter(email__startswith="bench-", email__endswith=f"@{BENCHMARK_DOMAIN}")
+        mailing.recipients.through.objects.bulk_create(
+            (
+                mailing.recipients.through(mailing_id=mailing.pk, recipient_id=pk)
+                for pk in recipients.values_list("pk", flat=True)[:count]
+            ),
+            batch_size=1000,
+        )
+        return mailing
+
+    def measure(self, sinks: list, mailing: Mailing, engine: str, count: int) -> None:
+        """
+        Замеряет скорость, задержку и память отправки рассылки движком и выводит результат.
+        Время и память замеряются разными проходами: отслеживание памяти замедляет отправку.
+        """
+        self.clear_results(mailing)
+        for sink in sinks:
+            sink.reset_stats()
+        started = time.perf_counter()
+        report = MailingService.send_messages(
+            recipients=MailingService.get_recipients(mailing), message=mailing.message, mailing=mailing, engine=engine
+        )
+        elapsed = time.perf_counter() - started
+        latencies = [latency for sink in sinks for latency in sink.stats.latencies]
+
+        self.clear_results(mailing)
+        tracemalloc.start()
+        MailingService.send_messages(
+            recipients=MailingService.get_recipients(mailing), message=mailing.message, mailing=mailing, engine=engine
+        )
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        self.clear_results(mailing)
+        command_started = time.perf_counter()
+        call_command("send_mailing", mailing.pk, engine=engine, stdout=StringIO())
+        command_elapsed = time.perf_counter() - command_started
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{engine}: {report.sent / elapsed:.0f} писем в секунду, "
+                f"задержка p50 {percentile(latencies, 50) * 1000:.1f} мс, "
+                f"p99 {percentile(latencies, 99) * 1000:.1f} мс, "
+                f"пик памяти {peak * 10000 / count / 1024 / 1024:.1f} МБ на 10000 получателей"
+            )
+        )
+        self.stdout.write(
+            f"{engine}: отправлено {report.sent}, не отправлено {report.failed}, "
+            f"команда send_mailing: {count / command_elapsed:.0f} писем в секунду"
+        )
+        for name, stats in report.relays.items():
+            self.stdout.write(
+                f"{engine}: SMTP сервер {name}: отправлено {stats['sent']}, ошибок сервера {stats['errors']}, "
+                f"задержка {stats['latency'] * 1000:.1f} мс"
+            )
+
+    @staticmethod
+    def clear_results(mailing: Mailing) -> None:
+        """Удаляет результаты предыдущего прохода."""
+        SendingAttempt.objects.filter(mailing=mailing).delete()
+        DeliveryRetry.objects.filter(mailing=mailing).delete()
+        Mailing.objects.filter(pk=mailing.pk).update(sent_count=0, failed_count=0, last_attempt_at=None)
@@ -0,0 +1,72 @@
+import time
+import tracemalloc
+from typing import Callable, Iterable
+
+from django.core.management.base import BaseCommand
+
+from client_connect.delivery import MessageTemplate
+from config import settings
+
+
+class Command(BaseCommand):
+    """
+    Команда измеряет затраты на формирование письма одному получателю, без отправки и без БД
+    Методы:
+        add_arguments(self, parser):
+            Добавляет аргументы команды.
+        handle(self, *args, **options) -> None:
+            Формирует письма для заданного количества получателей и выводит время и память на письмо.
+        measure(self, name: str, render: Callable, rows: Callable[[], Iterable[dict]]) -> None:
+            Измеряет время и пиковую память формирования писем и выводит результат.
+    """
+
+    help = "Замер времени формирования письма получателю: без подстановок и с подстановками данных получателя"
+
+    def add_arguments(self, parser):
+        """Добавляет аргументы команды."""
+        parser.add_argument("--recipients", type=int, default=10000, help="Количество писем (по умолчанию 10000)")
+        parser.add_argument(
+            "--body-size", type=int, default=2000, help="Длина текста письма в символах (по умолчанию 2000)"
+        )
+
+    def handle(self, *args, **options) -> None:
+        """Формирует письма для заданного количества получателей и выводит время и память на письмо."""
+
+        count = max(1, options["recipients"])
+        text = ("Текст письма рассылки на русском языке. " * (options["body_size"] // 40 + 1))[: options["body_size"]]
+        from_email = settings.DEFAULT_FROM_EMAIL or "from@example.com"
+        static = MessageTemplate("Новости рассылки", text, from_email)
+        personalized = MessageTemplate(
+            "Новости для {{ full_name }}", "Здравствуйте, {{ full_name }}!\n" + text + "\n{{ email }}", from_email
+        )
+
+        def rows():
+            for number in range(count):
+                yield {"id": number, "email": f"user{number}@example.com", "full_name": f"Получатель {number}"}
+
+        self.stdout.write(f"Писем: {count}, длина текста: {len(text)} символов")
+        self.measure("Без подстановок", lambda row: static.render(row["email"], row), rows)
+        self.measure("С подстановками", lambda row: personalized.render(row["email"], row), rows)
+
+    def measure(self, name: str, render: Callable, rows: Callable[[], Iterable[dict]]) -> None:
+        """
+        Измеряет время и пиковую память формирования писем и выводит результат.
+        Время и память замеряются разными проходами: отслеживание памяти замедляет формирование писем.
+        """
+        count = 0
+        started = time.perf_counter()
+        for row in rows():
+            render(row)
+            count += 1
+        elapsed = time.perf_counter() - started
+        tracemalloc.start()
+        for row in rows():
+            render(row)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{name}: {elapsed / count * 1_000_000:.1f} мкс на письмо, "
+                f"{count / elapsed:.0f} писем в секунду, пик памяти {peak / 1024:.0f} КБ"
+            )
+        )
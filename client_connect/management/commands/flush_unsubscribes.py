@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from client_connect.unsubscribe import UnsubscribeBuffer
+
+
+class Command(BaseCommand):
+    """
+    Команда записывает буфер отписок(UnsubscribeBuffer) в список исключений: например из cron, если исполнитель
+    run_mail_worker не запущен
+    Методы:
+        handle(self, *args, **options) -> None:
+            Записывает все отписки из буфера, включая оставшиеся после неудачной записи.
+    """
+
+    help = "Записывает буфер отписок в список исключений"
+
+    def handle(self, *args, **options) -> None:
+        """Записывает все отписки из буфера, включая оставшиеся после неудачной записи."""
+        flushed = UnsubscribeBuffer.flush()
+        self.stdout.write(self.style.SUCCESS(f"Записано отписок в список исключений: {flushed}"))
@@ -0,0 +1,50 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from client_connect.bounces import MAILBOX_FORMATS, ingest_mailbox
+
+
+class Command(BaseCommand):
+    """
+    Команда читает почтовый ящик возвратов(mbox или Maildir) с уведомлениями о доставке(DSN) и переносит их
+    в систему: результаты доставки рассылок, счетчики рассылок и список исключений.
+    Повторный запуск на том же ящике ничего не меняет: обработанные уведомления пропускаются
+    Методы:
+        add_arguments(self, parser):
+            Добавляет аргументы команды.
+        handle(self, *args, **options) -> None:
+            Обрабатывает почтовый ящик и выводит итоги.
+    """
+
+    help = "Обработка уведомлений о недоставке(DSN) из почтового ящика mbox или Maildir"
+
+    def add_arguments(self, parser):
+        """Добавляет аргументы команды."""
+        parser.add_argument("path", help="Путь к файлу mbox или каталогу Maildir")
+        parser.add_argument(
+            "--format",
+            choices=MAILBOX_FORMATS,
+            default="auto",
+            help="Формат ящика (по умолчанию auto: каталог - Maildir, файл - mbox)",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=1000, help="Размер пачки уведомлений для записи в БД (по умолчанию 1000)"
+        )
+
+    def handle(self, *args, **options) -> None:
+        """Обрабатывает почтовый ящик и выводит итоги."""
+        path = options["path"]
+        if not os.path.exists(path):
+            raise CommandError(f"Почтовый ящик {path} не найден")
+        totals = ingest_mailbox(path, options["format"], max(1, options["batch_size"]))
+        self.stdout.write(
+            f"Писем: {totals['messages']}, без уведомления о доставке: {totals['skipped']}, "
+            f"уведомлений по получателям: {totals['records']}, новых: {totals['new']}"
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Изменено результатов доставки: {totals['updated']}, "
+                f"адресов добавлено в список исключений: {totals['suppressed']}"
+            )
+        )
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from client_connect.models import Mailing
+from client_connect.services import MailingService
+
+
+class Command(BaseCommand):
+    """
+    Команда пересчитывает счетчики рассылок(получателей, отправлено, не отправлено, последняя попытка)
+    по журналу доставки: после миграции, ручной правки журнала или сбоя
+    Методы:
+        add_arguments(self, parser):
+            Добавляет аргументы команды.
+        handle(self, *args, **options) -> None:
+            Пересчитывает счетчики рассылок, кроме отправляемых в данный момент.
+    """
+
+    help = "Пересчитывает счетчики рассылок по журналу доставки"
+
+    def add_arguments(self, parser):
+        """Добавляет аргументы команды."""
+        parser.add_argument("mailing_ids", nargs="*", type=int, help="ID рассылок (по умолчанию все рассылки)")
+        parser.add_argument(
+            "--force", action="store_true", help="Пересчитать и рассылки, которые отправляются в данный момент"
+        )
+
+    def handle(self, *args, **options) -> None:
+        """Пересчитывает счетчики рассылок, кроме отправляемых в данный момент."""
+        mailings = Mailing.objects.all()
+        if options["mailing_ids"]:
+            mailings = mailings.filter(pk__in=options["mailing_ids"])
+        if not options["force"]:
+            # у отправляемой рассылки счетчики растут, пересчет разошелся бы с отправкой
+            sending = mailings.exclude(lease_owner="").exclude(lease_expires_at__lt=timezone.now())
+            for pk in sending.values_list("pk", flat=True):
+                self.stdout.write(self.style.WARNING(f"Рассылка с ID {pk} отправляется, пропущена"))
+            mailings = mailings.filter(Q(lease_owner="") | Q(lease_expires_at__lt=timezone.now()))
+        updated = MailingService.recount_counters(mailings)
+        self.stdout.write(self.style.SUCCESS(f"Счетчики пересчитаны, рассылок: {updated}"))
@@ -0,0 +1,118 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from client_connect.leases import lease_owner_name
+from client_connect.models import MailingJob
+from client_connect.services import DeliveryRetryService, MailingJobService
+from client_connect.unsubscribe import UnsubscribeBuffer
+from config import settings
+
+
+class Command(BaseCommand):
+    """
+    Команда запускает исполнителя очереди заданий рассылки(MailingJob) и повторных отправок(DeliveryRetry)
+    Методы:
+        add_arguments(self, parser):
+            Добавляет аргументы команды.
+        handle(self, *args, **options) -> None:
+            Забирает задания из очереди и выполняет их, пока команда не будет остановлена.
+            Когда очередь пуста, отправляет пачками повторы, время которых наступило.
+            Между заданиями записывает буфер отписок(UnsubscribeBuffer).
+        run_retries(self, worker: str) -> bool:
+            Отправляет пачку наступивших повторов и выводит результат.
+        flush_unsubscribes(self) -> None:
+            Записывает буфер отписок в список исключений и выводит результат.
+        run_job(self, job: MailingJob) -> None:
+            Выполняет задание и выводит результат.
+    """
+
+    help = "Исполнитель очереди заданий рассылки: забирает задания из БД и отправляет рассылки"
+
+    def add_arguments(self, parser):
+        """Добавляет аргументы команды."""
+        parser.add_argument("--once", action="store_true", help="Выполнить все задания из очереди и завершиться")
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=settings.MAILING_WORKER_POLL_INTERVAL,
+            help="Пауза в секундах между проверками пустой очереди (по умолчанию MAILING_WORKER_POLL_INTERVAL)",
+        )
+        parser.add_argument(
+            "--worker-name",
+            default=lease_owner_name(),
+            help="Имя исполнителя (по умолчанию <хост>-<pid>)",
+        )
+        parser.add_argument("--no-retries", action="store_true", help="Не отправлять повторы после временных ошибок")
+
+    def handle(self, *args, **options) -> None:
+        """
+        Забирает задания из очереди и выполняет их, пока команда не будет остановлена.
+        Когда очередь пуста, отправляет пачками повторы, время которых наступило.
+        Между заданиями, не чаще раза в MAILING_UNSUBSCRIBE_FLUSH_INTERVAL секунд, записывает буфер отписок.
+        """
+
+        worker = options["worker_name"]
+        poll_interval = options["poll_interval"]
+        self.stdout.write(self.style.SUCCESS(f"Исполнитель {worker} запущен"))
+        flushed_at = None
+        try:
+            while True:
+                if flushed_at is None or time.monotonic() - flushed_at >= settings.MAILING_UNSUBSCRIBE_FLUSH_INTERVAL:
+                    self.flush_unsubscribes()
+                    flushed_at = time.monotonic()
+                job = MailingJobService.claim(worker)
+                if job is not None:
+                    self.run_job(job)
+                    continue
+                if not options["no_retries"] and self.run_retries(worker):
+                    continue
+                if options["once"]:
+                    break
+                time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING("Исполнитель остановлен"))
+            return
+        self.stdout.write(self.style.SUCCESS("Очередь заданий пуста"))
+
+    def run_retries(self, worker: str) -> bool:
+        """
+        Отправляет пачку наступивших повторов и выводит результат.
+        :param worker: Имя исполнителя(владелец аренды рассылки на время отправки повторов).
+        :return: True, если были повторы для отправки.
+        """
+        report = DeliveryRetryService.run_due(owner=worker)
+        if not report.total:
+            return False
+        self.stdout.write(f"Повторная отправка. Отправлено: {report.sent}, не отправлено: {report.failed}.")
+        return True
+
+    def flush_unsubscribes(self) -> None:
+        """Записывает буфер отписок в список исключений и выводит результат."""
+        flushed = UnsubscribeBuffer.flush()
+        if flushed:
+            self.stdout.write(f"Записано отписок в список исключений: {flushed}")
+
+    def run_job(self, job: MailingJob) -> None:
+        """Выполняет задание и выводит результат."""
+        self.stdout.write(f"Задание {job.pk}: запуск рассылки с ID {job.mailing_id}")
+        report = MailingJobService.execute(job)
+        if report is None:
+            self.stdout.write(self.style.ERROR(f"Задание {job.pk} завершилось ошибкой: {job.error}"))
+        else:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Задание {job.pk} выполнено. Отправлено: {report.sent}, не отправлено: {report.failed}."
+                )
+            )
+            if report.round_trips_saved:
+                self.stdout.write(f"Сэкономлено ожиданий ответа SMTP сервера(PIPELINING): {report.round_trips_saved}")
+            if report.paused:
+                self.stdout.write(self.style.WARNING(f"Пауза из-за недоступности SMTP сервера: {report.paused:.0f} с"))
+            if report.suppressed:
+                self.stdout.write(f"Пропущено адресов из списка исключений: {report.suppressed}")
+            for name, stats in report.relays.items():
+                self.stdout.write(
+                    f"SMTP сервер {name}: отправлено {stats['sent']}, отклонено {stats['failed']}, "
+                    f"ошибок сервера {stats['errors']}, {stats['rate']} писем в секунду"
+                )
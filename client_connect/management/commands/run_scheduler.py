@@ -0,0 +1,58 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from client_connect.scheduler import MailingScheduler
+from client_connect.services import MailingJobService
+from config import settings
+
+
+class Command(BaseCommand):
+    """
+    Команда запускает планировщик рассылок: рассылки со статусом 'scheduled' ставятся в очередь заданий
+    в запланированное время(start_time), повторяющиеся - после запуска планируются на следующий повтор
+    Методы:
+        add_arguments(self, parser):
+            Добавляет аргументы команды.
+        handle(self, *args, **options) -> None:
+            Ждет ближайшего запуска по расписанию и ставит наступившие рассылки в очередь заданий.
+        launch_due(self, scheduler: MailingScheduler) -> None:
+            Ставит в очередь рассылки, время запуска которых наступило.
+    """
+
+    help = "Планировщик рассылок: ставит рассылки в очередь заданий в запланированное время"
+
+    def add_arguments(self, parser):
+        """Добавляет аргументы команды."""
+        parser.add_argument("--once", action="store_true", help="Запустить наступившие рассылки и завершиться")
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=settings.MAILING_SCHEDULER_POLL_INTERVAL,
+            help="Через сколько секунд перечитывать расписание из БД (по умолчанию MAILING_SCHEDULER_POLL_INTERVAL)",
+        )
+
+    def handle(self, *args, **options) -> None:
+        """Ждет ближайшего запуска по расписанию и ставит наступившие рассылки в очередь заданий."""
+
+        scheduler = MailingScheduler(options["poll_interval"])
+        self.stdout.write(self.style.SUCCESS("Планировщик рассылок запущен"))
+        try:
+            while True:
+                self.launch_due(scheduler)
+                if options["once"]:
+                    break
+                time.sleep(scheduler.wait_time(timezone.now()))
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING("Планировщик остановлен"))
+
+    def launch_due(self, scheduler: MailingScheduler) -> None:
+        """Ставит в очередь рассылки, время запуска которых наступило."""
+        now = timezone.now()
+        if scheduler.needs_refresh(now):
+            scheduler.refresh(now)
+        for pk in scheduler.pop_due(now):
+            job = MailingJobService.enqueue_scheduled(pk, now)
+            if job is not None:
+                self.stdout.write(f"Рассылка с ID {pk} поставлена в очередь, задание {job.pk}")
@@ -0,0 +1,69 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from client_connect.smtp_sink import SMTPSink
+
+
+def add_sink_arguments(parser) -> None:
+    """Добавляет аргументы имитации сети и ошибок тестового SMTP сервера."""
+    parser.add_argument("--latency", type=float, default=0.0, help="Задержка ответа сервера в секундах")
+    parser.add_argument(
+        "--rate", type=float, default=0.0, help="Максимум принимаемых писем в секунду, 0 - без ограничения"
+    )
+    parser.add_argument("--temp-fail", type=float, default=0.0, help="Доля получателей с ответом 451 (от 0 до 1)")
+    parser.add_argument("--perm-fail", type=float, default=0.0, help="Доля получателей с ответом 550 (от 0 до 1)")
+    parser.add_argument("--drop", type=float, default=0.0, help="Доля писем с обрывом соединения (от 0 до 1)")
+    parser.add_argument("--no-pipelining", action="store_true", help="Не объявлять расширение PIPELINING")
+    parser.add_argument("--seed", type=int, default=None, help="Начальное значение генератора случайных ошибок")
+
+
+def sink_options(options: dict) -> dict:
+    """Параметры конструктора SMTPSink из аргументов команды."""
+    return {
+        "latency": options["latency"],
+        "rate": options["rate"],
+        "temp_fail": options["temp_fail"],
+        "perm_fail": options["perm_fail"],
+        "drop": options["drop"],
+        "pipelining": not options["no_pipelining"],
+        "seed": options["seed"],
+    }
+
+
+class Command(BaseCommand):
+    """
+    Команда запускает локальный тестовый SMTP сервер, который принимает и выбрасывает письма.
+    Для проверки отправки рассылок без реального SMTP сервера: EMAIL_HOST=127.0.0.1, EMAIL_PORT=<port>
+    Методы:
+        add_arguments(self, parser):
+            Добавляет аргументы команды.
+        handle(self, *args, **options) -> None:
+            Запускает тестовый SMTP сервер до остановки(Ctrl+C) и выводит статистику.
+    """
+
+    help = "Тестовый SMTP сервер: принимает письма без доставки, имитирует задержку, ошибки 4xx/5xx и обрывы"
+
+    def add_arguments(self, parser):
+        """Добавляет аргументы команды."""
+        parser.add_argument("--host", default="127.0.0.1", help="Адрес прослушивания (по умолчанию 127.0.0.1)")
+        parser.add_argument("--port", type=int, default=2525, help="Порт прослушивания (по умолчанию 2525)")
+        add_sink_arguments(parser)
+
+    def handle(self, *args, **options) -> None:
+        """Запускает тестовый SMTP сервер до остановки(Ctrl+C) и выводит статистику."""
+
+        sink = SMTPSink(host=options["host"], port=options["port"], **sink_options(options))
+        self.stdout.write(self.style.SUCCESS(f"Тестовый SMTP сервер запущен на {sink.host}:{sink.port}"))
+        try:
+            asyncio.run(sink.serve_forever())
+        except KeyboardInterrupt:
+            pass
+        stats = sink.stats
+        self.stdout.write(
+            self.style.WARNING(
+                f"Сервер остановлен. Соединений: {stats.connections}, писем: {stats.messages}, "
+                f"получателей: {stats.recipients}, ответов 4xx: {stats.temp_failures}, "
+                f"ответов 5xx: {stats.perm_failures}, обрывов: {stats.drops}"
+            )
+        )
@@ -1,52 +1,110 @@
-import smtplib
+import multiprocessing
+import queue
+from contextlib import ExitStack
 from typing import Optional
 
-from django.core.mail import send_mail
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import QuerySet
 from django.shortcuts import get_object_or_404
 
+from client_connect.cancellation import share_cancels
+from client_connect.delivery import DeliveryResult
+from client_connect.leases import MailingLeaseError, lease_owner_name, mailing_lease
 from client_connect.models import Mailing, Message
-from config import settings
+from client_connect.progress import track_progress
+from client_connect.services import MailingService
+from client_connect.sharding import build_shards, init_worker, run_shard
 
 
 class Command(BaseCommand):
     """
-    Команда запускает рассылку по первичному ключу, если не указан запускает все
+    Команда запускает рассылку по первичному ключу, если не указан запускает все.
+    Рассылку отправляет только исполнитель, получивший ее аренду: одновременный запуск команды на нескольких
+    серверах не отправит рассылку дважды, рассылки с чужой действующей арендой пропускаются.
     Методы:
         add_arguments(self, parser):
             Добавляет аргументы команды.
         handle(self, *args, **options) -> None:
             Обрабатывает команду для отправки рассылки
-        get_mailing(self, pk: int = None) -> Optional[list]:
-            Получает список рассылок. Если указан первичный ключ, возвращает соответствующую рассылку.
-        send_mailing(self, mailing: Mailing) -> None:
-            Отправляет письма для указанной рассылки.
-        send_mail_to_recipient(self, subject: str, body: str, from_email: str, recipient: str) -> None:
-            Отправляет письмо указанному получателю.
+        get_mailing(self, pk: int = None) -> Optional[QuerySet]:
+            Получает рассылки для запуска. Если указан первичный ключ, возвращает соответствующую рассылку,
+            иначе - рассылки, готовые к отправке(SENDABLE_STATUSES).
+        send_leased(self, mailing: Mailing) -> None:
+            Забирает аренду рассылки и отправляет ее, рассылку с чужой арендой пропускает.
+        send_mailing(self, mailing: Mailing, resume: bool = False) -> None:
+            Отправляет письма для указанной рассылки через движок отправки.
+        send_parallel(self, mailings: QuerySet, processes: int, shard_by: str) -> None:
+            Делит рассылки на части и отправляет их в пуле процессов, выводит общий итог.
+        report_result(self, result: DeliveryResult) -> None:
+            Выводит результат отправки письма получателю.
     """
 
-    help = "Запуск рассылки по первичному ключу, если ключ не указан отправляет все рассылки"
+    help = "Запуск рассылки по первичному ключу, если ключ не указан отправляет все рассылки, готовые к отправке"
+    # без первичного ключа: отключенные и завершенные рассылки не отправляются, запланированные запускает run_scheduler
+    SENDABLE_STATUSES = ("created", "launched")
 
     def add_arguments(self, parser):
         """Добавляет аргументы команды."""
         parser.add_argument("pk", type=int, nargs="?", help="ID рассылки для запуска")
+        parser.add_argument(
+            "--engine",
+            choices=list(MailingService.ENGINES),
+            default=None,
+            help="Движок отправки: threaded - пул потоков, async - asyncio (по умолчанию MAILING_ENGINE)",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=1,
+            help="Количество процессов отправки (по умолчанию 1 - без дочерних процессов)",
+        )
+        parser.add_argument(
+            "--shard-by",
+            choices=["mailing", "recipients"],
+            default="mailing",
+            help="Деление работы между процессами: mailing - по рассылкам, recipients - по диапазонам ID получателей",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Продолжить прерванный запуск: пропустить получателей, которым письмо доставлено в этом запуске",
+        )
+        parser.add_argument(
+            "--worker-name",
+            default=lease_owner_name(),
+            help="Имя исполнителя в аренде рассылки (по умолчанию <хост>-<pid>)",
+        )
 
     def handle(self, *args, **options) -> None:
         """Обрабатывает команду для отправки рассылки"""
 
         pk = options.get("pk")
         mailings = self.get_mailing(pk)
+        self.engine = options.get("engine")
+        self.resume = options.get("resume", False)
+        self.owner = options.get("worker_name") or lease_owner_name()
+        if not mailings:
+            return
 
-        for mailing in mailings:
+        processes = options.get("processes") or 1
+        if processes > 1:
+            self.send_parallel(mailings, processes, options.get("shard_by"))
+            return
+
+        for mailing in mailings.iterator():
             self.stdout.write(self.style.SUCCESS(f"Запуск рассылки с ID: {mailing.pk}"))
-            self.send_mailing(mailing)
+            self.send_leased(mailing)
 
-    def get_mailing(self, pk: int = None) -> Optional[list]:
-        """Получает список рассылок. Если указан первичный ключ, возвращает соответствующую рассылку."""
+    def get_mailing(self, pk: int = None) -> Optional[QuerySet]:
+        """
+        Получает рассылки для запуска. Если указан первичный ключ, возвращает соответствующую рассылку,
+        иначе - рассылки со статусом из SENDABLE_STATUSES. Рассылки не загружаются списком, а читаются при отправке.
+        """
 
         if pk is None:
-            mailings = list(Mailing.objects.all())  # получаем все рассылки
-            if not mailings:
+            mailings = Mailing.objects.filter(status__in=self.SENDABLE_STATUSES).order_by("pk")
+            if not mailings.exists():
                 self.stdout.write(self.style.ERROR("Нет доступных рассылок для запуска!"))
                 return None
             self.stdout.write(self.style.SUCCESS("Запуск всех рассылок..."))
@@ -54,9 +112,8 @@ class Command(BaseCommand):
         else:
             try:
                 mailing = Mailing.objects.get(pk=pk)  # получаем объект рассылки
-                mailings = [mailing]
-                self.stdout.write(self.style.SUCCESS(f"Выбрана рассылка с ID: {pk}"))
-                return mailings
+                self.stdout.write(self.style.SUCCESS(f"Выбрана рассылка с ID: {mailing.pk}"))
+                return Mailing.objects.filter(pk=mailing.pk)
             except Mailing.DoesNotExist:
                 self.stdout.write(self.style.ERROR(f"Рассылка с ID: {pk} - не найдена."))
                 return None
@@ -64,27 +121,137 @@ class Command(BaseCommand):
                 self.stdout.write(self.style.ERROR(str(exc_info)))
                 return None
 
-    def send_mailing(self, mailing: Mailing) -> None:
-        """Отправляет письма для указанной рассылки."""
+    def send_leased(self, mailing: Mailing) -> None:
+        """
+        Забирает аренду рассылки и отправляет ее, рассылку с чужой арендой пропускает.
+        Если аренда забрана после сбоя другого исполнителя, отправка продолжается с места остановки.
+        Прогресс отправки учитывается в счетчиках(track_progress) для страницы рассылки.
+        """
+        try:
+            with mailing_lease(mailing.pk, self.owner) as lease:
+                resume = self.resume or lease.taken_over
+                MailingService.begin_run(mailing, resume)
+                total = MailingService.get_recipients(mailing, resume=resume).count()
+                with track_progress(mailing.pk, total):
+                    self.send_mailing(mailing, resume=resume)
+        except MailingLeaseError as exc_info:
+            self.stdout.write(self.style.WARNING(str(exc_info)))
+
+    def send_mailing(self, mailing: Mailing, resume: bool = False) -> None:
+        """Отправляет письма для указанной рассылки через движок отправки."""
 
         message = get_object_or_404(Message, pk=mailing.message.pk)  # Извлекаем сообщение
-        subject = message.subject
-        body = message.body
-        from_email = settings.DEFAULT_FROM_EMAIL
-        recipients = mailing.recipients.all()  # Получаем получателей
-        recipient_list = [recipient.email for recipient in recipients]
-        if not recipient_list:
-            self.stdout.write(self.style.WARNING(f"Список получателей для рассылки с ID {mailing.pk} пуст!"))
+        recipients = MailingService.get_recipients(mailing, resume=resume)  # читается движком порциями
+        if not recipients.exists():
+            if resume:
+                self.stdout.write(self.style.WARNING(f"Рассылка с ID {mailing.pk} уже доставлена всем получателям."))
+            else:
+                self.stdout.write(self.style.WARNING(f"Список получателей для рассылки с ID {mailing.pk} пуст!"))
             return
-        for recipient in recipient_list:
-            self.send_mail_to_recipient(subject, body, from_email, recipient)
+        report = MailingService.send_messages(
+            recipients=recipients,
+            message=message,
+            mailing=mailing,
+            on_result=self.report_result,
+            engine=self.engine,
+        )
 
-        self.stdout.write(self.style.SUCCESS(f"Рассылка с ID {mailing.pk} выполнена."))
+        if report.stopped:
+            self.stdout.write(self.style.WARNING(f"Рассылка с ID {mailing.pk} отключена, отправка остановлена."))
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Рассылка с ID {mailing.pk} выполнена. Отправлено: {report.sent}, не отправлено: {report.failed}."
+            )
+        )
+        if report.round_trips_saved:
+            self.stdout.write(f"Сэкономлено ожиданий ответа SMTP сервера(PIPELINING): {report.round_trips_saved}")
+        if report.paused:
+            self.stdout.write(self.style.WARNING(f"Пауза из-за недоступности SMTP сервера: {report.paused:.0f} с"))
+        if report.suppressed:
+            self.stdout.write(f"Пропущено адресов из списка исключений: {report.suppressed}")
+        for name, stats in report.relays.items():
+            self.stdout.write(
+                f"SMTP сервер {name}: отправлено {stats['sent']}, отклонено {stats['failed']}, "
+                f"ошибок сервера {stats['errors']}, {stats['rate']} писем в секунду"
+            )
 
-    def send_mail_to_recipient(self, subject: str, body: str, from_email: str, recipient: str) -> None:
-        """Отправляет письмо указанному получателю."""
-        try:
-            send_mail(subject=subject, message=body, from_email=from_email, recipient_list=[recipient])
-            self.stdout.write(self.style.SUCCESS(f"Отправлено получателю: {recipient}"))
-        except smtplib.SMTPRecipientsRefused as exc_info:
-            self.stdout.write(self.style.ERROR(f"Проблема с получателем: {exc_info.recipients}"))
+    def report_result(self, result: DeliveryResult) -> None:
+        """Выводит результат отправки письма получателю."""
+        if result.status == "success":
+            self.stdout.write(self.style.SUCCESS(f"Отправлено получателю: {result.recipient}"))
+        else:
+            self.stdout.write(self.style.ERROR(f"Проблема с получателем {result.recipient}: {result.answer}"))
+
+    def send_parallel(self, mailings: QuerySet, processes: int, shard_by: str) -> None:
+        """
+        Делит рассылки на части и отправляет их в пуле процессов, выводит общий итог.
+        Аренды рассылок держит родительский процесс на все время отправки частей, при потере аренды
+        отправка останавливается и в дочерних процессах(share_cancels). В список частей попадают только
+        рассылки, аренду которых получил этот исполнитель.
+        """
+
+        with ExitStack() as stack:
+            resume, leased = {}, []
+            for mailing in mailings.iterator():
+                try:
+                    lease = stack.enter_context(mailing_lease(mailing.pk, self.owner))
+                except MailingLeaseError as exc_info:
+                    self.stdout.write(self.style.WARNING(str(exc_info)))
+                    continue
+                resume[mailing.pk] = self.resume or lease.taken_over
+                MailingService.begin_run(mailing, resume[mailing.pk])
+                leased.append(mailing)
+            for mailing in leased:
+                total = MailingService.get_recipients(mailing, resume=resume[mailing.pk]).count()
+                stack.enter_context(track_progress(mailing.pk, total))
+            if leased:
+                self._send_shards(leased, processes, shard_by, resume)
+
+    def _send_shards(self, mailings: list, processes: int, shard_by: str, resume: dict) -> None:
+        """Отправляет части рассылок в пуле процессов, выводит общий итог."""
+
+        shards = build_shards(mailings, processes, shard_by)
+        self.stdout.write(self.style.SUCCESS(f"Частей рассылки: {len(shards)}, процессов: {processes}"))
+        connections.close_all()  # дочерние процессы открывают собственные соединения с БД
+        context = multiprocessing.get_context("spawn")
+        with context.Manager() as manager:
+            progress = manager.Queue()
+            cancels = manager.dict()
+            share_cancels(cancels)
+            try:
+                with context.Pool(processes, initializer=init_worker, initargs=(progress, cancels)) as pool:
+                    async_result = pool.starmap_async(
+                        run_shard, [(shard, self.engine, resume[shard.mailing_pk]) for shard in shards]
+                    )
+                    while not async_result.ready():
+                        self._write_progress(progress, timeout=0.5)
+                    results = async_result.get()
+            finally:
+                share_cancels(None)
+            self._write_progress(progress)
+
+        sent = sum(result.sent for result in results)
+        failed = sum(result.failed for result in results)
+        errors = [result for result in results if result.error]
+        for mailing in mailings:
+            mailing_results = [result for result in results if result.shard.mailing_pk == mailing.pk]
+            self.stdout.write(
+                f"Рассылка с ID {mailing.pk}: "
+                f"отправлено {sum(result.sent for result in mailing_results)}, "
+                f"не отправлено {sum(result.failed for result in mailing_results)}"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Итого отправлено: {sent}, не отправлено: {failed}."))
+        if errors:
+            for result in errors:
+                self.stdout.write(self.style.ERROR(f"Часть {result.shard} завершилась ошибкой: {result.error}"))
+            raise CommandError(f"Не выполнено частей рассылки: {len(errors)} из {len(results)}")
+
+    def _write_progress(self, progress, timeout: Optional[float] = None) -> None:
+        """Выводит сообщения о прогрессе из дочерних процессов."""
+        while True:
+            try:
+                text = progress.get(timeout=timeout) if timeout else progress.get_nowait()
+            except queue.Empty:
+                return
+            self.stdout.write(text)
+            timeout = None
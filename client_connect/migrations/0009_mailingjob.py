@@ -0,0 +1,56 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("client_connect", "0008_alter_mailing_status"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MailingJob",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("queued", "В очереди"),
+                            ("running", "Выполняется"),
+                            ("done", "Выполнено"),
+                            ("failed", "Ошибка"),
+                        ],
+                        default="queued",
+                        max_length=10,
+                        verbose_name="Статус",
+                    ),
+                ),
+                ("engine", models.CharField(blank=True, default="", max_length=20, verbose_name="Движок отправки")),
+                ("created_at", models.DateTimeField(auto_now_add=True, verbose_name="Дата постановки в очередь")),
+                ("started_at", models.DateTimeField(blank=True, null=True, verbose_name="Дата начала выполнения")),
+                ("finished_at", models.DateTimeField(blank=True, null=True, verbose_name="Дата окончания выполнения")),
+                ("worker", models.CharField(blank=True, default="", max_length=100, verbose_name="Исполнитель")),
+                ("attempts", models.PositiveIntegerField(default=0, verbose_name="Количество запусков")),
+                ("error", models.TextField(blank=True, default="", verbose_name="Ошибка")),
+                (
+                    "mailing",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="jobs",
+                        to="client_connect.mailing",
+                        verbose_name="Рассылка",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "задание рассылки",
+                "verbose_name_plural": "задания рассылки",
+                "ordering": ["created_at"],
+                "indexes": [models.Index(fields=["status", "created_at"], name="mailingjob_status_created_idx")],
+            },
+        ),
+    ]
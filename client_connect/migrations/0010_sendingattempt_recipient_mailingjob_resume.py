@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("client_connect", "0009_mailingjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mailingjob",
+            name="resume",
+            field=models.BooleanField(default=False, verbose_name="Продолжить с места остановки"),
+        ),
+        migrations.AddField(
+            model_name="sendingattempt",
+            name="recipient",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="sending_attempts",
+                to="client_connect.recipient",
+                verbose_name="Получатель",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="sendingattempt",
+            index=models.Index(fields=["mailing", "status", "recipient"], name="attempt_mailing_rcpt_idx"),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("client_connect", "0010_sendingattempt_recipient_mailingjob_resume"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mailing",
+            name="rate_limit",
+            field=models.PositiveIntegerField(
+                blank=True, help_text="Пусто - без ограничения", null=True, verbose_name="Писем в секунду"
+            ),
+        ),
+    ]
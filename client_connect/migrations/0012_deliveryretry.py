@@ -0,0 +1,54 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("client_connect", "0011_mailing_rate_limit"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DeliveryRetry",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("attempts", models.PositiveIntegerField(default=1, verbose_name="Количество попыток")),
+                ("next_attempt_at", models.DateTimeField(verbose_name="Дата следующей попытки")),
+                (
+                    "last_answer",
+                    models.TextField(blank=True, default="", verbose_name="Последний ответ почтового сервера"),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True, verbose_name="Дата первой ошибки")),
+                (
+                    "mailing",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="retries",
+                        to="client_connect.mailing",
+                        verbose_name="Рассылка",
+                    ),
+                ),
+                (
+                    "recipient",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="retries",
+                        to="client_connect.recipient",
+                        verbose_name="Получатель",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "повторная отправка",
+                "verbose_name_plural": "повторные отправки",
+                "ordering": ["next_attempt_at"],
+                "indexes": [models.Index(fields=["next_attempt_at"], name="retry_next_attempt_idx")],
+                "constraints": [
+                    models.UniqueConstraint(fields=("mailing", "recipient"), name="retry_mailing_recipient_uniq")
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("client_connect", "0012_deliveryretry"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mailing",
+            name="batch_send",
+            field=models.BooleanField(
+                default=False,
+                help_text="Одно письмо нескольким получателям за раз, только для сообщений без подстановок",
+                verbose_name="Пакетная отправка",
+            ),
+        ),
+    ]
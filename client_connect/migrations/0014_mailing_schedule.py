@@ -0,0 +1,51 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("client_connect", "0013_mailing_batch_send"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mailing",
+            name="repeat",
+            field=models.CharField(
+                blank=True,
+                choices=[
+                    ("", "Без повтора"),
+                    ("hourly", "Каждый час"),
+                    ("daily", "Каждый день"),
+                    ("weekly", "Каждую неделю"),
+                ],
+                default="",
+                max_length=10,
+                verbose_name="Повтор",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="mailing",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("done", "Завершена"),
+                    ("created", "Создана"),
+                    ("scheduled", "Запланирована"),
+                    ("launched", "Запущена"),
+                    ("disable", "Отключена"),
+                ],
+                default="created",
+                max_length=20,
+                verbose_name="Статус",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="mailing",
+            index=models.Index(fields=["status", "start_time"], name="mailing_status_start_idx"),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("client_connect", "0014_mailing_schedule"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mailing",
+            name="lease_expires_at",
+            field=models.DateTimeField(blank=True, null=True, verbose_name="Срок аренды"),
+        ),
+        migrations.AddField(
+            model_name="mailing",
+            name="lease_owner",
+            field=models.CharField(blank=True, default="", max_length=100, verbose_name="Исполнитель"),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("client_connect", "0015_mailing_lease"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mailing",
+            name="failed_count",
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name="Не отправлено"),
+        ),
+        migrations.AddField(
+            model_name="mailing",
+            name="last_attempt_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name="Последняя попытка"),
+        ),
+        migrations.AddField(
+            model_name="mailing",
+            name="sent_count",
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name="Отправлено"),
+        ),
+        migrations.AddField(
+            model_name="mailing",
+            name="total_count",
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name="Получателей"),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("client_connect", "0016_mailing_counters"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Suppression",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("email", models.EmailField(max_length=254, unique=True, verbose_name="email")),
+                (
+                    "reason",
+                    models.CharField(
+                        choices=[
+                            ("bounce", "Постоянная ошибка доставки"),
+                            ("complaint", "Жалоба на спам"),
+                            ("unsubscribe", "Отписка"),
+                            ("manual", "Вручную"),
+                        ],
+                        default="manual",
+                        max_length=20,
+                        verbose_name="Причина",
+                    ),
+                ),
+                ("comment", models.TextField(blank=True, default="", verbose_name="Комментарий")),
+                ("created_at", models.DateTimeField(auto_now_add=True, verbose_name="Дата добавления")),
+            ],
+            options={
+                "verbose_name": "исключенный адрес",
+                "verbose_name_plural": "список исключений",
+                "ordering": ["-created_at"],
+                "indexes": [models.Index(fields=["created_at"], name="suppression_created_idx")],
+            },
+        ),
+    ]
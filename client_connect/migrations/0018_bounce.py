@@ -0,0 +1,47 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("client_connect", "0017_suppression"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Bounce",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("message_id", models.CharField(max_length=255, verbose_name="Message-ID уведомления")),
+                ("email", models.EmailField(max_length=254, verbose_name="email")),
+                ("action", models.CharField(max_length=20, verbose_name="Действие")),
+                ("status", models.CharField(blank=True, default="", max_length=20, verbose_name="Код состояния")),
+                ("diagnostic", models.TextField(blank=True, default="", verbose_name="Ответ почтового сервера")),
+                ("received_at", models.DateTimeField(blank=True, null=True, verbose_name="Дата уведомления")),
+                ("created_at", models.DateTimeField(auto_now_add=True, verbose_name="Дата обработки")),
+                (
+                    "mailing",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="bounces",
+                        to="client_connect.mailing",
+                        verbose_name="Рассылка",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "уведомление о недоставке",
+                "verbose_name_plural": "уведомления о недоставке",
+                "ordering": ["-created_at"],
+                "indexes": [models.Index(fields=["email"], name="bounce_email_idx")],
+                "constraints": [
+                    models.UniqueConstraint(fields=("message_id", "email"), name="bounce_message_email_uniq")
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("client_connect", "0018_bounce"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mailing",
+            name="run_started_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name="Начало запуска"),
+        ),
+    ]
@@ -1,3 +1,6 @@
+from datetime import timedelta
+from typing import Iterable
+
 from django.db import models
 
 from users.models import CustomUser
@@ -71,23 +74,49 @@ class Mailing(models.Model):
     """
     Представление рассылки
     Атрибуты:
-        start_time(datetime): Дата и время первой отправки
+        start_time(datetime): Дата и время первой отправки, для запланированной рассылки - время следующего запуска
         end_time(datetime): Дата и время окончания отправки
-        status(str): Статус (строка: 'Завершена', 'Создана', 'Запущена'). Возможные значения:
+        status(str): Статус (строка: 'Завершена', 'Создана', 'Запланирована', 'Запущена'). Возможные значения:
             'done' - рассылка завершена,
             'created' - рассылка создана,
+            'scheduled' - рассылка запланирована на start_time, ее запустит команда run_scheduler,
             'launched' - рассылка запущена
+        repeat(str): Повтор запланированной рассылки: '' - без повтора, 'hourly', 'daily', 'weekly'
         message(ForeignKey): Сообщение (внешний ключ на модель «Сообщение»)
         recipient: Получатели («многие ко многим», связь с моделью «Получатель»)
         owner(ForeignKey): Связь с пользователем, который создал рассылку
+        rate_limit(int): Ограничение количества писем в секунду для рассылки(пусто - без ограничения)
+        batch_send(bool): Отправлять письмо без подстановок сразу нескольким получателям одной SMTP транзакцией
+        lease_owner(str): Исполнитель, который отправляет рассылку(аренда рассылки), пустая строка - свободна
+        lease_expires_at(datetime): Срок аренды, продлевается исполнителем; истекшую аренду забирает другой исполнитель
+        total_count(int): Количество получателей рассылки
+        sent_count(int): Количество успешных попыток отправки в текущем запуске(счетчик журнала доставки)
+        failed_count(int): Количество получателей, последняя попытка которым в текущем запуске неуспешна
+        last_attempt_at(datetime): Дата и время последней попытки отправки
+        run_started_at(datetime): Начало текущего(последнего) запуска отправки, продолжение запуска его не меняет
+    Методы:
+        settings_fields(cls, names: Iterable[str]) -> list:
+            Поля настроек рассылки из names для update_fields формы и админки, без полей отправки.
     """
 
     STATUS_CHOICES = [
         ("done", "Завершена"),
         ("created", "Создана"),
+        ("scheduled", "Запланирована"),
         ("launched", "Запущена"),
         ("disable", "Отключена"),
     ]
+    REPEAT_CHOICES = [
+        ("", "Без повтора"),
+        ("hourly", "Каждый час"),
+        ("daily", "Каждый день"),
+        ("weekly", "Каждую неделю"),
+    ]
+    REPEAT_INTERVALS = {
+        "hourly": timedelta(hours=1),
+        "daily": timedelta(days=1),
+        "weekly": timedelta(weeks=1),
+    }
     start_time = models.DateTimeField(blank=True, null=True, verbose_name="Дата первой отправки")
     end_time = models.DateTimeField(blank=True, null=True, verbose_name="Дата окончания отправки")
     status: str = models.CharField(max_length=20, choices=STATUS_CHOICES, verbose_name="Статус", default="created")
@@ -96,6 +125,33 @@ class Mailing(models.Model):
     owner = models.ForeignKey(
         CustomUser, on_delete=models.SET_NULL, null=True, related_name="owner_mailings", verbose_name="Владелец"
     )
+    rate_limit = models.PositiveIntegerField(
+        blank=True, null=True, verbose_name="Писем в секунду", help_text="Пусто - без ограничения"
+    )
+    batch_send = models.BooleanField(
+        default=False,
+        verbose_name="Пакетная отправка",
+        help_text="Одно письмо нескольким получателям за раз, только для сообщений без подстановок",
+    )
+    repeat = models.CharField(max_length=10, choices=REPEAT_CHOICES, blank=True, default="", verbose_name="Повтор")
+    lease_owner = models.CharField(max_length=100, blank=True, default="", verbose_name="Исполнитель")
+    lease_expires_at = models.DateTimeField(blank=True, null=True, verbose_name="Срок аренды")
+    total_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Получателей")
+    sent_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Отправлено")
+    failed_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Не отправлено")
+    last_attempt_at = models.DateTimeField(blank=True, null=True, editable=False, verbose_name="Последняя попытка")
+    run_started_at = models.DateTimeField(blank=True, null=True, editable=False, verbose_name="Начало запуска")
+
+    # поля обновляются отправкой атомарными запросами(F(), update()), форма и админка их не сохраняют
+    MAINTAINED_FIELDS = (
+        "lease_owner",
+        "lease_expires_at",
+        "total_count",
+        "sent_count",
+        "failed_count",
+        "last_attempt_at",
+        "run_started_at",
+    )
 
     def __str__(self) -> str:
         """
@@ -104,10 +160,24 @@ class Mailing(models.Model):
         """
         return f"{self.message.subject}: {self.status}"
 
+    @classmethod
+    def settings_fields(cls, names: Iterable[str]) -> list:
+        """
+        Поля настроек рассылки из names для update_fields: форма или админка, прочитавшие рассылку до начала
+        отправки, сохраняют только свои поля и не затирают счетчики и аренду идущей отправки(MAINTAINED_FIELDS).
+        :param names: Названия полей формы.
+        :return: Названия полей модели без связей «многие ко многим» и полей отправки.
+        """
+        concrete = {field.name for field in cls._meta.concrete_fields if not field.primary_key}
+        return [name for name in names if name in concrete and name not in cls.MAINTAINED_FIELDS]
+
     class Meta:
         verbose_name = "рассылка"
         verbose_name_plural = "рассылки"
         ordering = ["status"]
+        indexes = [
+            models.Index(fields=["status", "start_time"], name="mailing_status_start_idx"),
+        ]
         permissions = [
             ("can_list_mailings", "Can list mailings"),
             ("can_disable_send", "Can disable send"),
@@ -124,6 +194,7 @@ class SendingAttempt(models.Model):
             'fail' - не успешно отправлено,
         answer(str): Ответ почтового сервера (текст)
         mailing(str): Рассылка (внешний ключ на модель «Рассылка»).
+        recipient(ForeignKey): Получатель (внешний ключ на модель «Получатель»), журнал доставки по получателям
     """
 
     STATUS_CHOICES = [("success", "Успешно"), ("fail", "Не успешно")]
@@ -133,6 +204,14 @@ class SendingAttempt(models.Model):
     mailing = models.ForeignKey(
         Mailing, on_delete=models.CASCADE, related_name="sending_attempts", verbose_name="Рассылка"
     )
+    recipient = models.ForeignKey(
+        Recipient,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="sending_attempts",
+        verbose_name="Получатель",
+    )
 
     def __str__(self) -> str:
         """
@@ -146,3 +225,179 @@ class SendingAttempt(models.Model):
         verbose_name_plural = "попытки рассылки"
         ordering = ["status"]
         permissions = [("can_list_sending_attempts", "Can_list_sending_attempts")]
+        indexes = [
+            models.Index(fields=["mailing", "status", "recipient"], name="attempt_mailing_rcpt_idx"),
+        ]
+
+
+class MailingJob(models.Model):
+    """
+    Представление задания на отправку рассылки в очереди заданий
+    Атрибуты:
+        mailing(ForeignKey): Рассылка (внешний ключ на модель «Рассылка»)
+        status(str): Статус (строка: 'В очереди', 'Выполняется', 'Выполнено', 'Ошибка'). Возможные значения:
+            'queued' - задание ожидает исполнителя,
+            'running' - задание выполняется,
+            'done' - задание выполнено,
+            'failed' - задание завершилось ошибкой
+        engine(str): Движок отправки, пустая строка - движок по умолчанию
+        created_at(datetime): Дата и время постановки в очередь
+        started_at(datetime): Дата и время начала выполнения
+        finished_at(datetime): Дата и время окончания выполнения
+        worker(str): Имя исполнителя, взявшего задание
+        attempts(int): Количество запусков задания
+        error(str): Текст ошибки выполнения
+        resume(bool): Продолжить рассылку, пропуская получателей, которым письмо уже доставлено
+    """
+
+    STATUS_CHOICES = [
+        ("queued", "В очереди"),
+        ("running", "Выполняется"),
+        ("done", "Выполнено"),
+        ("failed", "Ошибка"),
+    ]
+    mailing = models.ForeignKey(Mailing, on_delete=models.CASCADE, related_name="jobs", verbose_name="Рассылка")
+    status: str = models.CharField(max_length=10, choices=STATUS_CHOICES, default="queued", verbose_name="Статус")
+    engine = models.CharField(max_length=20, blank=True, default="", verbose_name="Движок отправки")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата постановки в очередь")
+    started_at = models.DateTimeField(blank=True, null=True, verbose_name="Дата начала выполнения")
+    finished_at = models.DateTimeField(blank=True, null=True, verbose_name="Дата окончания выполнения")
+    worker = models.CharField(max_length=100, blank=True, default="", verbose_name="Исполнитель")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Количество запусков")
+    error = models.TextField(blank=True, default="", verbose_name="Ошибка")
+    resume = models.BooleanField(default=False, verbose_name="Продолжить с места остановки")
+
+    def __str__(self) -> str:
+        """
+        Строковое представление задания
+        :return: ID рассылки и статус задания
+        """
+        return f"{self.mailing_id}: {self.status}"
+
+    class Meta:
+        verbose_name = "задание рассылки"
+        verbose_name_plural = "задания рассылки"
+        ordering = ["created_at"]
+        indexes = [models.Index(fields=["status", "created_at"], name="mailingjob_status_created_idx")]
+
+
+class DeliveryRetry(models.Model):
+    """
+    Представление запланированной повторной отправки письма получателю после временной ошибки SMTP сервера
+    Атрибуты:
+        mailing(ForeignKey): Рассылка (внешний ключ на модель «Рассылка»)
+        recipient(ForeignKey): Получатель (внешний ключ на модель «Получатель»)
+        attempts(int): Количество неудачных попыток отправки
+        next_attempt_at(datetime): Дата и время следующей попытки
+        last_answer(str): Ответ почтового сервера при последней попытке
+        created_at(datetime): Дата и время первой временной ошибки
+    """
+
+    mailing = models.ForeignKey(Mailing, on_delete=models.CASCADE, related_name="retries", verbose_name="Рассылка")
+    recipient = models.ForeignKey(
+        Recipient, on_delete=models.CASCADE, related_name="retries", verbose_name="Получатель"
+    )
+    attempts = models.PositiveIntegerField(default=1, verbose_name="Количество попыток")
+    next_attempt_at = models.DateTimeField(verbose_name="Дата следующей попытки")
+    last_answer = models.TextField(blank=True, default="", verbose_name="Последний ответ почтового сервера")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата первой ошибки")
+
+    def __str__(self) -> str:
+        """
+        Строковое представление повторной отправки
+        :return: ID рассылки, получатель и дата следующей попытки
+        """
+        return f"{self.mailing_id}: {self.recipient_id} в {self.next_attempt_at}"
+
+    class Meta:
+        verbose_name = "повторная отправка"
+        verbose_name_plural = "повторные отправки"
+        ordering = ["next_attempt_at"]
+        constraints = [models.UniqueConstraint(fields=["mailing", "recipient"], name="retry_mailing_recipient_uniq")]
+        indexes = [models.Index(fields=["next_attempt_at"], name="retry_next_attempt_idx")]
+
+
+class Suppression(models.Model):
+    """
+    Представление адреса в списке исключений: письма на адрес не отправляются ни одной рассылкой
+    Атрибуты:
+        email(email): Электронная почта в нижнем регистре, уникальная
+        reason(str): Причина исключения. Возможные значения:
+            'bounce' - постоянная ошибка доставки,
+            'complaint' - жалоба на спам,
+            'unsubscribe' - получатель отписался,
+            'manual' - добавлен вручную
+        comment(str): Комментарий(например, ответ почтового сервера)
+        created_at(datetime): Дата и время добавления
+    """
+
+    REASON_CHOICES = [
+        ("bounce", "Постоянная ошибка доставки"),
+        ("complaint", "Жалоба на спам"),
+        ("unsubscribe", "Отписка"),
+        ("manual", "Вручную"),
+    ]
+
+    email = models.EmailField(unique=True, verbose_name="email")
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES, default="manual", verbose_name="Причина")
+    comment = models.TextField(blank=True, default="", verbose_name="Комментарий")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата добавления")
+
+    def save(self, *args, **kwargs) -> None:
+        """Сохраняет адрес в нижнем регистре: адреса сравниваются без учета регистра."""
+        self.email = self.email.strip().lower()
+        super().save(*args, **kwargs)
+
+    def __str__(self) -> str:
+        """
+        Строковое представление исключения
+        :return: Электронная почта и причина
+        """
+        return f"{self.email} ({self.get_reason_display()})"
+
+    class Meta:
+        verbose_name = "исключенный адрес"
+        verbose_name_plural = "список исключений"
+        ordering = ["-created_at"]
+        indexes = [models.Index(fields=["created_at"], name="suppression_created_idx")]
+
+
+class Bounce(models.Model):
+    """
+    Представление уведомления о доставке(DSN, RFC 3464) по одному получателю, прочитанного из почтового ящика
+    возвратов командой ingest_bounces
+    Атрибуты:
+        message_id(str): Message-ID уведомления(или хеш уведомления без Message-ID)
+        email(email): Адрес получателя из уведомления(Final-Recipient) в нижнем регистре
+        mailing(ForeignKey): Рассылка из заголовка X-Mailing-Id исходного письма, None - рассылка не определена
+        action(str): Действие почтового сервера: 'failed', 'delayed', 'delivered', 'relayed', 'expanded'
+        status(str): Код состояния доставки(например, 5.1.1)
+        diagnostic(str): Ответ почтового сервера получателя(Diagnostic-Code)
+        received_at(datetime): Дата уведомления
+        created_at(datetime): Дата и время обработки уведомления
+    """
+
+    message_id = models.CharField(max_length=255, verbose_name="Message-ID уведомления")
+    email = models.EmailField(verbose_name="email")
+    mailing = models.ForeignKey(
+        Mailing, on_delete=models.SET_NULL, null=True, blank=True, related_name="bounces", verbose_name="Рассылка"
+    )
+    action = models.CharField(max_length=20, verbose_name="Действие")
+    status = models.CharField(max_length=20, blank=True, default="", verbose_name="Код состояния")
+    diagnostic = models.TextField(blank=True, default="", verbose_name="Ответ почтового сервера")
+    received_at = models.DateTimeField(null=True, blank=True, verbose_name="Дата уведомления")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата обработки")
+
+    def __str__(self) -> str:
+        """
+        Строковое представление уведомления
+        :return: Адрес получателя, действие и код состояния
+        """
+        return f"{self.email}: {self.action} {self.status}"
+
+    class Meta:
+        verbose_name = "уведомление о недоставке"
+        verbose_name_plural = "уведомления о недоставке"
+        ordering = ["-created_at"]
+        constraints = [models.UniqueConstraint(fields=["message_id", "email"], name="bounce_message_email_uniq")]
+        indexes = [models.Index(fields=["email"], name="bounce_email_idx")]
@@ -0,0 +1,75 @@
+import re
+from typing import Optional
+
+# Подстановки, доступные в теме и тексте сообщения: {{ email }}, {{ full_name }}, {{ unsubscribe_url }}(ссылка отписки)
+PLACEHOLDER_RE = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+PLACEHOLDER_FIELDS = ("email", "full_name", "unsubscribe_url")
+
+
+class PersonalizedText:
+    """
+    Текст с подстановками данных получателя, разобранный один раз при создании.
+    Текст делится на части: постоянные строки и названия полей получателя, при отправке части
+    только склеиваются, без повторного разбора. Неизвестные подстановки остаются в тексте как есть.
+    Атрибуты:
+        text(str): Исходный текст
+        fields(tuple): Поля получателя, используемые в тексте
+    Методы:
+        is_static(self) -> bool:
+            Текст без подстановок, одинаковый для всех получателей.
+        render(self, context: dict) -> str:
+            Возвращает текст для одного получателя.
+    """
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self._parts = tuple(self._compile(text))
+        self.fields = tuple(part for part, is_field in self._parts if is_field)
+
+    @property
+    def is_static(self) -> bool:
+        """Текст без подстановок, одинаковый для всех получателей."""
+        return not self.fields
+
+    def render(self, context: dict) -> str:
+        """
+        Возвращает текст для одного получателя.
+        :param context: Данные получателя {'email': ..., 'full_name': ...}, отсутствующие поля - пустая строка.
+        :return: Текст с подставленными данными.
+        """
+        if not self.fields:
+            return self.text
+        return "".join((context.get(part) or "") if is_field else part for part, is_field in self._parts)
+
+    @staticmethod
+    def _compile(text: str) -> list:
+        """
+        Разбирает текст на части (строка, является ли полем получателя).
+        Соседние постоянные части склеиваются, неизвестные подстановки остаются постоянным текстом.
+        """
+        parts: list = []
+        literal, position = "", 0
+        for match in PLACEHOLDER_RE.finditer(text):
+            start, end = match.span()
+            literal += text[position:start]
+            position = end
+            if match.group(1) not in PLACEHOLDER_FIELDS:
+                literal += match.group(0)
+                continue
+            if literal:
+                parts.append((literal, False))
+                literal = ""
+            parts.append((match.group(1), True))
+        literal += text[position:]
+        if literal:
+            parts.append((literal, False))
+        return parts
+
+
+def unknown_placeholders(text: Optional[str]) -> list:
+    """
+    Возвращает подстановки текста, которых нет среди полей получателя.
+    :param text: Текст темы или сообщения.
+    :return: Список неизвестных названий полей.
+    """
+    return sorted({name for name in PLACEHOLDER_RE.findall(text or "") if name not in PLACEHOLDER_FIELDS})
@@ -0,0 +1,182 @@
+import smtplib
+import threading
+from typing import Optional
+
+
+class SMTPRoundTrips:
+    """
+    Счетчик обращений к SMTP серверу при отправке писем, общий для соединений пула
+    Атрибуты:
+        commands(int): Количество команд транзакций(MAIL FROM, RCPT TO, DATA, текст письма)
+        round_trips(int): Количество ожиданий ответа сервера
+    Методы:
+        add(self, commands: int, round_trips: int) -> None:
+            Учитывает одну SMTP транзакцию.
+        saved(self) -> int:
+            Сколько ожиданий ответа сервера сэкономлено конвейерной отправкой команд.
+    """
+
+    def __init__(self) -> None:
+        self.commands = 0
+        self.round_trips = 0
+        self._lock = threading.Lock()
+
+    def add(self, commands: int, round_trips: int) -> None:
+        """Учитывает одну SMTP транзакцию."""
+        with self._lock:
+            self.commands += commands
+            self.round_trips += round_trips
+
+    @property
+    def saved(self) -> int:
+        """Сколько ожиданий ответа сервера сэкономлено конвейерной отправкой команд."""
+        return self.commands - self.round_trips
+
+
+def transaction_commands(recipients: list) -> int:
+    """
+    Количество команд одной SMTP транзакции без конвейера: MAIL FROM, RCPT TO на каждого получателя, DATA
+    и текст письма - каждая ждет ответа сервера.
+    :param recipients: Список адресов получателей.
+    """
+    return len(recipients) + 3
+
+
+class SMTPDataDisconnected(smtplib.SMTPServerDisconnected):
+    """
+    Соединение оборвано после того, как сервер принял команду DATA: сервер мог принять письмо. Такую отправку
+    нельзя сразу повторять через новое соединение или другой сервер группы - получатель может получить письмо
+    дважды, она записывается временной ошибкой и повторяется по расписанию(DeliveryRetry).
+    """
+
+
+class PipeliningSMTP(smtplib.SMTP):
+    """
+    SMTP соединение с конвейерной отправкой команд(ESMTP PIPELINING, RFC 2920).
+    Если сервер объявил расширение PIPELINING, MAIL FROM, все RCPT TO и DATA отправляются одним пакетом
+    и ответы читаются после: транзакция занимает два ожидания ответа сервера вместо N + 3.
+    Без расширения письмо отправляется обычным smtplib.SMTP.sendmail.
+    Атрибуты:
+        pipelining(bool): Использовать конвейер, если сервер его поддерживает
+        stats(SMTPRoundTrips): Счетчик обращений к серверу, None - не считать
+        data_started(bool): Сервер принял команду DATA текущей транзакции(ответ 354), передается текст письма
+    Методы:
+        sendmail(self, from_addr: str, to_addrs, msg, mail_options=(), rcpt_options=()) -> dict:
+            Отправляет письмо, возвращает словарь отклоненных получателей как smtplib.SMTP.sendmail.
+        data(self, msg: bytes) -> tuple:
+            Отправляет команду DATA и текст письма(отправка без конвейера).
+    """
+
+    def __init__(self, *args, pipelining: bool = True, stats: Optional[SMTPRoundTrips] = None, **kwargs) -> None:
+        self.pipelining = pipelining
+        self.stats = stats
+        self.data_started = False
+        super().__init__(*args, **kwargs)
+
+    def sendmail(self, from_addr: str, to_addrs, msg, mail_options=(), rcpt_options=()) -> dict:
+        """
+        Отправляет письмо, возвращает словарь отклоненных получателей как smtplib.SMTP.sendmail.
+        :raise smtplib.SMTPSenderRefused: Если сервер отклонил отправителя
+        :raise smtplib.SMTPRecipientsRefused: Если сервер отклонил всех получателей
+        :raise smtplib.SMTPDataError: Если сервер не принял письмо
+        :raise SMTPDataDisconnected: Если соединение оборвано после команды DATA
+        """
+        self.ehlo_or_helo_if_needed()
+        if isinstance(to_addrs, str):
+            to_addrs = [to_addrs]
+        if isinstance(msg, str):
+            msg = smtplib._fix_eols(msg).encode("ascii")
+        commands = transaction_commands(to_addrs)
+        self.data_started = False
+        try:
+            if not (self.pipelining and self.has_extn("pipelining")):
+                refused = super().sendmail(from_addr, to_addrs, msg, mail_options, rcpt_options)
+                self._count(commands, commands)
+                return refused
+            refused = self._send_pipelined(from_addr, to_addrs, msg, list(mail_options), rcpt_options)
+        except OSError as exc_info:
+            # SMTPException - подкласс OSError: ответы сервера(SMTPDataError и другие) обрывом не считаются
+            response = isinstance(exc_info, smtplib.SMTPException) and not isinstance(
+                exc_info, smtplib.SMTPServerDisconnected
+            )
+            if self.data_started and not response:
+                raise SMTPDataDisconnected(f"Соединение оборвано после команды DATA: {exc_info}") from exc_info
+            raise
+        self._count(commands, 2)
+        return refused
+
+    def data(self, msg: bytes) -> tuple:
+        """
+        Отправляет команду DATA и текст письма(отправка без конвейера), отмечает начало передачи текста.
+        :return: (код, ответ) сервера на текст письма
+        :raise smtplib.SMTPDataError: Если сервер не принял команду DATA
+        """
+        self.putcmd("data")
+        code, reply = self.getreply()
+        if code != 354:
+            raise smtplib.SMTPDataError(code, reply)
+        self.data_started = True
+        return self._send_text(msg)
+
+    def _send_pipelined(self, from_addr: str, to_addrs: list, msg: bytes, mail_options: list, rcpt_options) -> dict:
+        """Отправляет конверт письма одним пакетом(MAIL FROM, RCPT TO, DATA), затем текст письма."""
+        if self.does_esmtp and self.has_extn("size"):
+            mail_options.append(f"size={len(msg)}")
+        lines = [f"mail FROM:{smtplib.quoteaddr(from_addr)}{self._options(mail_options)}"]
+        lines.extend(f"rcpt TO:{smtplib.quoteaddr(addr)}{self._options(rcpt_options)}" for addr in to_addrs)
+        lines.append("data")
+        self.send("".join(f"{line}\r\n" for line in lines))
+
+        mail_code, mail_reply = self.getreply()
+        rcpt_replies = [self.getreply() for _ in to_addrs]
+        data_code, data_reply = self.getreply()
+        refused = {addr: reply for addr, reply in zip(to_addrs, rcpt_replies) if reply[0] not in (250, 251)}
+        if data_code == 354 and (mail_code != 250 or len(refused) == len(to_addrs)):
+            # сервер уже ждет текст письма: завершаем его пустым, транзакция будет отклонена
+            self.send(b"." + smtplib.bCRLF)
+            self.getreply()
+        if mail_code != 250:
+            self._abort(mail_code)
+            raise smtplib.SMTPSenderRefused(mail_code, mail_reply, from_addr)
+        if len(refused) == len(to_addrs):
+            self._abort(max(code for code, _ in refused.values()))
+            raise smtplib.SMTPRecipientsRefused(refused)
+        if data_code != 354:
+            self._abort(data_code)
+            raise smtplib.SMTPDataError(data_code, data_reply)
+
+        self.data_started = True
+        code, reply = self._send_text(msg)
+        if code != 250:
+            self._abort(code)
+            raise smtplib.SMTPDataError(code, reply)
+        return refused
+
+    def _send_text(self, msg: bytes) -> tuple:
+        """Отправляет текст письма с завершающей точкой после ответа 354, возвращает (код, ответ) сервера."""
+        data = smtplib._quote_periods(msg)
+        if data[-2:] != smtplib.bCRLF:
+            data += smtplib.bCRLF
+        self.send(data + b"." + smtplib.bCRLF)
+        return self.getreply()
+
+    def _abort(self, code: int) -> None:
+        """Сбрасывает транзакцию после ошибки, при ответе 421 сервер закрывает соединение."""
+        if code == 421:
+            self.close()
+        else:
+            self._rset()
+
+    def _count(self, commands: int, round_trips: int) -> None:
+        """Учитывает транзакцию в счетчике обращений к серверу."""
+        if self.stats is not None:
+            self.stats.add(commands, round_trips)
+
+    @staticmethod
+    def _options(options) -> str:
+        """Параметры команды ESMTP через пробел."""
+        return "".join(f" {option}" for option in options)
+
+
+class PipeliningSMTP_SSL(PipeliningSMTP, smtplib.SMTP_SSL):
+    """SSL соединение с конвейерной отправкой команд(ESMTP PIPELINING)."""
@@ -0,0 +1,190 @@
+import asyncio
+import json
+import time
+from contextlib import contextmanager
+from typing import AsyncIterator, Iterator, Optional
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+
+from client_connect.models import Mailing, MailingJob
+from config import settings
+
+PROGRESS_KEY = "mailing:progress:{}:{}"
+PROGRESS_TTL = 60 * 60 * 24
+PROGRESS_FINAL_TTL = 60 * 60
+COUNTERS = ("sent", "failed", "total", "started")
+
+
+def _key(mailing_pk: int, name: str) -> str:
+    """Ключ счетчика прогресса рассылки в кеше."""
+    return PROGRESS_KEY.format(mailing_pk, name)
+
+
+def start_progress(mailing_pk: int, total: int) -> None:
+    """
+    Заводит счетчики прогресса отправки рассылки.
+    При CACHE_ENABLED счетчики хранятся в Redis и видны всем процессам(веб-сервер, исполнители),
+    иначе - в памяти процесса отправки, другие процессы получают прогресс из БД(run_progress).
+    :param mailing_pk: ID рассылки.
+    :param total: Количество получателей к отправке.
+    """
+    cache.delete(_key(mailing_pk, "final"))
+    cache.set_many(
+        {
+            _key(mailing_pk, "sent"): 0,
+            _key(mailing_pk, "failed"): 0,
+            _key(mailing_pk, "total"): total,
+            _key(mailing_pk, "started"): time.time(),
+        },
+        PROGRESS_TTL,
+    )
+
+
+def record_progress(mailing_pk: int, results: list) -> None:
+    """
+    Учитывает пачку результатов отправки в счетчиках прогресса(два атомарных INCR на пачку).
+    Если счетчики не заведены(повторная отправка после завершения рассылки), результаты не учитываются.
+    :param mailing_pk: ID рассылки.
+    :param results: Результаты отправки(DeliveryResult).
+    """
+    sent = sum(1 for result in results if result.status == "success")
+    try:
+        if sent:
+            cache.incr(_key(mailing_pk, "sent"), sent)
+        if len(results) - sent:
+            cache.incr(_key(mailing_pk, "failed"), len(results) - sent)
+    except ValueError:
+        pass
+
+
+def finish_progress(mailing_pk: int) -> None:
+    """
+    Завершает учет прогресса: итоговые значения сохраняются одним ключом, счетчики удаляются.
+    :param mailing_pk: ID рассылки.
+    """
+    progress = get_progress(mailing_pk)
+    cache.delete_many([_key(mailing_pk, name) for name in COUNTERS])
+    if progress is not None:
+        progress["finished"] = True
+        cache.set(_key(mailing_pk, "final"), progress, PROGRESS_FINAL_TTL)
+
+
+def get_progress(mailing_pk: int) -> Optional[dict]:
+    """
+    Возвращает прогресс отправки рассылки из счетчиков, без запросов к журналу доставки.
+    :param mailing_pk: ID рассылки.
+    :return: {'sent', 'failed', 'total', 'remaining', 'started', 'finished'}, либо None, если рассылка не отправляется.
+    """
+    values = cache.get_many([_key(mailing_pk, name) for name in (*COUNTERS, "final")])
+    if _key(mailing_pk, "total") not in values:
+        return values.get(_key(mailing_pk, "final"))
+    progress = {name: values.get(_key(mailing_pk, name), 0) for name in COUNTERS}
+    progress["remaining"] = max(0, progress["total"] - progress["sent"] - progress["failed"])
+    progress["finished"] = False
+    return progress
+
+
+def run_progress(mailing_pk: int) -> Optional[dict]:
+    """
+    Прогресс отправки рассылки из БД для процессов, которые не видят счетчики процесса отправки(без CACHE_ENABLED
+    счетчики в памяти исполнителя run_mail_worker): счетчики текущего запуска из строки рассылки(total_count,
+    sent_count, failed_count), одно чтение строки по первичному ключу без запросов к журналу доставки.
+    :param mailing_pk: ID рассылки.
+    :return: {'sent', 'failed', 'total', 'remaining', 'started', 'finished'}, либо None, если рассылка не отправляется
+             (нет аренды исполнителя).
+    """
+    mailing = (
+        Mailing.objects.filter(pk=mailing_pk, run_started_at__isnull=False)
+        .exclude(lease_owner="")
+        .values("total_count", "sent_count", "failed_count", "run_started_at")
+        .first()
+    )
+    if mailing is None:
+        return None
+    progress = {"sent": mailing["sent_count"], "failed": mailing["failed_count"], "total": mailing["total_count"]}
+    progress["remaining"] = max(0, progress["total"] - progress["sent"] - progress["failed"])
+    progress["started"] = mailing["run_started_at"].timestamp()
+    progress["finished"] = False
+    return progress
+
+
+@contextmanager
+def track_progress(mailing_pk: int, total: int) -> Iterator[None]:
+    """
+    Учитывает прогресс отправки рассылки на время блока.
+    :param mailing_pk: ID рассылки.
+    :param total: Количество получателей к отправке.
+    """
+    start_progress(mailing_pk, total)
+    try:
+        yield
+    finally:
+        finish_progress(mailing_pk)
+
+
+def progress_event(mailing_pk: int, previous: Optional[tuple] = None) -> tuple:
+    """
+    Формирует событие Server-Sent Events с прогрессом отправки рассылки.
+    Пока рассылка отправляется, данные берутся только из счетчиков; без счетчиков запрашивается статус рассылки
+    и наличие задания в очереди(ожидание исполнителя). Без CACHE_ENABLED, когда рассылку отправляет другой процесс,
+    счетчики читаются из строки рассылки(run_progress), журнал доставки(SendingAttempt) не запрашивается.
+    :param mailing_pk: ID рассылки.
+    :param previous: Состояние предыдущего события(обработано писем, время) для расчета текущей скорости.
+    :return: (текст события, состояние для следующего события, последнее ли событие)
+    """
+    progress = get_progress(mailing_pk)
+    if progress is None and not settings.CACHE_ENABLED:
+        progress = run_progress(mailing_pk)
+    now = time.monotonic()
+    if progress is None:
+        waiting = MailingJob.objects.filter(mailing_id=mailing_pk, status__in=("queued", "running")).exists()
+        status = Mailing.objects.filter(pk=mailing_pk).values_list("status", flat=True).first()
+        data = {"status": status, "waiting": waiting, "finished": not waiting}
+        return sse_event("progress", data), None, not waiting
+    processed = progress["sent"] + progress["failed"]
+    if previous is not None and now > previous[1]:
+        rate = (processed - previous[0]) / (now - previous[1])
+    else:
+        rate = processed / max(time.time() - progress["started"], 0.001)
+    data = {name: progress[name] for name in ("sent", "failed", "total", "remaining", "finished")}
+    data["rate"] = round(rate, 1)
+    return sse_event("progress", data), (processed, now), progress["finished"]
+
+
+def sse_event(event: str, data: dict) -> str:
+    """Событие Server-Sent Events с данными в JSON."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def aprogress_stream(mailing_pk: int, interval: Optional[float] = None) -> AsyncIterator[str]:
+    """
+    Поток событий прогресса отправки рассылки для асинхронного представления(ASGI): событие раз в interval секунд,
+    поток завершается после окончания отправки.
+    :param mailing_pk: ID рассылки.
+    :param interval: Пауза между событиями в секундах(по умолчанию MAILING_PROGRESS_INTERVAL).
+    """
+    interval = interval or settings.MAILING_PROGRESS_INTERVAL
+    previous = None
+    while True:
+        event, previous, finished = await sync_to_async(progress_event)(mailing_pk, previous)
+        yield event
+        if finished:
+            return
+        await asyncio.sleep(interval)
+
+
+def progress_stream(mailing_pk: int, interval: Optional[float] = None) -> Iterator[str]:
+    """
+    Поток событий прогресса отправки рассылки для сервера WSGI(занимает поток сервера на время отправки).
+    :param mailing_pk: ID рассылки.
+    :param interval: Пауза между событиями в секундах(по умолчанию MAILING_PROGRESS_INTERVAL).
+    """
+    interval = interval or settings.MAILING_PROGRESS_INTERVAL
+    previous = None
+    while True:
+        event, previous, finished = progress_event(mailing_pk, previous)
+        yield event
+        if finished:
+            return
+        time.sleep(interval)
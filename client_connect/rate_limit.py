@@ -0,0 +1,214 @@
+import asyncio
+import threading
+import time
+from typing import Optional
+
+import redis
+from django.core.cache import cache
+
+from client_connect.cache_client import redis_client
+from config import settings
+
+# Атомарное взятие токена из корзины в Redis. Время берется с сервера Redis, чтобы часы процессов не влияли.
+# Возвращает время ожидания в секундах(0 - токен получен) и текущую скорость корзины строками.
+TAKE_SCRIPT = """
+local rate = tonumber(redis.call('HGET', KEYS[1], 'rate')) or tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], 3600)
+return {tostring(wait), tostring(rate)}
+"""
+
+
+class TokenBucket:
+    """
+    Корзина токенов в памяти процесса: не больше rate писем в секунду, с накоплением до capacity
+    Атрибуты:
+        name(str): Название корзины
+        base_rate(float): Настроенное количество писем в секунду
+        capacity(float): Максимальное количество накопленных токенов(размер всплеска)
+    Методы:
+        take(self) -> float:
+            Пытается взять токен, возвращает 0 при успехе, иначе сколько секунд ждать.
+        acquire(self) -> None:
+            Ждет и берет токен.
+        rate(self) -> float:
+            Текущее количество писем в секунду(может быть снижено адаптацией).
+        set_rate(self, rate: float) -> None:
+            Устанавливает текущее количество писем в секунду.
+    """
+
+    def __init__(self, name: str, rate: float, capacity: Optional[float] = None) -> None:
+        self.name = name
+        self.base_rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._rate = rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> float:
+        """Пытается взять токен, возвращает 0 при успехе, иначе сколько секунд ждать."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self._rate
+
+    def acquire(self) -> None:
+        """Ждет и берет токен."""
+        while True:
+            wait = self.take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def rate(self) -> float:
+        """Текущее количество писем в секунду(может быть снижено адаптацией)."""
+        return self._rate
+
+    def set_rate(self, rate: float) -> None:
+        """Устанавливает текущее количество писем в секунду."""
+        with self._lock:
+            self._rate = rate
+
+
+class RedisTokenBucket(TokenBucket):
+    """
+    Корзина токенов в Redis, общая для всех процессов и серверов, использующих один Redis
+    Атрибуты:
+        key(str): Ключ корзины в Redis(с KEY_PREFIX кеша)
+        client(redis.Redis): Клиент Redis кеша Django(redis_client)
+    """
+
+    def __init__(self, name: str, rate: float, client: redis.Redis, capacity: Optional[float] = None) -> None:
+        super().__init__(name, rate, capacity)
+        self.key = cache.make_key(f"mailing:rate:{name}")
+        self.client = client
+        self._script = client.register_script(TAKE_SCRIPT)
+
+    def take(self) -> float:
+        """
+        Атомарно берет токен из корзины в Redis, возвращает 0 при успехе, иначе сколько секунд ждать.
+        Заодно запоминает текущую общую скорость, чтобы rate() не обращался к Redis.
+        """
+        wait, rate = self._script(keys=[self.key], args=[self.base_rate, self.capacity])
+        self._rate = float(rate)
+        return float(wait)
+
+    def rate(self) -> float:
+        """Общая для всех процессов скорость на момент последнего взятия токена."""
+        return self._rate
+
+    def set_rate(self, rate: float) -> None:
+        """Устанавливает общее для всех процессов количество писем в секунду."""
+        self._rate = rate
+        self.client.hset(self.key, "rate", str(rate))
+
+
+class RateLimiter:
+    """
+    Ограничитель скорости отправки: набор корзин токенов(SMTP сервер, рассылка) с адаптацией скорости.
+    При отложенной доставке(ответы 4xx сервера) скорость всех корзин снижается в MAILING_RATE_BACKOFF раз,
+    после успешных отправок постепенно возвращается к настроенной.
+    Атрибуты:
+        buckets(list): Корзины токенов, токен берется из каждой
+    Методы:
+        for_mailing(mailing: Mailing) -> RateLimiter:
+            Создает ограничитель для рассылки по настройкам SMTP сервера и рассылки.
+        acquire(self) -> None:
+            Ждет разрешения на отправку одного письма.
+        aacquire(self) -> None:
+            Асинхронно ждет разрешения на отправку одного письма, не блокируя цикл событий.
+        record(self, code: Optional[int]) -> None:
+            Учитывает результат отправки для адаптации скорости.
+    """
+
+    _local_buckets: dict = {}
+    _local_lock = threading.Lock()
+
+    def __init__(self, buckets: list) -> None:
+        self.buckets = buckets
+
+    @classmethod
+    def for_mailing(cls, mailing) -> "RateLimiter":
+        """
+        Создает ограничитель для рассылки по настройкам SMTP сервера и рассылки.
+        Корзины хранятся в Redis при включенном кешировании(CACHE_ENABLED), иначе в памяти процесса.
+        :param mailing: Модель рассылки(поле rate_limit - ограничение писем в секунду для рассылки).
+        :return: Ограничитель скорости, без корзин если ограничения не заданы.
+        """
+        buckets = []
+        if settings.MAILING_RELAY_RATE_LIMIT:
+            buckets.append(cls.get_bucket(f"relay:{settings.EMAIL_HOST}", settings.MAILING_RELAY_RATE_LIMIT))
+        if getattr(mailing, "rate_limit", None):
+            buckets.append(cls.get_bucket(f"mailing:{mailing.pk}", mailing.rate_limit))
+        return cls(buckets)
+
+    @classmethod
+    def get_bucket(cls, name: str, rate: float) -> TokenBucket:
+        """
+        Возвращает корзину токенов по названию: в Redis при CACHE_ENABLED, иначе общую для процесса.
+        :param name: Название корзины.
+        :param rate: Настроенное количество писем в секунду.
+        :return: Корзина токенов.
+        """
+        if settings.CACHE_ENABLED:
+            return RedisTokenBucket(name, rate, redis_client(), capacity=settings.MAILING_RATE_BURST or None)
+        with cls._local_lock:
+            bucket = cls._local_buckets.get(name)
+            if bucket is None or bucket.base_rate != rate:
+                bucket = TokenBucket(name, rate, capacity=settings.MAILING_RATE_BURST or None)
+                cls._local_buckets[name] = bucket
+        return bucket
+
+    def acquire(self) -> None:
+        """Ждет разрешения на отправку одного письма."""
+        for bucket in self.buckets:
+            bucket.acquire()
+
+    async def aacquire(self) -> None:
+        """Асинхронно ждет разрешения на отправку одного письма, не блокируя цикл событий."""
+        for bucket in self.buckets:
+            while True:
+                wait = bucket.take()
+                if not wait:
+                    break
+                await asyncio.sleep(wait)
+
+    def record(self, code: Optional[int]) -> None:
+        """
+        Учитывает результат отправки для адаптации скорости.
+        :param code: Код ответа SMTP сервера(None - письмо принято, 421/450/451/452 - сервер откладывает доставку).
+        """
+        for bucket in self.buckets:
+            rate = bucket.rate()
+            if is_deferral_code(code):
+                bucket.set_rate(max(settings.MAILING_RATE_MIN, rate * settings.MAILING_RATE_BACKOFF))
+            elif rate < bucket.base_rate:
+                # аддитивное восстановление: 1% настроенной скорости за каждое успешное письмо
+                bucket.set_rate(min(bucket.base_rate, rate + bucket.base_rate * 0.01))
+
+
+def is_deferral_code(code: Optional[int]) -> bool:
+    """
+    Проверяет, что код ответа SMTP сервера означает отложенную доставку из-за превышения скорости.
+    :param code: Код ответа SMTP сервера.
+    :return: True для кодов 421, 450, 451, 452.
+    """
+    return code in (421, 450, 451, 452)
@@ -0,0 +1,242 @@
+import smtplib
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from client_connect.circuit import CircuitBreaker
+from config import settings
+
+BALANCING = ("weighted", "least_outstanding")
+
+
+@dataclass
+class RelayConfig:
+    """
+    Настройки одного SMTP сервера из EMAIL_RELAYS
+    Атрибуты:
+        host(str): Адрес SMTP сервера
+        port(int): Порт SMTP сервера
+        weight(int): Вес сервера при распределении писем
+        concurrency(int): Максимальное количество соединений с сервером
+    """
+
+    host: str
+    port: int
+    weight: int = 1
+    concurrency: int = 4
+
+    @property
+    def name(self) -> str:
+        """Название сервера: <адрес>:<порт>."""
+        return f"{self.host}:{self.port}"
+
+
+def parse_relays(value: Optional[str]) -> list:
+    """
+    Разбирает список SMTP серверов из строки вида 'smtp1.example.com:587=3/10,smtp2.example.com=1/4'
+    (адрес:порт=вес/соединений, по умолчанию порт EMAIL_PORT, вес 1, соединений EMAIL_POOL_SIZE).
+    :param value: Строка настройки EMAIL_RELAYS.
+    :return: Список настроек серверов(RelayConfig).
+    :raise ValueError: Если строка записана с ошибкой.
+    """
+    relays = []
+    for item in (value or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        address, _, limits = item.partition("=")
+        host, _, port = address.strip().partition(":")
+        weight, _, concurrency = limits.partition("/")
+        try:
+            relay = RelayConfig(
+                host, int(port or settings.EMAIL_PORT), int(weight or 1), int(concurrency or settings.EMAIL_POOL_SIZE)
+            )
+        except ValueError:
+            raise ValueError(f"Неверный SMTP сервер в EMAIL_RELAYS: {item}")
+        if not host or relay.weight < 1 or relay.concurrency < 1:
+            raise ValueError(f"Неверный SMTP сервер в EMAIL_RELAYS: {item}")
+        relays.append(relay)
+    return relays
+
+
+def relays_name(relays: list) -> str:
+    """Название группы SMTP серверов для общего автоматического выключателя группы."""
+    return "relays:" + ",".join(relay.name for relay in relays)
+
+
+def relay_group_name() -> str:
+    """Название SMTP сервера(EMAIL_HOST:EMAIL_PORT) или группы серверов(EMAIL_RELAYS) из настроек."""
+    relays = parse_relays(settings.EMAIL_RELAYS)
+    return relays_name(relays) if relays else f"{settings.EMAIL_HOST}:{settings.EMAIL_PORT}"
+
+
+def is_connection_error(exc_info: Exception) -> bool:
+    """
+    Проверяет, что отправка не удалась из-за SMTP сервера, а не письма: сервер недоступен, соединение оборвано,
+    истек таймаут или сервер ответил 421. Такое письмо можно отправить через другой сервер.
+    :param exc_info: Исключение, возникшее при отправке письма.
+    """
+    if isinstance(exc_info, smtplib.SMTPResponseException):
+        return exc_info.smtp_code == 421
+    return isinstance(exc_info, (smtplib.SMTPServerDisconnected, OSError, TimeoutError))
+
+
+@dataclass
+class RelayStats:
+    """
+    Статистика отправки через один SMTP сервер с момента создания пула
+    Атрибуты:
+        sent(int): Количество принятых сервером получателей
+        failed(int): Количество отклоненных сервером получателей
+        errors(int): Количество отправок, не выполненных из-за ошибки сервера(переданы другому серверу)
+        transactions(int): Количество SMTP транзакций
+        busy(float): Суммарное время отправок в секундах
+        started(float): Время первой отправки(time.monotonic), 0 - отправок не было
+    """
+
+    sent: int = 0
+    failed: int = 0
+    errors: int = 0
+    transactions: int = 0
+    busy: float = 0.0
+    started: float = 0.0
+
+    def as_dict(self) -> dict:
+        """Статистика с производными показателями: писем в секунду и средняя длительность транзакции."""
+        elapsed = time.monotonic() - self.started if self.started else 0.0
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "errors": self.errors,
+            "rate": round(self.sent / elapsed, 1) if elapsed else 0.0,
+            "latency": round(self.busy / self.transactions, 4) if self.transactions else 0.0,
+        }
+
+
+@dataclass(eq=False)
+class Relay:
+    """
+    SMTP сервер группы с пулом соединений и состоянием балансировки
+    Атрибуты:
+        config(RelayConfig): Настройки сервера
+        pool: Пул соединений с сервером(SMTPConnectionPool или AsyncSMTPConnectionPool)
+        breaker(CircuitBreaker): Автоматический выключатель сервера, None - выключатель отключен
+        outstanding(int): Количество отправок через сервер, выполняющихся сейчас
+        stats(RelayStats): Статистика отправки через сервер
+        current_weight(int): Текущий вес плавного взвешенного кругового обхода
+    """
+
+    config: RelayConfig
+    pool: object
+    breaker: Optional[CircuitBreaker] = None
+    outstanding: int = 0
+    stats: RelayStats = field(default_factory=RelayStats)
+    current_weight: int = 0
+
+    @property
+    def name(self) -> str:
+        """Название сервера: <адрес>:<порт>."""
+        return self.config.name
+
+
+class RelayBalancer:
+    """
+    Распределение писем между SMTP серверами группы.
+    'weighted' - плавный взвешенный круговой обход(доля писем сервера пропорциональна весу),
+    'least_outstanding' - сервер с наименьшим количеством выполняющихся отправок на единицу веса.
+    Серверы с разомкнутым автоматическим выключателем пропускаются, сервер без свободных соединений
+    выбирается, только если свободных серверов нет.
+    Атрибуты:
+        relays(list): SMTP серверы группы(Relay)
+        strategy(str): Способ распределения: 'weighted' или 'least_outstanding'
+    Методы:
+        choose(self, exclude: tuple = ()) -> Optional[Relay]:
+            Выбирает сервер для отправки и учитывает начатую отправку.
+        record(self, relay: Relay, started: float, results: Optional[tuple] = None) -> None:
+            Учитывает отправку через сервер в статистике и автоматическом выключателе сервера.
+        release(self, relay: Relay) -> None:
+            Учитывает завершение отправки(или возврат соединения), выбранной через choose.
+        stats(self) -> dict:
+            Статистика отправки по серверам {сервер: показатели}.
+        for_relays(configs: list, make_pool, strategy: Optional[str] = None) -> RelayBalancer:
+            Создает распределение писем по настройкам серверов.
+    """
+
+    def __init__(self, relays: list, strategy: Optional[str] = None) -> None:
+        self.relays = relays
+        self.strategy = strategy or settings.EMAIL_RELAY_BALANCING
+        if self.strategy not in BALANCING:
+            raise ValueError(f"Неизвестный способ распределения писем: {self.strategy}")
+        self._lock = threading.Lock()
+
+    def choose(self, exclude: tuple = ()) -> Optional[Relay]:
+        """
+        Выбирает сервер для отправки и учитывает начатую отправку.
+        :param exclude: Серверы, которые уже не смогли отправить это письмо.
+        :return: Сервер, либо None, если доступных серверов нет.
+        """
+        with self._lock:
+            available = [
+                relay
+                for relay in self.relays
+                if relay not in exclude and (relay.breaker is None or not relay.breaker.wait_time())
+            ]
+            free = [relay for relay in available if relay.outstanding < relay.config.concurrency]
+            candidates = free or available
+            if not candidates:
+                return None
+            if self.strategy == "least_outstanding":
+                relay = min(candidates, key=lambda candidate: candidate.outstanding / candidate.config.weight)
+            else:
+                total = 0
+                for candidate in candidates:
+                    candidate.current_weight += candidate.config.weight
+                    total += candidate.config.weight
+                relay = max(candidates, key=lambda candidate: candidate.current_weight)
+                relay.current_weight -= total
+            relay.outstanding += 1
+            if relay.breaker is not None:
+                relay.breaker.start()
+            if not relay.stats.started:
+                relay.stats.started = time.monotonic()
+            return relay
+
+    def record(self, relay: Relay, started: float, results: Optional[tuple] = None) -> None:
+        """
+        Учитывает отправку через сервер в статистике и автоматическом выключателе сервера.
+        :param relay: Сервер, выбранный через choose.
+        :param started: Время начала отправки(time.monotonic).
+        :param results: (принято получателей, отклонено получателей), None - ошибка сервера.
+        """
+        with self._lock:
+            relay.stats.transactions += 1
+            relay.stats.busy += time.monotonic() - started
+            if results is None:
+                relay.stats.errors += 1
+            else:
+                relay.stats.sent += results[0]
+                relay.stats.failed += results[1]
+        if relay.breaker is not None:
+            relay.breaker.record_call(failed=results is None)
+
+    def release(self, relay: Relay) -> None:
+        """Учитывает завершение отправки(или возврат соединения), выбранной через choose."""
+        with self._lock:
+            relay.outstanding -= 1
+
+    def stats(self) -> dict:
+        """Статистика отправки по серверам {сервер: показатели}."""
+        with self._lock:
+            return {relay.name: relay.stats.as_dict() for relay in self.relays}
+
+    @classmethod
+    def for_relays(cls, configs: list, make_pool, strategy: Optional[str] = None) -> "RelayBalancer":
+        """
+        Создает распределение писем по настройкам серверов.
+        :param configs: Настройки серверов(RelayConfig).
+        :param make_pool: Функция создания пула соединений по настройкам сервера.
+        :param strategy: Способ распределения(по умолчанию EMAIL_RELAY_BALANCING).
+        """
+        relays = [Relay(config, make_pool(config), CircuitBreaker.for_relay(config.name)) for config in configs]
+        return cls(relays, strategy)
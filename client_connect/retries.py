@@ -0,0 +1,79 @@
+import random
+from datetime import datetime, timedelta
+from typing import Optional
+
+from django.utils import timezone
+
+from client_connect.models import DeliveryRetry, Mailing
+from config import settings
+
+
+def is_transient_failure(status: str, code: Optional[int]) -> bool:
+    """
+    Проверяет, что неудачную отправку имеет смысл повторить позже.
+    Временные ошибки - ответы сервера 4xx и обрывы соединения(код ответа отсутствует),
+    ответы 5xx - постоянные ошибки, повтор не поможет.
+    :param status: Статус попытки('success' или 'fail').
+    :param code: Код ответа SMTP сервера.
+    :return: True для временной ошибки.
+    """
+    return status == "fail" and (code is None or 400 <= code < 500)
+
+
+def retry_delay(attempts: int) -> float:
+    """
+    Задержка перед следующей попыткой: экспоненциальный рост от MAILING_RETRY_BASE_DELAY
+    до MAILING_RETRY_MAX_DELAY со случайным разбросом, чтобы повторы разных получателей не совпадали.
+    :param attempts: Количество уже сделанных неудачных попыток.
+    :return: Задержка в секундах.
+    """
+    delay = min(settings.MAILING_RETRY_MAX_DELAY, settings.MAILING_RETRY_BASE_DELAY * 2 ** (attempts - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def schedule_retries(results: list, mailing: Mailing, now: Optional[datetime] = None) -> None:
+    """
+    Обновляет расписание повторных отправок по результатам отправки пачки писем.
+    Временная ошибка планирует повтор(не больше MAILING_RETRY_MAX_ATTEMPTS попыток), успешная отправка,
+    постоянная ошибка или исчерпание попыток удаляют запланированный повтор получателю.
+    :param results: Список результатов отправки(DeliveryResult).
+    :param mailing: Модель рассылки.
+    :param now: Текущее время(по умолчанию timezone.now()).
+    """
+    results = [result for result in results if result.recipient_id is not None]
+    if not results:
+        return
+    now = now or timezone.now()
+    existing = {
+        retry.recipient_id: retry
+        for retry in DeliveryRetry.objects.filter(
+            mailing=mailing, recipient_id__in=[result.recipient_id for result in results]
+        )
+    }
+    to_create, to_update, to_delete = [], [], []
+    for result in results:
+        retry = existing.get(result.recipient_id)
+        attempts = retry.attempts + 1 if retry is not None else 1
+        if not is_transient_failure(result.status, result.code) or attempts >= settings.MAILING_RETRY_MAX_ATTEMPTS:
+            if retry is not None:
+                to_delete.append(retry.pk)
+            continue
+        next_attempt_at = now + timedelta(seconds=retry_delay(attempts))
+        if retry is None:
+            to_create.append(
+                DeliveryRetry(
+                    mailing=mailing,
+                    recipient_id=result.recipient_id,
+                    next_attempt_at=next_attempt_at,
+                    last_answer=result.answer,
+                )
+            )
+        else:
+            retry.attempts, retry.next_attempt_at, retry.last_answer = attempts, next_attempt_at, result.answer
+            to_update.append(retry)
+    if to_delete:
+        DeliveryRetry.objects.filter(pk__in=to_delete).delete()
+    if to_update:
+        DeliveryRetry.objects.bulk_update(to_update, ["attempts", "next_attempt_at", "last_answer"])
+    if to_create:
+        DeliveryRetry.objects.bulk_create(to_create, ignore_conflicts=True)
@@ -0,0 +1,84 @@
+import heapq
+from datetime import datetime, timedelta
+from typing import Optional
+
+from client_connect.models import Mailing
+from config import settings
+
+
+def next_run_time(start_time: datetime, repeat: str, now: datetime) -> datetime:
+    """
+    Возвращает время следующего запуска повторяющейся рассылки: ближайшее после now время из ряда
+    start_time + k * интервал повтора. Пропущенные запуски(планировщик был остановлен) не догоняются.
+    :param start_time: Запланированное время запуска.
+    :param repeat: Повтор рассылки('hourly', 'daily', 'weekly').
+    :param now: Текущее время.
+    :return: Время следующего запуска.
+    """
+    interval = Mailing.REPEAT_INTERVALS[repeat]
+    if start_time > now:
+        return start_time
+    return start_time + interval * ((now - start_time) // interval + 1)
+
+
+class MailingScheduler:
+    """
+    Очередь запланированных запусков рассылок в памяти: куча по времени запуска(heapq).
+    Очередь заполняется индексированным запросом(status, start_time) только рассылками, время которых наступит
+    до следующего обновления, поэтому планировщик просыпается точно ко времени ближайшего запуска
+    и не перебирает все рассылки.
+    Атрибуты:
+        poll_interval(float): Через сколько секунд перечитывать расписание из БД
+    Методы:
+        refresh(self, now: datetime) -> None:
+            Перечитывает запланированные рассылки, время которых наступит до следующего обновления.
+        needs_refresh(self, now: datetime) -> bool:
+            Пора ли перечитать расписание из БД.
+        pop_due(self, now: datetime) -> list:
+            Забирает из очереди ID рассылок, время запуска которых наступило.
+        wait_time(self, now: datetime) -> float:
+            Сколько секунд спать до ближайшего запуска или обновления расписания.
+    """
+
+    def __init__(self, poll_interval: Optional[float] = None) -> None:
+        self.poll_interval = poll_interval or settings.MAILING_SCHEDULER_POLL_INTERVAL
+        self._heap: list = []
+        self._refresh_at: Optional[datetime] = None
+
+    def refresh(self, now: datetime) -> None:
+        """
+        Перечитывает запланированные рассылки, время которых наступит до следующего обновления.
+        :param now: Текущее время.
+        """
+        self._refresh_at = now + timedelta(seconds=self.poll_interval)
+        self._heap = list(
+            Mailing.objects.filter(status="scheduled", start_time__lte=self._refresh_at)
+            .order_by("start_time")
+            .values_list("start_time", "pk")
+        )
+        heapq.heapify(self._heap)
+
+    def needs_refresh(self, now: datetime) -> bool:
+        """Пора ли перечитать расписание из БД."""
+        return self._refresh_at is None or now >= self._refresh_at
+
+    def pop_due(self, now: datetime) -> list:
+        """
+        Забирает из очереди ID рассылок, время запуска которых наступило.
+        :param now: Текущее время.
+        :return: Список ID рассылок в порядке времени запуска.
+        """
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due.append(heapq.heappop(self._heap)[1])
+        return due
+
+    def wait_time(self, now: datetime) -> float:
+        """
+        Сколько секунд спать до ближайшего запуска или обновления расписания.
+        :param now: Текущее время.
+        """
+        wake_at = self._refresh_at or now
+        if self._heap:
+            wake_at = min(wake_at, self._heap[0][0])
+        return max(0.0, (wake_at - now).total_seconds())
@@ -1,14 +1,24 @@
-import smtplib
-from typing import Callable, Optional
+from datetime import datetime, timedelta
+from itertools import groupby
+from typing import Callable, Iterable, Optional, Union
 
-from django.core.mail import send_mail
-from django.db.models import Model
+from django.db import transaction
+from django.db.models import Count, Exists, F, Max, Model, OuterRef, Q, QuerySet
 from django.http import HttpResponseForbidden
 from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.views.decorators.cache import cache_page
 
-from client_connect.models import Mailing, Message, SendingAttempt
+from client_connect.async_delivery import AsyncDeliveryEngine
+from client_connect.cancellation import clear_cancel, request_cancel
+from client_connect.delivery import DeliveryReport, DeliveryResult, ThreadedDeliveryEngine, build_message
+from client_connect.leases import (LeaseHeartbeat, acquire_lease, lease_available, lease_owner_name, mailing_lease,
+                                   release_lease)
+from client_connect.models import DeliveryRetry, Mailing, MailingJob, Message, SendingAttempt
+from client_connect.progress import track_progress
+from client_connect.rate_limit import RateLimiter
+from client_connect.scheduler import next_run_time
+from client_connect.smtp_pool import get_connection_pool
 from config import settings
 from config.settings import CACHE_ENABLED
 from users.models import CustomUser
@@ -102,45 +112,450 @@ class AccessControlService:
 class MailingService:
     """
     Сервисный класс для работы с рассылкой
+    Атрибуты:
+        ENGINES(dict): Доступные движки отправки: 'threaded' - пул потоков, 'async' - asyncio
     Методы:
+        get_engine(name: Optional[str] = None, **options) -> Union[ThreadedDeliveryEngine, AsyncDeliveryEngine]:
+            Возвращает движок отправки по названию.
         update_status(mailing: Mailing, status: str = "created") -> None:
             Обновляет статус рассылки и фиксирует временные метки.
-        send_messages(recipients: list, message: Message, mailing: Mailing) -> None:
-            Отправляет сообщения получателям и фиксирует результаты.
+        cancel_mailing(mailing: Mailing) -> None:
+            Отключает рассылку: останавливает идущую отправку и снимает задания из очереди.
+        send_message(subject: str, body: str, from_email: str, recipient: str) -> None:
+            Отправляет письмо одному получателю через общий пул SMTP соединений.
+        begin_run(mailing: Mailing, resume: bool = False) -> None:
+            Отмечает начало запуска отправки рассылки и снимает флаг отмены прошлого отключения.
+        get_recipients(mailing: Mailing, resume: bool = False) -> QuerySet:
+            Возвращает строки получателей рассылки {'id', 'email', 'full_name'} в порядке ID.
+        send_messages(recipients: Iterable[dict], message: Message, mailing: Mailing,
+                      on_result: Optional[Callable] = None, engine: Optional[str] = None) -> DeliveryReport:
+            Отправляет сообщения получателям через выбранный движок отправки и фиксирует результаты.
+        run_mailing(mailing: Mailing, engine: Optional[str] = None, resume: bool = False,
+                    owner: Optional[str] = None) -> DeliveryReport:
+            Запускает рассылку: статус 'launched', отправка получателям, статус 'done'.
+        recount_counters(mailings: QuerySet) -> int:
+            Пересчитывает счетчики рассылок по журналу доставки и списку получателей.
     """
 
+    ENGINES = {
+        "threaded": ThreadedDeliveryEngine,
+        "async": AsyncDeliveryEngine,
+    }
+
+    @staticmethod
+    def get_engine(name: Optional[str] = None, **options) -> Union[ThreadedDeliveryEngine, AsyncDeliveryEngine]:
+        """
+        Возвращает движок отправки по названию.
+        :param name: Название движка(по умолчанию config.settings.MAILING_ENGINE)
+        :param options: Параметры конструктора движка(например rate_limiter)
+        :return: Экземпляр движка отправки
+        :raise ValueError: Если движок с таким названием не существует
+        """
+        name = name or settings.MAILING_ENGINE
+        if name not in MailingService.ENGINES:
+            raise ValueError(f"Неизвестный движок отправки: {name}")
+        return MailingService.ENGINES[name](**options)
+
     @staticmethod
     def update_status(mailing: Mailing, status: str = "created") -> None:
         """
         Обновляет статус рассылки и фиксирует временные метки.
+        Статус 'disable' выставляет флаг отмены для идущей отправки, статус 'launched' снимает его.
         :param mailing: Модель рассылки.
         :param status: Статус рассылки(по умолчанию created - создана)
         """
         if status == "launched":
             mailing.start_time = timezone.now()
+            clear_cancel(mailing.pk)
         elif status == "done":
             mailing.end_time = timezone.now()
         mailing.status = status
-        mailing.save()
+        mailing.save(update_fields=["status", "start_time", "end_time"])
+        if status == "disable":
+            request_cancel(mailing.pk)
+
+    @staticmethod
+    def cancel_mailing(mailing: Mailing) -> None:
+        """
+        Отключает рассылку: останавливает идущую отправку во всех процессах и снимает задания из очереди.
+        :param mailing: Модель рассылки.
+        """
+        MailingService.update_status(mailing, "disable")
+        MailingJob.objects.filter(mailing=mailing, status="queued").update(
+            status="failed", error="Рассылка отключена", finished_at=timezone.now()
+        )
+
+    @staticmethod
+    def send_message(subject: str, body: str, from_email: str, recipient: str) -> None:
+        """
+        Отправляет письмо одному получателю через общий пул SMTP соединений.
+        :param subject: Тема письма.
+        :param body: Текст письма.
+        :param from_email: Адрес отправителя.
+        :param recipient: Адрес получателя.
+        :raise smtplib.SMTPException: Если SMTP сервер отклонил письмо.
+        """
+        email = build_message(subject, body, from_email, recipient)
+        get_connection_pool().send(from_email, [recipient], email)
+
+    @staticmethod
+    def begin_run(mailing: Mailing, resume: bool = False) -> None:
+        """
+        Отмечает начало запуска отправки рассылки(run_started_at): по нему продолжение рассылки пропускает только
+        получателей, которым письмо доставлено в этом запуске, а не в прошлых запусках повторяющейся рассылки.
+        Флаг отмены прошлого отключения снимается, если рассылка не отключена: иначе запуск командой send_mailing,
+        которая не меняет статус рассылки, остановился бы сразу.
+        Счетчики отправки(sent_count, failed_count) относятся к текущему запуску и обнуляются, количество
+        получателей(total_count) пересчитывается: отправленные и неотправленные не превышают получателей
+        и у повторяющейся рассылки.
+        :param mailing: Модель рассылки.
+        :param resume: Продолжение прерванного запуска(в том числе после перехвата аренды) - начало и счетчики
+                       не меняются.
+        """
+        if mailing.status != "disable":
+            clear_cancel(mailing.pk)
+        if resume:
+            return
+        mailing.run_started_at = timezone.now()
+        mailing.total_count = mailing.recipients.count()
+        mailing.sent_count = mailing.failed_count = 0
+        mailing.save(update_fields=["run_started_at", "total_count", "sent_count", "failed_count"])
 
     @staticmethod
-    def send_messages(recipients: list, message: Message, mailing: Mailing) -> None:
+    def get_recipients(mailing: Mailing, resume: bool = False) -> QuerySet:
+        """
+        Возвращает строки получателей рассылки {'id', 'email', 'full_name'} в порядке ID.
+        Адрес и Ф.И.О. используются для подстановок в тему и текст сообщения.
+        :param mailing: Модель рассылки.
+        :param resume: Пропустить получателей, которым письмо уже доставлено в текущем запуске
+                       (по журналу доставки SendingAttempt с начала запуска run_started_at).
+        :return: QuerySet словарей с ID, адресом и Ф.И.О. получателя.
         """
-        Отправляет сообщения получателям и фиксирует результаты.
+        recipients = mailing.recipients.order_by("id")
+        if resume:
+            delivered = SendingAttempt.objects.filter(mailing=mailing, status="success", recipient__isnull=False)
+            if mailing.run_started_at is not None:
+                delivered = delivered.filter(created_at__gte=mailing.run_started_at)
+            delivered = delivered.values("recipient_id")
+            recipients = recipients.exclude(id__in=delivered)
+        return recipients.values("id", "email", "full_name")
+
+    @staticmethod
+    def send_messages(
+        recipients: Iterable[dict],
+        message: Message,
+        mailing: Mailing,
+        on_result: Optional[Callable[[DeliveryResult], None]] = None,
+        engine: Optional[str] = None,
+    ) -> DeliveryReport:
+        """
+        Отправляет сообщения получателям через выбранный движок отправки и фиксирует результаты.
+        По умолчанию используется движок из настройки MAILING_ENGINE ('threaded' - пул потоков, 'async' - asyncio).
         С проверкой статуса, если отключена, то останавливает цикл.
-        :param recipients: Список получателей.
+        Скорость отправки ограничивается общими для всех процессов корзинами токенов SMTP сервера и рассылки.
+        :param recipients: Строки получателей {'id': ID получателя, 'email': адрес}. QuerySet не загружается
+                           целиком, движок читает его порциями по MAILING_RECIPIENTS_CHUNK_SIZE строк.
         :param message: Модель сообщения.
         :param mailing: Модель рассылки.
+        :param on_result: Функция, вызываемая для каждого результата отправки.
+        :param engine: Название движка отправки.
+        :return: Итог отправки рассылки.
         """
-        subject = message.subject
-        message = message.body
-        for recipient in recipients:
-            try:
-                from_email = settings.DEFAULT_FROM_EMAIL
-                if mailing.status == "disable":
-                    break
-                send_mail(subject, message, from_email, [recipient])
-            except smtplib.SMTPException as exc_info:
-                SendingAttempt.objects.create(status="fail", answer=str(exc_info), mailing=mailing)
+        delivery_engine = MailingService.get_engine(
+            engine,
+            rate_limiter=RateLimiter.for_mailing(mailing),
+            rcpt_batch_size=settings.MAILING_RCPT_BATCH_SIZE if mailing.batch_send else 1,
+        )
+        return delivery_engine.deliver(
+            recipients=recipients,
+            subject=message.subject,
+            body=message.body,
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            mailing=mailing,
+            on_result=on_result,
+        )
+
+    @staticmethod
+    def run_mailing(
+        mailing: Mailing, engine: Optional[str] = None, resume: bool = False, owner: Optional[str] = None
+    ) -> DeliveryReport:
+        """
+        Запускает рассылку: статус 'launched', отправка получателям, статус 'done'.
+        Прогресс отправки учитывается в счетчиках(track_progress) для страницы рассылки.
+        Рассылку отправляет только исполнитель, получивший ее аренду(mailing_lease), аренда продлевается
+        во время отправки. Если аренда забрана после сбоя другого исполнителя, отправка продолжается с места остановки:
+        пропускаются получатели, которым письмо доставлено в прерванном запуске(run_started_at).
+        Если отправка остановлена отключением рассылки, статус 'disable' сохраняется.
+        Запланированная рассылка(статус 'scheduled') после отправки снова планируется на start_time,
+        повторяющаяся - на ближайшее время следующего повтора.
+        :param mailing: Модель рассылки.
+        :param engine: Название движка отправки.
+        :param resume: Продолжить прерванный запуск - пропустить получателей, которым письмо уже доставлено
+                       в этом запуске.
+        :param owner: Исполнитель(по умолчанию <хост>-<pid>).
+        :return: Итог отправки рассылки.
+        :raise MailingLeaseError: Если рассылку отправляет другой исполнитель, либо аренда потеряна во время отправки.
+        """
+        with mailing_lease(mailing.pk, owner) as lease:
+            next_run = mailing.start_time if mailing.status == "scheduled" else None
+            if lease.taken_over and mailing.status == "launched":
+                resume, next_run = True, None
+            MailingService.begin_run(mailing, resume)
+            MailingService.update_status(mailing, "launched")
+            recipients = MailingService.get_recipients(mailing, resume=resume)  # читается движком порциями
+            with track_progress(mailing.pk, recipients.count()):
+                report = MailingService.send_messages(
+                    recipients=recipients, message=mailing.message, mailing=mailing, engine=engine
+                )
+        if not report.stopped:
+            MailingService.update_status(mailing, "done")
+            now = timezone.now()
+            if next_run is not None and mailing.repeat:
+                next_run = next_run_time(next_run, mailing.repeat, now)
+            if next_run is not None and next_run > now:
+                mailing.status, mailing.start_time = "scheduled", next_run
+                mailing.save(update_fields=["status", "start_time"])
+        return report
+
+    @staticmethod
+    def recount_counters(mailings: QuerySet) -> int:
+        """
+        Пересчитывает счетчики рассылок(total_count, sent_count, failed_count, last_attempt_at)
+        по журналу доставки и списку получателей: по одному агрегирующему запросу на таблицу.
+        Отправленные и неотправленные считаются по попыткам текущего запуска(с run_started_at).
+        :param mailings: QuerySet рассылок.
+        :return: Количество обновленных рассылок.
+        """
+        current_run = Q(mailing__run_started_at__isnull=True) | Q(created_at__gte=F("mailing__run_started_at"))
+        # неотправленный получатель - неуспешная попытка, после которой ему ничего не отправлялось
+        later = SendingAttempt.objects.filter(mailing=OuterRef("mailing"), recipient=OuterRef("recipient")).filter(
+            Q(created_at__gt=OuterRef("created_at")) | Q(created_at=OuterRef("created_at"), pk__gt=OuterRef("pk"))
+        )
+        attempts = {
+            row["mailing"]: row
+            for row in SendingAttempt.objects.filter(mailing__in=mailings)
+            .values("mailing")
+            .annotate(
+                sent=Count("id", filter=Q(status="success") & current_run),
+                failed=Count("id", filter=Q(status="fail") & ~Q(Exists(later)) & current_run),
+                last=Max("created_at"),
+            )
+        }
+        updated = []
+        for mailing in mailings.annotate(recipients_total=Count("recipients")).only("pk"):
+            row = attempts.get(mailing.pk, {})
+            mailing.total_count = mailing.recipients_total
+            mailing.sent_count = row.get("sent", 0)
+            mailing.failed_count = row.get("failed", 0)
+            mailing.last_attempt_at = row.get("last")
+            updated.append(mailing)
+        Mailing.objects.bulk_update(updated, ["total_count", "sent_count", "failed_count", "last_attempt_at"])
+        return len(updated)
+
+
+class MailingJobService:
+    """
+    Сервисный класс для работы с очередью заданий рассылки(таблица MailingJob, без внешнего брокера)
+    Методы:
+        enqueue(mailing: Mailing, engine: Optional[str] = None, resume: bool = False) -> MailingJob:
+            Ставит рассылку в очередь, если по ней нет ожидающего или выполняемого задания.
+        claim(worker: str) -> Optional[MailingJob]:
+            Забирает самое старое задание из очереди, не блокируясь на заданиях других исполнителей.
+        execute(job: MailingJob) -> Optional[DeliveryReport]:
+            Выполняет задание и фиксирует результат в задании.
+        enqueue_scheduled(pk: int, now: Optional[datetime] = None) -> Optional[MailingJob]:
+            Ставит в очередь запланированную рассылку, время запуска которой наступило.
+    """
+
+    @staticmethod
+    def enqueue(mailing: Mailing, engine: Optional[str] = None, resume: bool = False) -> MailingJob:
+        """
+        Ставит рассылку в очередь, если по ней нет ожидающего или выполняемого задания.
+        :param mailing: Модель рассылки.
+        :param engine: Название движка отправки(по умолчанию MAILING_ENGINE).
+        :param resume: Продолжить с места остановки - пропустить получателей, которым письмо уже доставлено.
+        :return: Новое или уже существующее задание рассылки.
+        """
+        with transaction.atomic():
+            Mailing.objects.select_for_update().filter(pk=mailing.pk).first()  # блокировка от двойной постановки
+            job = MailingJob.objects.filter(mailing=mailing, status__in=("queued", "running")).first()
+            if job is None:
+                job = MailingJob.objects.create(mailing=mailing, engine=engine or "", resume=resume)
+        return job
+
+    @staticmethod
+    def claim(worker: str) -> Optional[MailingJob]:
+        """
+        Забирает самое старое задание из очереди, не блокируясь на заданиях других исполнителей.
+        Используется SELECT ... FOR UPDATE SKIP LOCKED, поэтому несколько исполнителей не получат одно задание.
+        Вместе с заданием исполнитель забирает аренду рассылки; задания рассылок, которые отправляет другой
+        исполнитель, пропускаются. Брошенное выполняемое задание забирается повторно и продолжается с места остановки:
+        аренда рассылки истекла(исполнитель упал) или аренды нет, а задание не отправляло писем дольше
+        MAILING_LEASE_TTL секунд(исполнитель упал после освобождения аренды, не записав результат).
+        :param worker: Имя исполнителя.
+        :return: Задание со статусом 'running', либо None, если очередь пуста.
+        """
+        now = timezone.now()
+        idle_since = now - timedelta(seconds=settings.MAILING_LEASE_TTL)
+        abandoned = Q(mailing__lease_expires_at__lt=now) | (
+            Q(mailing__lease_owner="", started_at__lt=idle_since)
+            & (Q(mailing__last_attempt_at__isnull=True) | Q(mailing__last_attempt_at__lt=idle_since))
+        )
+        with transaction.atomic():
+            jobs = (
+                MailingJob.objects.select_for_update(skip_locked=True, of=("self",))
+                .filter(Q(status="queued") | (Q(status="running") & abandoned))
+                .filter(lease_available(worker, now, prefix="mailing__"))
+                .order_by("created_at")
+            )
+            for job in jobs[: settings.MAILING_WORKERS]:
+                if acquire_lease(job.mailing_id, worker) is None:
+                    continue
+                job.resume = job.resume or job.status == "running"
+                job.status = "running"
+                job.worker = worker
+                job.started_at = timezone.now()
+                job.attempts += 1
+                job.save(update_fields=["status", "worker", "started_at", "attempts", "resume"])
+                return job
+        return None
+
+    @staticmethod
+    def execute(job: MailingJob) -> Optional[DeliveryReport]:
+        """
+        Выполняет задание и фиксирует результат в задании.
+        Результат не записывается, если задание забрал другой исполнитель после истечения аренды рассылки.
+        Если исполнитель остановлен во время отправки(KeyboardInterrupt), задание возвращается в очередь
+        и продолжится с места остановки.
+        :param job: Задание со статусом 'running'.
+        :return: Итог отправки рассылки, либо None, если задание завершилось ошибкой.
+        """
+        report = None
+        try:
+            mailing = Mailing.objects.select_related("message").get(pk=job.mailing_id)
+            report = MailingService.run_mailing(
+                mailing, engine=job.engine or None, resume=job.resume, owner=job.worker or None
+            )
+        except Exception as exc_info:
+            job.status = "failed"
+            job.error = str(exc_info) or exc_info.__class__.__name__
+        except BaseException:
+            job.status, job.resume = "queued", True
+            MailingJob.objects.filter(pk=job.pk, worker=job.worker, attempts=job.attempts).update(
+                status=job.status, resume=True, worker=""
+            )
+            raise
+        else:
+            job.status = "done"
+            job.error = ""
+        job.finished_at = timezone.now()
+        MailingJob.objects.filter(pk=job.pk, worker=job.worker, attempts=job.attempts).update(
+            status=job.status, error=job.error, finished_at=job.finished_at
+        )
+        return report
+
+    @staticmethod
+    def enqueue_scheduled(pk: int, now: Optional[datetime] = None) -> Optional[MailingJob]:
+        """
+        Ставит в очередь запланированную рассылку, время запуска которой наступило.
+        Рассылка без повтора получает статус 'created', у повторяющейся start_time переносится на следующий
+        повтор, чтобы планировщик не запустил ее повторно. Отправку выполнит команда run_mail_worker.
+        :param pk: ID рассылки.
+        :param now: Текущее время(по умолчанию timezone.now()).
+        :return: Задание рассылки, либо None, если рассылка изменена или отключена после чтения расписания.
+        """
+        now = now or timezone.now()
+        with transaction.atomic():
+            mailing = (
+                Mailing.objects.select_for_update().filter(pk=pk, status="scheduled", start_time__lte=now).first()
+            )
+            if mailing is None:
+                return None
+            if mailing.repeat:
+                mailing.start_time = next_run_time(mailing.start_time, mailing.repeat, now)
             else:
-                SendingAttempt.objects.create(status="success", answer="Сообщение успешно отправлено", mailing=mailing)
+                mailing.status = "created"
+            mailing.save(update_fields=["status", "start_time"])
+            return MailingJobService.enqueue(mailing)
+
+
+class DeliveryRetryService:
+    """
+    Сервисный класс для повторной отправки писем после временных ошибок SMTP сервера(таблица DeliveryRetry)
+    Методы:
+        claim_due(limit: Optional[int] = None, owner: Optional[str] = None) -> list:
+            Забирает пачку повторов, время которых наступило, не блокируясь на повторах других исполнителей.
+        run_due(limit: Optional[int] = None, engine: Optional[str] = None, owner: Optional[str] = None)
+        -> DeliveryReport:
+            Отправляет пачку наступивших повторов, без повторной отправки всей рассылки.
+    """
+
+    @staticmethod
+    def claim_due(limit: Optional[int] = None, owner: Optional[str] = None) -> list:
+        """
+        Забирает пачку повторов, время которых наступило, не блокируясь на повторах других исполнителей.
+        Время следующей попытки забранных повторов сдвигается на MAILING_RETRY_MAX_DELAY, чтобы их не взял
+        другой исполнитель; если исполнитель упадет, повторы вернутся в работу по истечении этого времени.
+        Повторы отключенных рассылок и рассылок, которые отправляет другой исполнитель(аренда рассылки), не забираются.
+        :param limit: Размер пачки(по умолчанию MAILING_RETRY_BATCH_SIZE).
+        :param owner: Исполнитель(по умолчанию <хост>-<pid>).
+        :return: Список повторов(DeliveryRetry) с рассылкой, сообщением и получателем.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            retries = list(
+                DeliveryRetry.objects.select_for_update(skip_locked=True, of=("self",))
+                .select_related("mailing__message", "recipient")
+                .filter(next_attempt_at__lte=now)
+                .exclude(mailing__status="disable")
+                .filter(lease_available(owner or lease_owner_name(), now, prefix="mailing__"))
+                .order_by("next_attempt_at")[: limit or settings.MAILING_RETRY_BATCH_SIZE]
+            )
+            if retries:
+                DeliveryRetry.objects.filter(pk__in=[retry.pk for retry in retries]).update(
+                    next_attempt_at=now + timedelta(seconds=settings.MAILING_RETRY_MAX_DELAY)
+                )
+        return retries
+
+    @staticmethod
+    def run_due(
+        limit: Optional[int] = None, engine: Optional[str] = None, owner: Optional[str] = None
+    ) -> DeliveryReport:
+        """
+        Отправляет пачку наступивших повторов, без повторной отправки всей рассылки.
+        Повторы рассылки отправляются под ее арендой, как и сама рассылка, поэтому получатель не получит письмо
+        дважды от исполнителя повторов и исполнителя рассылки. Если аренду рассылки забрал другой исполнитель,
+        ее повторы возвращаются в расписание без отправки.
+        Результаты записываются в журнал доставки, расписание повторов обновляется движком отправки:
+        успешно отправленные удаляются, при новой временной ошибке попытка откладывается с увеличенной задержкой.
+        :param limit: Размер пачки(по умолчанию MAILING_RETRY_BATCH_SIZE).
+        :param engine: Название движка отправки.
+        :param owner: Исполнитель(по умолчанию <хост>-<pid>).
+        :return: Итог отправки повторов.
+        """
+        owner = owner or lease_owner_name()
+        report = DeliveryReport()
+        retries = sorted(DeliveryRetryService.claim_due(limit, owner), key=lambda retry: retry.mailing_id)
+        for mailing_pk, group in groupby(retries, key=lambda retry: retry.mailing_id):
+            group = list(group)
+            lease = acquire_lease(mailing_pk, owner)
+            if lease is None:
+                DeliveryRetry.objects.filter(pk__in=[retry.pk for retry in group]).update(
+                    next_attempt_at=timezone.now()
+                )
+                continue
+            mailing = group[0].mailing
+            recipients = [
+                {"id": retry.recipient_id, "email": retry.recipient.email, "full_name": retry.recipient.full_name}
+                for retry in group
+            ]
+            try:
+                with LeaseHeartbeat(lease):
+                    report.merge(
+                        MailingService.send_messages(
+                            recipients=recipients, message=mailing.message, mailing=mailing, engine=engine
+                        )
+                    )
+            finally:
+                release_lease(lease)
+        return report
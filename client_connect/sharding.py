@@ -0,0 +1,150 @@
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+# Модуль загружается в дочерних процессах(spawn) до настройки Django,
+# поэтому модели и сервисы импортируются внутри функций, после django.setup().
+
+_progress_queue = None
+
+
+@dataclass
+class MailingShard:
+    """
+    Часть рассылки для отправки в отдельном процессе
+    Атрибуты:
+        number(int): Порядковый номер части
+        mailing_pk(int): ID рассылки
+        id_from(int): Минимальный ID получателя включительно(None - без ограничения)
+        id_to(int): Максимальный ID получателя не включительно(None - без ограничения)
+    """
+
+    number: int
+    mailing_pk: int
+    id_from: Optional[int] = None
+    id_to: Optional[int] = None
+
+    def __str__(self) -> str:
+        """
+        Строковое представление части рассылки
+        :return: Номер части, ID рассылки и диапазон ID получателей
+        """
+        if self.id_from is None and self.id_to is None:
+            return f"#{self.number} рассылка {self.mailing_pk}"
+        id_from = "..." if self.id_from is None else self.id_from
+        id_to = "..." if self.id_to is None else self.id_to
+        return f"#{self.number} рассылка {self.mailing_pk}, получатели [{id_from}, {id_to})"
+
+
+@dataclass
+class ShardResult:
+    """
+    Итог отправки части рассылки
+    Атрибуты:
+        shard(MailingShard): Часть рассылки
+        sent(int): Количество успешно отправленных писем
+        failed(int): Количество не отправленных писем
+        stopped(bool): Отправка остановлена до конца списка получателей
+        error(str): Текст ошибки, если часть не удалось отправить
+    """
+
+    shard: MailingShard
+    sent: int = 0
+    failed: int = 0
+    stopped: bool = False
+    error: str = ""
+
+
+def build_shards(mailings: list, processes: int, shard_by: str = "mailing") -> list:
+    """
+    Делит рассылки на части для отправки в процессах.
+    :param mailings: Список рассылок.
+    :param processes: Количество процессов.
+    :param shard_by: 'mailing' - одна часть на рассылку, 'recipients' - каждая рассылка делится
+                     на processes диапазонов ID получателей примерно одинакового размера.
+    :return: Список частей рассылки(MailingShard).
+    :raise ValueError: Если способ деления неизвестен.
+    """
+    if shard_by not in ("mailing", "recipients"):
+        raise ValueError(f"Неизвестный способ деления: {shard_by}")
+    shards = []
+    for mailing in mailings:
+        if shard_by == "mailing":
+            shards.append(MailingShard(len(shards) + 1, mailing.pk))
+            continue
+        recipient_ids = mailing.recipients.order_by("id").values_list("id", flat=True)
+        count = recipient_ids.count()
+        parts = max(1, min(processes, count))
+        # границы диапазонов - ID получателей на позициях count * k / parts
+        bounds = [None] + [recipient_ids[count * k // parts] for k in range(1, parts)] + [None]
+        for id_from, id_to in zip(bounds, bounds[1:]):
+            shards.append(MailingShard(len(shards) + 1, mailing.pk, id_from, id_to))
+    return shards
+
+
+def init_worker(progress_queue=None, cancels=None) -> None:
+    """
+    Инициализация дочернего процесса: настройка Django, очередь для передачи прогресса родителю
+    и остановки отправки, общие с родителем.
+    :param progress_queue: Очередь multiprocessing для сообщений о прогрессе.
+    :param cancels: Словарь multiprocessing.Manager остановленных рассылок(share_cancels).
+    """
+    global _progress_queue
+    _progress_queue = progress_queue
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+    import django
+
+    django.setup()
+    from client_connect.cancellation import share_cancels
+
+    share_cancels(cancels)
+
+
+def report_progress(shard: MailingShard, text: str) -> None:
+    """Передает сообщение о прогрессе части рассылки родительскому процессу."""
+    if _progress_queue is not None:
+        _progress_queue.put(f"[{shard}] {text}")
+
+
+def run_shard(
+    shard: MailingShard, engine: Optional[str] = None, resume: bool = False, progress_every: int = 100
+) -> ShardResult:
+    """
+    Отправляет часть рассылки в дочернем процессе.
+    :param shard: Часть рассылки.
+    :param engine: Название движка отправки(по умолчанию MAILING_ENGINE).
+    :param resume: Пропустить получателей, которым письмо уже доставлено.
+    :param progress_every: Через сколько отправленных писем передавать прогресс родителю.
+    :return: Итог отправки части рассылки.
+    """
+    from client_connect.models import Mailing
+    from client_connect.services import MailingService
+
+    result = ShardResult(shard)
+    try:
+        mailing = Mailing.objects.select_related("message").get(pk=shard.mailing_pk)
+        recipients = MailingService.get_recipients(mailing, resume=resume)
+        if shard.id_from is not None:
+            recipients = recipients.filter(id__gte=shard.id_from)
+        if shard.id_to is not None:
+            recipients = recipients.filter(id__lt=shard.id_to)
+        total = recipients.count()  # получатели читаются движком порциями, без загрузки всего списка
+        report_progress(shard, f"запуск, получателей: {total}")
+
+        def on_result(delivery_result) -> None:
+            if delivery_result.status == "success":
+                result.sent += 1
+            else:
+                result.failed += 1
+            if (result.sent + result.failed) % progress_every == 0:
+                report_progress(shard, f"обработано {result.sent + result.failed} из {total}")
+
+        report = MailingService.send_messages(
+            recipients=recipients, message=mailing.message, mailing=mailing, on_result=on_result, engine=engine
+        )
+        result.sent, result.failed, result.stopped = report.sent, report.failed, report.stopped
+        report_progress(shard, f"выполнено, отправлено: {result.sent}, не отправлено: {result.failed}")
+    except Exception as exc_info:
+        result.error = str(exc_info) or exc_info.__class__.__name__
+        report_progress(shard, f"ошибка: {result.error}")
+    return result
@@ -0,0 +1,39 @@
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+
+from client_connect.models import Mailing
+
+MailingRecipients = Mailing.recipients.through
+
+
+def recount_total(mailing_pks: set) -> None:
+    """
+    Пересчитывает количество получателей(total_count) рассылок одним запросом UPDATE с подзапросом
+    к таблице связи рассылок и получателей.
+    :param mailing_pks: ID рассылок.
+    """
+    if not mailing_pks:
+        return
+    counts = (
+        MailingRecipients.objects.filter(mailing=OuterRef("pk"))
+        .values("mailing")
+        .annotate(count=Count("pk"))
+        .values("count")
+    )
+    Mailing.objects.filter(pk__in=mailing_pks).update(total_count=Coalesce(Subquery(counts), 0))
+
+
+@receiver(m2m_changed, sender=MailingRecipients)
+def recipients_changed(sender, instance, action: str, reverse: bool, pk_set: set, **kwargs) -> None:
+    """
+    Обновляет total_count при изменении получателей рассылки: со стороны рассылки(mailing.recipients) и со стороны
+    получателя(recipient.mailings, в том числе в админке). Перед очисткой получателя запоминаются его рассылки.
+    """
+    if action == "pre_clear" and reverse:
+        instance._cleared_mailings = set(instance.mailings.values_list("pk", flat=True))
+    elif action in ("post_add", "post_remove"):
+        recount_total(pk_set if reverse else {instance.pk})
+    elif action == "post_clear":
+        recount_total(instance.__dict__.pop("_cleared_mailings", set()) if reverse else {instance.pk})
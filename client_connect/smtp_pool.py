@@ -0,0 +1,551 @@
+import atexit
+import smtplib
+import ssl
+import threading
+import time
+from contextlib import contextmanager
+from email import message_from_bytes, policy
+from queue import Empty, LifoQueue
+from typing import Iterator, Optional, Union
+
+from django.core.mail import EmailMessage, get_connection
+
+from client_connect.pipelining import PipeliningSMTP, PipeliningSMTP_SSL, SMTPDataDisconnected, SMTPRoundTrips
+from client_connect.relays import Relay, RelayBalancer, RelayConfig, is_connection_error, parse_relays, relays_name
+from config import settings
+
+SMTP_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+# заголовки, которые почтовый бэкенд Django формирует сам
+BACKEND_HEADERS = ("subject", "from", "mime-version", "content-type", "content-transfer-encoding")
+
+
+class PooledSMTPConnection:
+    """
+    Представление SMTP соединения, которое хранится в пуле
+    Атрибуты:
+        host(str): Хост SMTP сервера
+        port(int): Порт SMTP сервера
+        username(str): Логин для авторизации
+        password(str): Пароль для авторизации
+        use_tls(bool): Использовать STARTTLS
+        use_ssl(bool): Использовать SSL соединение
+        timeout(float): Таймаут сокета в секундах
+        pipelining(bool): Отправлять команды конвейером, если сервер поддерживает ESMTP PIPELINING
+        stats(SMTPRoundTrips): Счетчик обращений к серверу, None - не считать
+        connection(smtplib.SMTP): Открытое соединение, None если соединение закрыто
+        last_used(float): Время последнего использования соединения (time.monotonic)
+    Методы:
+        open(self) -> None:
+            Открывает соединение: подключение, EHLO, STARTTLS и авторизация.
+        close(self) -> None:
+            Закрывает соединение, ошибки закрытия игнорируются.
+        is_alive(self, noop_interval: float) -> bool:
+            Проверяет соединение командой NOOP, если оно простаивало дольше noop_interval.
+        sendmail(self, from_email: str, recipients: list, message: bytes) -> dict:
+            Отправляет письмо через открытое соединение.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        use_tls: bool = False,
+        use_ssl: bool = False,
+        timeout: Optional[float] = None,
+        pipelining: bool = True,
+        stats: Optional[SMTPRoundTrips] = None,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.pipelining = pipelining
+        self.stats = stats
+        self.connection: Optional[smtplib.SMTP] = None
+        self.last_used = 0.0
+
+    def open(self) -> None:
+        """Открывает соединение: подключение, EHLO, STARTTLS и авторизация."""
+        if self.use_ssl:
+            connection = PipeliningSMTP_SSL(
+                self.host,
+                self.port,
+                timeout=self.timeout,
+                context=ssl.create_default_context(),
+                pipelining=self.pipelining,
+                stats=self.stats,
+            )
+        else:
+            connection = PipeliningSMTP(
+                self.host, self.port, timeout=self.timeout, pipelining=self.pipelining, stats=self.stats
+            )
+            if self.use_tls:
+                connection.starttls(context=ssl.create_default_context())
+        if self.username and self.password:
+            connection.login(self.username, self.password)
+        self.connection = connection
+        self.last_used = time.monotonic()
+
+    def close(self) -> None:
+        """Закрывает соединение, ошибки закрытия игнорируются."""
+        if self.connection is None:
+            return
+        try:
+            self.connection.quit()
+        except (smtplib.SMTPException, OSError):
+            self.connection.close()
+        finally:
+            self.connection = None
+
+    def is_alive(self, noop_interval: float) -> bool:
+        """
+        Проверяет соединение командой NOOP, если оно простаивало дольше noop_interval.
+        :param noop_interval: Время простоя в секундах, после которого соединение проверяется.
+        :return: True, если соединение можно использовать, иначе False
+        """
+        if self.connection is None:
+            return False
+        if time.monotonic() - self.last_used < noop_interval:
+            return True
+        try:
+            code, _ = self.connection.noop()
+        except (smtplib.SMTPException, OSError):
+            return False
+        return code == 250
+
+    def sendmail(self, from_email: str, recipients: list, message: bytes) -> dict:
+        """
+        Отправляет письмо через открытое соединение.
+        :param from_email: Адрес отправителя
+        :param recipients: Список адресов получателей
+        :param message: Письмо в виде байтов
+        :return: Словарь отклоненных получателей(smtplib.SMTP.sendmail)
+        :raise smtplib.SMTPServerDisconnected: Если соединение закрыто
+        """
+        if self.connection is None:
+            raise smtplib.SMTPServerDisconnected("Соединение не открыто")
+        refused = self.connection.sendmail(from_email, recipients, message)
+        self.last_used = time.monotonic()
+        return refused
+
+
+class SMTPConnectionPool:
+    """
+    Пул авторизованных SMTP соединений, переиспользуемых между получателями и рассылками
+    Атрибуты:
+        size(int): Максимальное количество открытых соединений
+        noop_interval(float): Время простоя в секундах, после которого соединение проверяется командой NOOP
+        connection_kwargs(dict): Параметры для создания PooledSMTPConnection
+        stats(SMTPRoundTrips): Счетчик обращений к серверу всех соединений пула
+    Методы:
+        name(self) -> str:
+            Название SMTP сервера пула: <адрес>:<порт>.
+        acquire(self, timeout: Optional[float] = None) -> PooledSMTPConnection:
+            Выдает живое соединение из пула, при необходимости открывает новое.
+        release(self, connection: PooledSMTPConnection, discard: bool = False) -> None:
+            Возвращает соединение в пул, либо закрывает его при discard=True.
+        connection(self, timeout: Optional[float] = None) -> Iterator[PooledSMTPConnection]:
+            Контекстный менеджер выдачи соединения, при обрыве соединение не возвращается в пул.
+        send(self, from_email: str, recipients: list, message: bytes) -> dict:
+            Отправляет письмо через соединение из пула, при обрыве соединения до DATA переподключается один раз.
+        close_all(self) -> None:
+            Закрывает все свободные соединения пула.
+    """
+
+    def __init__(self, size: int, noop_interval: float = 30, **connection_kwargs) -> None:
+        if size < 1:
+            raise ValueError("Размер пула должен быть больше нуля")
+        self.size = size
+        self.noop_interval = noop_interval
+        self.connection_kwargs = connection_kwargs
+        self.stats = SMTPRoundTrips()
+        self._idle: LifoQueue = LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @property
+    def name(self) -> str:
+        """Название SMTP сервера пула: <адрес>:<порт>."""
+        return f"{self.connection_kwargs.get('host')}:{self.connection_kwargs.get('port')}"
+
+    def acquire(self, timeout: Optional[float] = None) -> PooledSMTPConnection:
+        """
+        Выдает живое соединение из пула, при необходимости открывает новое.
+        :param timeout: Время ожидания свободного соединения в секундах(None - ждать без ограничения)
+        :return: Открытое соединение
+        :raise TimeoutError: Если свободное соединение не появилось за timeout
+        """
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError("Нет свободных SMTP соединений в пуле")
+        try:
+            while True:
+                try:
+                    connection = self._idle.get_nowait()
+                except Empty:
+                    break
+                if connection.is_alive(self.noop_interval):
+                    return connection
+                connection.close()
+            connection = PooledSMTPConnection(stats=self.stats, **self.connection_kwargs)
+            connection.open()
+            return connection
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, connection: PooledSMTPConnection, discard: bool = False) -> None:
+        """
+        Возвращает соединение в пул, либо закрывает его при discard=True.
+        :param connection: Соединение, полученное через acquire
+        :param discard: Закрыть соединение вместо возврата в пул
+        """
+        if discard or connection.connection is None:
+            connection.close()
+        else:
+            self._idle.put(connection)
+        self._slots.release()
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None) -> Iterator[PooledSMTPConnection]:
+        """
+        Контекстный менеджер выдачи соединения, при обрыве соединение не возвращается в пул.
+        :param timeout: Время ожидания свободного соединения в секундах
+        :return: Открытое соединение
+        """
+        connection = self.acquire(timeout)
+        discard = False
+        try:
+            yield connection
+        except smtplib.SMTPServerDisconnected:
+            discard = True
+            raise
+        except smtplib.SMTPException:
+            raise
+        except OSError:
+            discard = True
+            raise
+        finally:
+            self.release(connection, discard=discard)
+
+    def send(self, from_email: str, recipients: list, message: bytes) -> dict:
+        """
+        Отправляет письмо через соединение из пула, при обрыве соединения до команды DATA переподключается
+        один раз. Обрыв после DATA не повторяется: сервер мог принять письмо, повтор - по расписанию(DeliveryRetry).
+        :param from_email: Адрес отправителя
+        :param recipients: Список адресов получателей
+        :param message: Письмо в виде байтов
+        :return: Словарь отклоненных получателей(smtplib.SMTP.sendmail)
+        :raise SMTPDataDisconnected: Если соединение оборвано после команды DATA
+        """
+        try:
+            with self.connection() as connection:
+                return connection.sendmail(from_email, recipients, message)
+        except SMTPDataDisconnected:
+            raise
+        except smtplib.SMTPServerDisconnected:
+            with self.connection() as connection:
+                return connection.sendmail(from_email, recipients, message)
+
+    def close_all(self) -> None:
+        """Закрывает все свободные соединения пула."""
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except Empty:
+                break
+            connection.close()
+
+
+class RelayConnection:
+    """
+    Соединение с одним SMTP сервером группы, выданное RelayPool: отправки учитываются в статистике сервера
+    Атрибуты:
+        relay(Relay): SMTP сервер группы
+        pooled(PooledSMTPConnection): Соединение из пула сервера
+    Методы:
+        sendmail(self, from_email: str, recipients: list, message: bytes) -> dict:
+            Отправляет письмо через открытое соединение.
+    """
+
+    def __init__(self, relay: Relay, balancer: RelayBalancer, pooled: PooledSMTPConnection) -> None:
+        self.relay = relay
+        self.pooled = pooled
+        self._balancer = balancer
+
+    @property
+    def connection(self) -> Optional[smtplib.SMTP]:
+        """Открытое соединение, None если соединение закрыто."""
+        return self.pooled.connection
+
+    def sendmail(self, from_email: str, recipients: list, message: bytes) -> dict:
+        """
+        Отправляет письмо через открытое соединение.
+        :return: Словарь отклоненных получателей(smtplib.SMTP.sendmail)
+        """
+        started = time.monotonic()
+        try:
+            refused = self.pooled.sendmail(from_email, recipients, message)
+        except (smtplib.SMTPException, OSError) as exc_info:
+            self._balancer.record(self.relay, started, None if is_connection_error(exc_info) else (0, len(recipients)))
+            raise
+        self._balancer.record(self.relay, started, (len(recipients) - len(refused), len(refused)))
+        return refused
+
+
+class RelayPool:
+    """
+    Группа SMTP серверов(EMAIL_RELAYS) с отдельным пулом соединений на каждый сервер. Письма распределяются
+    между серверами(RelayBalancer), при ошибке сервера(недоступен, обрыв соединения, таймаут, ответ 421)
+    письмо отправляется через следующий сервер. Интерфейс как у SMTPConnectionPool.
+    Атрибуты:
+        balancer(RelayBalancer): Распределение писем между серверами
+        size(int): Максимальное количество открытых соединений со всеми серверами
+        noop_interval(float): Время простоя в секундах, после которого соединение проверяется командой NOOP
+        stats(SMTPRoundTrips): Счетчик обращений к серверам всех соединений группы
+    Методы:
+        name(self) -> str:
+            Название группы серверов.
+        acquire(self, timeout: Optional[float] = None) -> RelayConnection:
+            Выдает соединение с сервером, выбранным для отправки, при ошибке сервера - со следующим.
+        release(self, connection: RelayConnection, discard: bool = False) -> None:
+            Возвращает соединение в пул его сервера, либо закрывает его при discard=True.
+        send(self, from_email: str, recipients: list, message: bytes) -> dict:
+            Отправляет письмо через выбранный сервер, при ошибке сервера - через следующий.
+        relay_stats(self) -> dict:
+            Статистика отправки по серверам.
+        close_all(self) -> None:
+            Закрывает все свободные соединения со всеми серверами.
+    """
+
+    def __init__(
+        self, relays: list, strategy: Optional[str] = None, noop_interval: float = 30, **connection_kwargs
+    ) -> None:
+        if not relays:
+            raise ValueError("Список SMTP серверов пуст")
+        self.size = sum(relay.concurrency for relay in relays)
+        self.noop_interval = noop_interval
+        self.stats = SMTPRoundTrips()
+        self._name = relays_name(relays)
+        self.balancer = RelayBalancer.for_relays(relays, self._make_pool(connection_kwargs), strategy)
+
+    @property
+    def name(self) -> str:
+        """Название группы серверов."""
+        return self._name
+
+    def acquire(self, timeout: Optional[float] = None) -> RelayConnection:
+        """
+        Выдает соединение с сервером, выбранным для отправки, при ошибке сервера - со следующим.
+        :param timeout: Время ожидания свободного соединения в секундах(None - ждать без ограничения)
+        :return: Открытое соединение
+        :raise smtplib.SMTPServerDisconnected: Если доступных серверов нет
+        """
+        tried, error = [], None
+        while True:
+            relay = self.balancer.choose(tuple(tried))
+            if relay is None:
+                raise error or smtplib.SMTPServerDisconnected("Нет доступных SMTP серверов")
+            started = time.monotonic()
+            try:
+                return RelayConnection(relay, self.balancer, relay.pool.acquire(timeout))
+            except (smtplib.SMTPException, OSError) as exc_info:
+                self.balancer.release(relay)
+                if not is_connection_error(exc_info):
+                    raise
+                self.balancer.record(relay, started)
+                tried.append(relay)
+                error = exc_info
+
+    def release(self, connection: RelayConnection, discard: bool = False) -> None:
+        """
+        Возвращает соединение в пул его сервера, либо закрывает его при discard=True.
+        :param connection: Соединение, полученное через acquire
+        :param discard: Закрыть соединение вместо возврата в пул
+        """
+        connection.relay.pool.release(connection.pooled, discard=discard)
+        self.balancer.release(connection.relay)
+
+    def send(self, from_email: str, recipients: list, message: bytes) -> dict:
+        """
+        Отправляет письмо через выбранный сервер, при ошибке сервера - через следующий.
+        Отказы получателям, ошибки письма(ответы 5xx) и обрыв соединения после DATA другому серверу не передаются.
+        :param from_email: Адрес отправителя
+        :param recipients: Список адресов получателей
+        :param message: Письмо в виде байтов
+        :return: Словарь отклоненных получателей(smtplib.SMTP.sendmail)
+        :raise smtplib.SMTPServerDisconnected: Если доступных серверов нет
+        """
+        tried, error = [], None
+        while True:
+            relay = self.balancer.choose(tuple(tried))
+            if relay is None:
+                raise error or smtplib.SMTPServerDisconnected("Нет доступных SMTP серверов")
+            started = time.monotonic()
+            try:
+                refused = relay.pool.send(from_email, recipients, message)
+            except (smtplib.SMTPException, OSError) as exc_info:
+                if not is_connection_error(exc_info):
+                    self.balancer.record(relay, started, (0, len(recipients)))
+                    raise
+                self.balancer.record(relay, started)
+                if isinstance(exc_info, SMTPDataDisconnected):
+                    raise  # сервер мог принять письмо: другому серверу не передается
+                tried.append(relay)
+                error = exc_info
+            else:
+                self.balancer.record(relay, started, (len(recipients) - len(refused), len(refused)))
+                return refused
+            finally:
+                self.balancer.release(relay)
+
+    def relay_stats(self) -> dict:
+        """Статистика отправки по серверам {сервер: показатели} с момента создания пула."""
+        return self.balancer.stats()
+
+    def close_all(self) -> None:
+        """Закрывает все свободные соединения со всеми серверами."""
+        for relay in self.balancer.relays:
+            relay.pool.close_all()
+
+    def _make_pool(self, connection_kwargs: dict):
+        """Функция создания пула соединений сервера группы, соединения считаются в общем счетчике группы."""
+
+        def make_pool(relay: RelayConfig) -> SMTPConnectionPool:
+            pool = SMTPConnectionPool(
+                relay.concurrency, self.noop_interval, host=relay.host, port=relay.port, **connection_kwargs
+            )
+            pool.stats = self.stats
+            return pool
+
+        return make_pool
+
+
+class BackendPool:
+    """
+    Отправка писем рассылки через почтовый бэкенд Django(EMAIL_BACKEND), если это не SMTP бэкенд:
+    console, locmem и filebased для разработки и тестов, бэкенды внешних сервисов отправки.
+    Повторяет интерфейс SMTPConnectionPool, поэтому движки отправки работают с ним без изменений;
+    соединением из пула служит сам пул, соединение бэкенда открывается на каждое письмо.
+    Атрибуты:
+        backend(str): Путь к классу почтового бэкенда
+        size(int): Максимальное количество одновременных отправок
+        stats(SMTPRoundTrips): Счетчик обращений к SMTP серверу(для бэкенда всегда пустой)
+    Методы:
+        name(self) -> str:
+            Название бэкенда.
+        acquire(self, timeout: Optional[float] = None) -> BackendPool:
+            Выдает соединение - сам пул.
+        release(self, connection: BackendPool, discard: bool = False) -> None:
+            Возвращает соединение, ничего не делает.
+        send(self, from_email: str, recipients: list, message: bytes) -> dict:
+            Отправляет письмо через почтовый бэкенд.
+        close_all(self) -> None:
+            Закрывать нечего.
+    """
+
+    def __init__(self, backend: str, size: int) -> None:
+        self.backend = backend
+        self.size = size
+        self.stats = SMTPRoundTrips()
+
+    @property
+    def name(self) -> str:
+        """Название бэкенда."""
+        return self.backend.rsplit(".", 2)[-2]
+
+    def acquire(self, timeout: Optional[float] = None) -> "BackendPool":
+        """Выдает соединение - сам пул(sendmail)."""
+        return self
+
+    def release(self, connection: "BackendPool", discard: bool = False) -> None:
+        """Возвращает соединение, ничего не делает."""
+
+    def send(self, from_email: str, recipients: list, message: bytes) -> dict:
+        """
+        Отправляет письмо через почтовый бэкенд: письмо разбирается обратно в EmailMessage с темой, текстом
+        и заголовками рассылки(Message-ID, X-Mailing-Id, List-Unsubscribe), пачка получателей - в скрытой копии.
+        :return: Отклоненные получатели - бэкенд их не сообщает, всегда пусто
+        """
+        parsed = message_from_bytes(message, policy=policy.default)
+        headers = {name: str(value) for name, value in parsed.items() if name.lower() not in BACKEND_HEADERS}
+        if len(recipients) == 1:
+            headers.pop("To", None)
+            to, bcc = recipients, []
+        else:
+            to, bcc = [], recipients
+        email = EmailMessage(str(parsed["Subject"] or ""), parsed.get_content(), from_email, to, bcc, headers=headers)
+        get_connection(self.backend).send_messages([email])
+        return {}
+
+    sendmail = send
+
+    def close_all(self) -> None:
+        """Закрывать нечего: соединение бэкенда открывается на каждое письмо."""
+
+
+def uses_smtp_backend() -> bool:
+    """Почтовый бэкенд - SMTP(EMAIL_BACKEND): рассылки отправляются через пулы SMTP соединений."""
+    return settings.EMAIL_BACKEND == SMTP_BACKEND
+
+
+_pool: Optional[Union[SMTPConnectionPool, RelayPool, BackendPool]] = None
+_pool_lock = threading.Lock()
+
+
+def get_connection_pool() -> Union[SMTPConnectionPool, RelayPool, BackendPool]:
+    """
+    Возвращает общий для процесса пул SMTP соединений, созданный по настройкам config.settings.
+    :return: Пул SMTP соединений
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = create_connection_pool()
+                atexit.register(_pool.close_all)
+    return _pool
+
+
+def create_connection_pool() -> Union[SMTPConnectionPool, RelayPool, BackendPool]:
+    """
+    Создает пул SMTP соединений по настройкам config.settings: группу серверов(RelayPool), если задан EMAIL_RELAYS,
+    иначе пул соединений с сервером EMAIL_HOST. Если EMAIL_BACKEND - не SMTP бэкенд, письма отправляются
+    через него(BackendPool).
+    :return: Пул SMTP соединений
+    """
+    if not uses_smtp_backend():
+        return BackendPool(settings.EMAIL_BACKEND, settings.EMAIL_POOL_SIZE)
+    connection_kwargs = dict(
+        username=settings.EMAIL_HOST_USER,
+        password=settings.EMAIL_HOST_PASSWORD,
+        use_tls=settings.EMAIL_USE_TLS,
+        use_ssl=settings.EMAIL_USE_SSL,
+        timeout=settings.EMAIL_TIMEOUT,
+        pipelining=settings.EMAIL_PIPELINING,
+    )
+    relays = parse_relays(settings.EMAIL_RELAYS)
+    if relays:
+        return RelayPool(relays, noop_interval=settings.EMAIL_POOL_NOOP_INTERVAL, **connection_kwargs)
+    return SMTPConnectionPool(
+        size=settings.EMAIL_POOL_SIZE,
+        noop_interval=settings.EMAIL_POOL_NOOP_INTERVAL,
+        host=settings.EMAIL_HOST,
+        port=int(settings.EMAIL_PORT),
+        **connection_kwargs,
+    )
+
+
+def reset_connection_pool() -> None:
+    """
+    Закрывает свободные соединения общего пула и сбрасывает его: следующий вызов get_connection_pool
+    создаст пул по текущим настройкам config.settings.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close_all()
+        _pool = None
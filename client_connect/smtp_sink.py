@@ -0,0 +1,402 @@
+import asyncio
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Iterator, Optional
+
+from client_connect import smtp_pool
+from config import settings
+
+ADDRESS_RE = re.compile(r"<([^>]*)>")
+
+
+@dataclass
+class SinkStats:
+    """
+    Статистика тестового SMTP сервера
+    Атрибуты:
+        connections(int): Количество принятых соединений
+        messages(int): Количество принятых писем(SMTP транзакций)
+        recipients(int): Количество принятых получателей
+        temp_failures(int): Количество ответов 4xx получателям
+        perm_failures(int): Количество ответов 5xx получателям
+        drops(int): Количество оборванных соединений
+        latencies(list): Длительность принятых транзакций в секундах, от MAIL FROM до ответа на текст письма
+    """
+
+    connections: int = 0
+    messages: int = 0
+    recipients: int = 0
+    temp_failures: int = 0
+    perm_failures: int = 0
+    drops: int = 0
+    latencies: list = field(default_factory=list)
+
+
+class SinkSession:
+    """
+    Состояние одной SMTP сессии тестового сервера
+    Атрибуты:
+        mail_from(str): Адрес отправителя текущей транзакции, None - транзакции нет
+        recipients(list): Принятые получатели текущей транзакции
+        started(float): Время команды MAIL FROM(time.monotonic)
+        in_data(bool): Сервер принимает текст письма
+        auth_lines(int): Сколько строк авторизации осталось прочитать(AUTH LOGIN, AUTH PLAIN без токена)
+    Методы:
+        reset(self) -> None:
+            Сбрасывает транзакцию.
+    """
+
+    def __init__(self) -> None:
+        self.auth_lines = 0
+        self.reset()
+
+    def reset(self) -> None:
+        """Сбрасывает транзакцию."""
+        self.mail_from: Optional[str] = None
+        self.recipients: list = []
+        self.started = 0.0
+        self.in_data = False
+
+
+class SMTPSink:
+    """
+    Локальный SMTP сервер, который принимает и выбрасывает письма, для тестов и замеров скорости отправки
+    без реального SMTP сервера. Умеет имитировать задержку сети, ограничение скорости приема, ответы 4xx/5xx
+    и обрывы соединения.
+    Задержка latency добавляется один раз на каждый пакет команд клиента(одно ожидание ответа), поэтому
+    конвейерная отправка команд(PIPELINING) дает тот же выигрыш, что и на реальном сервере.
+    Адреса получателей, начинающиеся с 'temp', получают ответ 451, с 'bad' - 550, с 'drop' - обрыв соединения.
+    Атрибуты:
+        host(str): Адрес прослушивания
+        port(int): Порт прослушивания, 0 - свободный порт(выбранный порт доступен после запуска)
+        latency(float): Задержка ответа сервера в секундах
+        rate(float): Максимальное количество принимаемых писем в секунду, 0 - без ограничения
+        temp_fail(float): Доля получателей со случайным ответом 451
+        perm_fail(float): Доля получателей со случайным ответом 550
+        drop(float): Доля писем, после текста которых соединение обрывается
+        pipelining(bool): Объявлять расширение PIPELINING
+        keep_messages(bool): Сохранять принятые письма в messages
+        stats(SinkStats): Статистика сервера
+        messages(list): Принятые письма (отправитель, получатели, текст) при keep_messages=True
+    Методы:
+        serve_forever(self) -> None:
+            Запускает сервер в текущем цикле событий и обслуживает соединения до отмены.
+        start(self) -> SMTPSink:
+            Запускает сервер в фоновом потоке.
+        stop(self) -> None:
+            Останавливает сервер, запущенный в фоновом потоке.
+        reset_stats(self) -> None:
+            Обнуляет статистику и принятые письма.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        rate: float = 0.0,
+        temp_fail: float = 0.0,
+        perm_fail: float = 0.0,
+        drop: float = 0.0,
+        pipelining: bool = True,
+        keep_messages: bool = False,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.rate = rate
+        self.temp_fail = temp_fail
+        self.perm_fail = perm_fail
+        self.drop = drop
+        self.pipelining = pipelining
+        self.keep_messages = keep_messages
+        self.stats = SinkStats()
+        self.messages: list = []
+        self._random = random.Random(seed)
+        self._next_accept = 0.0
+        self._server: Optional[asyncio.Server] = None
+        self._writers: set = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "SMTPSink":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    async def serve_forever(self) -> None:
+        """Запускает сервер в текущем цикле событий и обслуживает соединения до отмены."""
+        await self._listen()
+        try:
+            await self._server.serve_forever()
+        finally:
+            self._close()
+
+    def start(self) -> "SMTPSink":
+        """
+        Запускает сервер в фоновом потоке.
+        :return: Сервер, порт прослушивания - в атрибуте port.
+        """
+        ready = threading.Event()
+
+        def run() -> None:
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._listen())
+            ready.set()
+            try:
+                self._loop.run_forever()
+            finally:
+                self._close()
+                tasks = asyncio.all_tasks(self._loop)
+                if tasks:  # соединения закрыты, обработчики завершаются сами
+                    self._loop.run_until_complete(asyncio.wait(tasks, timeout=1))
+                self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="smtp-sink", daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self) -> None:
+        """Останавливает сервер, запущенный в фоновом потоке."""
+        if self._loop is None or self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop = self._thread = None
+
+    def reset_stats(self) -> None:
+        """Обнуляет статистику и принятые письма."""
+        self.stats = SinkStats()
+        self.messages = []
+
+    async def _listen(self) -> None:
+        """Открывает порт прослушивания."""
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    def _close(self) -> None:
+        """Закрывает порт прослушивания и открытые соединения."""
+        if self._server is not None:
+            self._server.close()
+        for writer in list(self._writers):
+            writer.transport.abort()
+        self._writers.clear()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Обслуживает одно соединение: читает пакеты команд и отвечает на них одним пакетом."""
+        self.stats.connections += 1
+        self._writers.add(writer)
+        session = SinkSession()
+        buffer = b""
+        try:
+            await self._write(writer, [self._reply(220, "smtp-sink ESMTP")], [])
+            while True:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    break
+                buffer += chunk
+                replies, finished, buffer, action = await self._process(session, buffer)
+                if action == "drop":
+                    self.stats.drops += 1
+                    writer.transport.abort()
+                    break
+                await self._write(writer, replies, finished)
+                if action == "quit":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _write(self, writer: asyncio.StreamWriter, replies: list, finished: list) -> None:
+        """Отправляет ответы одним пакетом после задержки latency и учитывает длительность транзакций."""
+        if not replies:
+            return
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        writer.write(b"".join(replies))
+        await writer.drain()
+        now = time.monotonic()
+        self.stats.latencies.extend(now - started for started in finished)
+
+    async def _process(self, session: SinkSession, buffer: bytes) -> tuple:
+        """
+        Обрабатывает все полные команды и письма из буфера.
+        :return: (ответы, время начала завершенных транзакций, необработанный остаток буфера, действие)
+                 действие: None, 'quit' - закрыть соединение после ответа, 'drop' - оборвать соединение.
+        """
+        replies: list = []
+        finished: list = []
+        while True:
+            if session.in_data:
+                if buffer.startswith(b".\r\n"):
+                    data, buffer = b"", buffer[3:]
+                else:
+                    if b"\r\n.\r\n" not in buffer:
+                        return replies, finished, buffer, None
+                    data, _, buffer = buffer.partition(b"\r\n.\r\n")
+                    data += b"\r\n"
+                if self.drop and self._random.random() < self.drop:
+                    return replies, finished, buffer, "drop"
+                await self._throttle()
+                self._accept(session, re.sub(rb"(?m)^\.\.", b".", data))
+                finished.append(session.started)
+                session.reset()
+                replies.append(self._reply(250, "OK: queued"))
+                continue
+            if b"\r\n" not in buffer:
+                return replies, finished, buffer, None
+            line, _, buffer = buffer.partition(b"\r\n")
+            line = line.decode("latin-1")
+            reply, action = self._command(session, line)
+            if action == "drop":
+                return replies, finished, buffer, "drop"
+            replies.append(reply)
+            if action == "quit":
+                return replies, finished, buffer, "quit"
+
+    def _command(self, session: SinkSession, line: str) -> tuple:
+        """
+        Обрабатывает одну команду SMTP.
+        :return: (ответ, действие) - действие None, 'quit' или 'drop'.
+        """
+        if session.auth_lines:
+            session.auth_lines -= 1
+            return (
+                self._reply(334, "") if session.auth_lines else self._reply(235, "Authentication successful")
+            ), None
+        verb, _, arg = line.partition(" ")
+        verb = verb.upper()
+        if verb == "EHLO":
+            session.reset()
+            extensions = ["smtp-sink", "8BITMIME", "AUTH PLAIN LOGIN"]
+            if self.pipelining:
+                extensions.append("PIPELINING")
+            return self._reply(250, *extensions), None
+        if verb == "HELO":
+            session.reset()
+            return self._reply(250, "smtp-sink"), None
+        if verb == "AUTH":
+            method, _, token = arg.partition(" ")
+            if method.upper() == "PLAIN" and token:
+                return self._reply(235, "Authentication successful"), None
+            session.auth_lines = 2 if method.upper() == "LOGIN" else 1
+            return self._reply(334, ""), None
+        if verb == "MAIL":
+            session.reset()
+            session.mail_from = self._address(arg)
+            session.started = time.monotonic()
+            return self._reply(250, "OK"), None
+        if verb == "RCPT":
+            if session.mail_from is None:
+                return self._reply(503, "Error: need MAIL command"), None
+            return self._recipient(session, self._address(arg))
+        if verb == "DATA":
+            if not session.recipients:
+                session.reset()
+                return self._reply(554, "Error: no valid recipients"), None
+            session.in_data = True
+            return self._reply(354, "End data with <CR><LF>.<CR><LF>"), None
+        if verb == "RSET":
+            session.reset()
+            return self._reply(250, "OK"), None
+        if verb == "NOOP":
+            return self._reply(250, "OK"), None
+        if verb == "QUIT":
+            return self._reply(221, "Bye"), "quit"
+        return self._reply(502, "Error: command not implemented"), None
+
+    def _recipient(self, session: SinkSession, address: str) -> tuple:
+        """Принимает или отклоняет получателя по правилам адресов и случайным ошибкам."""
+        local_part = address.lower()
+        if local_part.startswith("drop"):
+            return None, "drop"
+        if local_part.startswith("temp") or (self.temp_fail and self._random.random() < self.temp_fail):
+            self.stats.temp_failures += 1
+            return self._reply(451, "Requested action aborted: try again later"), None
+        if local_part.startswith("bad") or (self.perm_fail and self._random.random() < self.perm_fail):
+            self.stats.perm_failures += 1
+            return self._reply(550, "Requested action not taken: mailbox unavailable"), None
+        session.recipients.append(address)
+        return self._reply(250, "OK"), None
+
+    async def _throttle(self) -> None:
+        """Ограничивает скорость приема писем: каждое следующее письмо не раньше чем через 1 / rate секунд."""
+        if not self.rate:
+            return
+        now = time.monotonic()
+        accept_at = max(now, self._next_accept)
+        self._next_accept = accept_at + 1 / self.rate
+        if accept_at > now:
+            await asyncio.sleep(accept_at - now)
+
+    def _accept(self, session: SinkSession, data: bytes) -> None:
+        """Учитывает принятое письмо."""
+        self.stats.messages += 1
+        self.stats.recipients += len(session.recipients)
+        if self.keep_messages:
+            self.messages.append((session.mail_from, session.recipients, data))
+
+    @staticmethod
+    def _address(arg: str) -> str:
+        """Адрес из аргумента MAIL FROM:<...> или RCPT TO:<...>."""
+        match = ADDRESS_RE.search(arg)
+        return match.group(1) if match else arg.partition(":")[2].strip()
+
+    @staticmethod
+    def _reply(code: int, *lines: str) -> bytes:
+        """Ответ сервера, многострочный если строк несколько."""
+        lines = lines or ("",)
+        return b"".join(
+            f"{code}{'-' if number < len(lines) - 1 else ' '}{line}\r\n".encode() for number, line in enumerate(lines)
+        )
+
+
+@contextmanager
+def use_sink(
+    sink: SMTPSink, *relays: SMTPSink, weights: Optional[list] = None, balancing: Optional[str] = None
+) -> Iterator[SMTPSink]:
+    """
+    Направляет отправку рассылок на тестовый SMTP сервер: подменяет настройки SMTP сервера в config.settings
+    и общий пул соединений, после выхода восстанавливает их.
+    С несколькими серверами отправка идет через группу серверов(EMAIL_RELAYS).
+    :param sink: Запущенный тестовый SMTP сервер.
+    :param relays: Другие запущенные тестовые серверы группы.
+    :param weights: Веса серверов группы по порядку(по умолчанию 1).
+    :param balancing: Способ распределения писем между серверами(по умолчанию EMAIL_RELAY_BALANCING).
+    """
+    sinks = (sink, *relays)
+    weights = weights or [1] * len(sinks)
+    overrides = {
+        "EMAIL_BACKEND": smtp_pool.SMTP_BACKEND,
+        "EMAIL_HOST": sink.host,
+        "EMAIL_PORT": sink.port,
+        "EMAIL_RELAYS": (
+            ",".join(f"{item.host}:{item.port}={weight}" for item, weight in zip(sinks, weights)) if relays else ""
+        ),
+        "EMAIL_RELAY_BALANCING": balancing or settings.EMAIL_RELAY_BALANCING,
+        "EMAIL_USE_TLS": False,
+        "EMAIL_USE_SSL": False,
+        "EMAIL_HOST_USER": settings.EMAIL_HOST_USER or "mailing@sink.test",
+        "EMAIL_HOST_PASSWORD": None,
+        "DEFAULT_FROM_EMAIL": settings.DEFAULT_FROM_EMAIL or "mailing@sink.test",
+    }
+    saved = {name: getattr(settings, name, None) for name in overrides}
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+    smtp_pool.reset_connection_pool()
+    try:
+        yield sink
+    finally:
+        smtp_pool.reset_connection_pool()
+        for name, value in saved.items():
+            setattr(settings, name, value)
@@ -0,0 +1,246 @@
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import AsyncIterable, AsyncIterator, Callable, Iterable, Iterator, Optional
+
+from asgiref.sync import sync_to_async
+from django.utils import timezone
+
+from client_connect.models import Suppression
+from config import settings
+
+SUPPRESSED_ANSWER = "Адрес в списке исключений, письмо не отправлено"
+SUPPRESSED_CODE = 550  # постоянная ошибка: повторная отправка не планируется
+MIN_CAPACITY = 100000
+REFRESH_OVERLAP = 60  # секунд: исключения из транзакций, завершившихся после прошлого чтения
+
+
+def normalize_email(email: str) -> str:
+    """Адрес для сравнения со списком исключений: без пробелов, в нижнем регистре."""
+    return email.strip().lower()
+
+
+class BloomFilter:
+    """
+    Фильтр Блума: компактное множество строк в памяти(около 1.8 МБ на миллион адресов при доле ошибок 0.001).
+    Добавленная строка всегда находится, отсутствующая изредка(с долей false_positive) тоже считается найденной,
+    поэтому найденные строки проверяются точным запросом. Удалить строку из фильтра нельзя.
+    Атрибуты:
+        capacity(int): На сколько строк рассчитан фильтр с заданной долей ложных срабатываний
+        false_positive(float): Доля ложных срабатываний при заполнении до capacity
+        size(int): Количество бит
+        hashes(int): Количество хеш функций
+        count(int): Сколько раз добавлялись строки
+    Методы:
+        add(self, value: str) -> None:
+            Добавляет строку.
+        __contains__(self, value: str) -> bool:
+            Проверяет, что строка могла быть добавлена.
+    """
+
+    def __init__(self, capacity: int, false_positive: float) -> None:
+        self.capacity = max(1, capacity)
+        self.false_positive = false_positive
+        self.size = max(8, math.ceil(-self.capacity * math.log(false_positive) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value: str) -> Iterator[int]:
+        """Номера бит строки: двойное хеширование одним вызовом blake2b."""
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return ((first + number * second) % self.size for number in range(self.hashes))
+
+    def add(self, value: str) -> None:
+        """Добавляет строку."""
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value: str) -> bool:
+        """Проверяет, что строка могла быть добавлена: False - строки точно нет."""
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class SuppressionFilter:
+    """
+    Общий для процесса фильтр Блума по списку исключений(Suppression): получатели проверяются в памяти,
+    запрос к БД выполняется только для адресов, найденных фильтром.
+    Фильтр строится при первой проверке и дочитывает новые исключения не чаще раза в MAILING_SUPPRESSION_REFRESH
+    секунд(по индексу даты добавления); когда исключений становится больше расчетного, фильтр перестраивается
+    с двойным запасом. Удаленные исключения остаются в фильтре до перестройки и отсеиваются точным запросом.
+    Атрибуты:
+        false_positive(float): Доля ложных срабатываний фильтра
+        bloom(BloomFilter): Фильтр, None - еще не построен
+        loaded_at(datetime): Время начала последнего чтения исключений
+    Методы:
+        get() -> SuppressionFilter:
+            Возвращает общий для процесса фильтр.
+        reset() -> None:
+            Сбрасывает общий фильтр: следующая проверка построит его заново.
+        refresh(self, force: bool = False) -> None:
+            Строит фильтр или дочитывает новые исключения, если прошло MAILING_SUPPRESSION_REFRESH секунд.
+        add(self, email: str) -> None:
+            Добавляет адрес в построенный фильтр.
+        might_contain(self, email: str) -> bool:
+            Проверяет адрес по фильтру: False - адреса точно нет в списке исключений.
+    """
+
+    _instance: Optional["SuppressionFilter"] = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, false_positive: Optional[float] = None) -> None:
+        self.false_positive = false_positive or settings.MAILING_SUPPRESSION_FALSE_POSITIVE
+        self.bloom: Optional[BloomFilter] = None
+        self.loaded_at: Optional[datetime] = None
+        self._refreshed = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get(cls) -> "SuppressionFilter":
+        """Возвращает общий для процесса фильтр."""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    @classmethod
+    def reset(cls) -> None:
+        """Сбрасывает общий фильтр: следующая проверка построит его заново."""
+        with cls._instance_lock:
+            cls._instance = None
+
+    def refresh(self, force: bool = False) -> None:
+        """
+        Строит фильтр или дочитывает новые исключения, если прошло MAILING_SUPPRESSION_REFRESH секунд.
+        :param force: Дочитать исключения без учета времени прошлого чтения.
+        """
+        with self._lock:
+            if (
+                not force
+                and self.bloom is not None
+                and time.monotonic() - self._refreshed < settings.MAILING_SUPPRESSION_REFRESH
+            ):
+                return
+            started = timezone.now()
+            if self.bloom is None or self.bloom.count > self.bloom.capacity:
+                self.bloom = BloomFilter(max(MIN_CAPACITY, Suppression.objects.count() * 2), self.false_positive)
+                emails = Suppression.objects.values_list("email", flat=True)
+            else:
+                since = self.loaded_at - timedelta(seconds=REFRESH_OVERLAP)
+                emails = Suppression.objects.filter(created_at__gte=since).values_list("email", flat=True)
+            for email in emails.iterator(chunk_size=10000):
+                self.bloom.add(email)
+            self.loaded_at, self._refreshed = started, time.monotonic()
+
+    def add(self, email: str) -> None:
+        """Добавляет адрес в построенный фильтр(исключение, записанное этим процессом)."""
+        with self._lock:
+            if self.bloom is not None:
+                self.bloom.add(normalize_email(email))
+
+    def might_contain(self, email: str) -> bool:
+        """Проверяет адрес по фильтру: False - адреса точно нет в списке исключений."""
+        return self.bloom is not None and normalize_email(email) in self.bloom
+
+
+def find_suppressed(emails: Iterable[str]) -> set:
+    """
+    Находит адреса из списка исключений: все адреса проверяются фильтром Блума в памяти,
+    найденные фильтром - одним запросом по уникальному индексу.
+    :param emails: Адреса получателей.
+    :return: Адреса из списка исключений(в нижнем регистре).
+    """
+    suppression_filter = SuppressionFilter.get()
+    suppression_filter.refresh()
+    candidates = {normalize_email(email) for email in emails if suppression_filter.might_contain(email)}
+    if not candidates:
+        return set()
+    return set(Suppression.objects.filter(email__in=candidates).values_list("email", flat=True))
+
+
+def split_suppressed(rows: list, suppressed: set, on_suppressed: Callable[[dict], None]) -> list:
+    """
+    Отделяет получателей из списка исключений.
+    :param rows: Строки получателей {'id', 'email', ...}.
+    :param suppressed: Адреса из списка исключений(find_suppressed).
+    :param on_suppressed: Функция, вызываемая для каждой строки исключенного получателя.
+    :return: Строки получателей, которым письмо можно отправить.
+    """
+    if not suppressed:
+        return rows
+    allowed = []
+    for row in rows:
+        if normalize_email(row["email"]) in suppressed:
+            on_suppressed(row)
+        else:
+            allowed.append(row)
+    return allowed
+
+
+def screen_recipients(
+    rows: Iterable[dict], on_suppressed: Callable[[dict], None], chunk_size: Optional[int] = None
+) -> Iterator[dict]:
+    """
+    Пропускает получателей из списка исключений, проверяя порции по chunk_size строк.
+    :param rows: Строки получателей {'id', 'email', ...}.
+    :param on_suppressed: Функция, вызываемая для каждой строки исключенного получателя.
+    :param chunk_size: Размер порции(по умолчанию MAILING_RECIPIENTS_CHUNK_SIZE).
+    :return: Итератор строк получателей, которым письмо можно отправить.
+    """
+    chunk_size = chunk_size or settings.MAILING_RECIPIENTS_CHUNK_SIZE
+    rows = iter(rows)
+    while chunk := list(islice(rows, chunk_size)):
+        yield from split_suppressed(chunk, find_suppressed(row["email"] for row in chunk), on_suppressed)
+
+
+async def ascreen_recipients(
+    rows: AsyncIterable[dict], on_suppressed: Callable[[dict], None], chunk_size: Optional[int] = None
+) -> AsyncIterator[dict]:
+    """
+    Асинхронно пропускает получателей из списка исключений, проверяя порции по chunk_size строк.
+    Проверка порции выполняется в потоке(запросы к БД), on_suppressed вызывается в цикле событий.
+    :param rows: Асинхронный итератор строк получателей {'id', 'email', ...}.
+    :param on_suppressed: Функция, вызываемая для каждой строки исключенного получателя.
+    :param chunk_size: Размер порции(по умолчанию MAILING_RECIPIENTS_CHUNK_SIZE).
+    :return: Асинхронный итератор строк получателей, которым письмо можно отправить.
+    """
+    chunk_size = chunk_size or settings.MAILING_RECIPIENTS_CHUNK_SIZE
+    chunk: list = []
+    async for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            suppressed = await sync_to_async(find_suppressed)([item["email"] for item in chunk])
+            for allowed in split_suppressed(chunk, suppressed, on_suppressed):
+                yield allowed
+            chunk = []
+    if chunk:
+        suppressed = await sync_to_async(find_suppressed)([item["email"] for item in chunk])
+        for allowed in split_suppressed(chunk, suppressed, on_suppressed):
+            yield allowed
+
+
+def suppress(emails: Iterable[str], reason: str = "manual", comment: str = "") -> int:
+    """
+    Добавляет адреса в список исключений, уже исключенные адреса не меняются.
+    Адреса сразу попадают в фильтр этого процесса, другие процессы дочитают их при обновлении фильтра.
+    :param emails: Адреса.
+    :param reason: Причина исключения(Suppression.REASON_CHOICES).
+    :param comment: Комментарий.
+    :return: Количество переданных адресов без повторов.
+    """
+    emails = {normalize_email(email) for email in emails if email and email.strip()}
+    Suppression.objects.bulk_create(
+        (Suppression(email=email, reason=reason, comment=comment) for email in emails),
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    suppression_filter = SuppressionFilter.get()
+    for email in emails:
+        suppression_filter.add(email)
+    return len(emails)
@@ -1,3 +1,1589 @@
-# from django.test import TestCase
+import multiprocessing.pool
+import os
+import smtplib
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+from email import message_from_bytes, policy
+from email.utils import formatdate
+from io import StringIO
+from unittest.mock import patch
 
-# Create your tests here.
+from django.contrib.auth.models import Permission
+from django.core import mail, signing
+from django.core.cache import cache
+from django.core.mail import EmailMessage
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from client_connect.async_delivery import AsyncDeliveryEngine, AsyncSMTPClient, AsyncSMTPConnectionPool
+from client_connect.bounces import BounceRecord, fail_attempts, ingest_mailbox, parse_dsn
+from client_connect.cancellation import (CancellationToken, cancel_local, clear_cancel, clear_local_cancel,
+                                         request_cancel, share_cancels)
+from client_connect.circuit import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from client_connect.delivery import (DeliveryResult, MessageTemplate, ThreadedDeliveryEngine, batch_results,
+                                     save_attempts, stream_recipients)
+from client_connect.forms import MailingForm, MessageForm
+from client_connect.lanes import DomainLanes, recipient_domain
+from client_connect.leases import (Lease, LeaseHeartbeat, MailingLeaseError, acquire_lease, mailing_lease,
+                                   release_lease, renew_lease)
+from client_connect.models import (Bounce, DeliveryRetry, Mailing, MailingJob, Message, Recipient, SendingAttempt,
+                                   Suppression)
+from client_connect.personalization import PersonalizedText
+from client_connect.pipelining import PipeliningSMTP, SMTPDataDisconnected, SMTPRoundTrips
+from client_connect.progress import (finish_progress, get_progress, progress_event, record_progress, run_progress,
+                                     start_progress)
+from client_connect.rate_limit import RateLimiter, TokenBucket
+from client_connect.relays import Relay, RelayBalancer, RelayConfig
+from client_connect.retries import is_transient_failure, retry_delay, schedule_retries
+from client_connect.scheduler import MailingScheduler, next_run_time
+from client_connect.services import DeliveryRetryService, MailingJobService, MailingService
+from client_connect.sharding import build_shards
+from client_connect.smtp_pool import SMTPConnectionPool, get_connection_pool, reset_connection_pool
+from client_connect.smtp_sink import SMTPSink, use_sink
+from client_connect.suppression import SUPPRESSED_ANSWER, BloomFilter, SuppressionFilter, find_suppressed, suppress
+from client_connect.unsubscribe import (BUFFER_KEY, PROCESSING_KEY, UnsubscribeBuffer, make_token, read_token,
+                                        unsubscribe_links)
+from config import settings
+from users.models import CustomUser
+
+FROM_EMAIL = "mailing@sink.test"
+MESSAGE = b"Subject: test\r\n\r\nBody\r\n.line with dot\r\n"
+
+
+def make_dsn(message_id: str, mailing_id: int, *recipients: tuple) -> bytes:
+    """Уведомление о доставке(RFC 3464) по получателям (адрес, действие, код состояния)."""
+    blocks = "\n".join(
+        f"Final-Recipient: rfc822; {email}\nAction: {action}\nStatus: {status}\n"
+        f"Diagnostic-Code: smtp; {status[0]}50 {status} mailbox\n unavailable\n"
+        for email, action, status in recipients
+    )
+    return (
+        f"From: MAILER-DAEMON@mx.test\nMessage-ID: <{message_id}@mx.test>\nDate: {formatdate(time.time() + 60)}\n"
+        "MIME-Version: 1.0\nContent-Type: multipart/report; report-type=delivery-status; boundary=B\n\n"
+        "--B\nContent-Type: text/plain\n\nUndelivered\n\n"
+        f"--B\nContent-Type: message/delivery-status\n\nReporting-MTA: dns; mx.test\n\n{blocks}\n"
+        f"--B\nContent-Type: text/rfc822-headers\n\nFrom: {FROM_EMAIL}\nX-Mailing-Id: {mailing_id}\n\n--B--\n"
+    ).encode()
+
+
+class SMTPSinkTestCase(SimpleTestCase):
+    """Тесты тестового SMTP сервера: прием писем, ответы получателям, обрыв соединения."""
+
+    def setUp(self):
+        self.sink = SMTPSink(keep_messages=True).start()
+        self.addCleanup(self.sink.stop)
+
+    def connect(self) -> smtplib.SMTP:
+        smtp = smtplib.SMTP(self.sink.host, self.sink.port, timeout=5)
+        self.addCleanup(smtp.close)
+        return smtp
+
+    def test_accepts_message(self):
+        smtp = self.connect()
+        refused = smtp.sendmail(FROM_EMAIL, ["a@example.com", "b@example.com"], MESSAGE)
+        smtp.quit()
+        self.assertEqual(refused, {})
+        self.assertEqual(self.sink.stats.messages, 1)
+        self.assertEqual(self.sink.stats.recipients, 2)
+        self.assertEqual(self.sink.messages[0][:2], (FROM_EMAIL, ["a@example.com", "b@example.com"]))
+        self.assertIn(b"\r\n.line with dot\r\n", self.sink.messages[0][2])
+        self.assertEqual(len(self.sink.stats.latencies), 1)
+
+    def test_refuses_recipients(self):
+        smtp = self.connect()
+        refused = smtp.sendmail(FROM_EMAIL, ["a@example.com", "bad@example.com", "temp@example.com"], MESSAGE)
+        self.assertEqual(refused["bad@example.com"][0], 550)
+        self.assertEqual(refused["temp@example.com"][0], 451)
+        self.assertEqual(self.sink.stats.perm_failures, 1)
+        self.assertEqual(self.sink.stats.temp_failures, 1)
+        with self.assertRaises(smtplib.SMTPRecipientsRefused):
+            smtp.sendmail(FROM_EMAIL, ["bad@example.com"], MESSAGE)
+
+    def test_injected_failures(self):
+        self.sink.perm_fail = 1.0
+        smtp = self.connect()
+        with self.assertRaises(smtplib.SMTPRecipientsRefused):
+            smtp.sendmail(FROM_EMAIL, ["a@example.com"], MESSAGE)
+        self.assertEqual(self.sink.stats.messages, 0)
+
+    def test_drops_connection(self):
+        smtp = self.connect()
+        with self.assertRaises(smtplib.SMTPServerDisconnected):
+            smtp.sendmail(FROM_EMAIL, ["drop@example.com"], MESSAGE)
+        self.assertEqual(self.sink.stats.drops, 1)
+
+    def test_advertises_pipelining(self):
+        smtp = self.connect()
+        smtp.ehlo()
+        self.assertTrue(smtp.has_extn("pipelining"))
+        self.sink.pipelining = False
+        smtp = self.connect()
+        smtp.ehlo()
+        self.assertFalse(smtp.has_extn("pipelining"))
+
+
+class PipeliningSMTPTestCase(SimpleTestCase):
+    """Тесты конвейерной отправки команд: ожидания ответа сервера и ответы получателям."""
+
+    def send(self, pipelining: bool, recipients: list) -> tuple:
+        stats = SMTPRoundTrips()
+        with SMTPSink(pipelining=pipelining) as sink:
+            smtp = PipeliningSMTP(sink.host, sink.port, timeout=5, stats=stats)
+            try:
+                refused = smtp.sendmail(FROM_EMAIL, recipients, MESSAGE)
+            finally:
+                smtp.close()
+            return refused, stats, sink.stats
+
+    def test_pipelined_round_trips(self):
+        refused, stats, sink_stats = self.send(True, ["a@example.com", "bad@example.com", "c@example.com"])
+        self.assertEqual(list(refused), ["bad@example.com"])
+        self.assertEqual((stats.commands, stats.round_trips), (6, 2))
+        self.assertEqual(sink_stats.recipients, 2)
+
+    def test_fallback_without_pipelining(self):
+        refused, stats, sink_stats = self.send(False, ["a@example.com", "c@example.com"])
+        self.assertEqual(refused, {})
+        self.assertEqual(stats.saved, 0)
+        self.assertEqual(sink_stats.messages, 1)
+
+    def test_all_recipients_refused(self):
+        with self.assertRaises(smtplib.SMTPRecipientsRefused):
+            self.send(True, ["bad@example.com", "temp@example.com"])
+
+    def test_reuses_connection(self):
+        stats = SMTPRoundTrips()
+        with SMTPSink(keep_messages=True) as sink:
+            smtp = PipeliningSMTP(sink.host, sink.port, timeout=5, stats=stats)
+            try:
+                for number in range(3):
+                    smtp.sendmail(FROM_EMAIL, [f"user{number}@example.com"], MESSAGE)
+            finally:
+                smtp.close()
+        # после каждой транзакции соединение готово к следующей, точки в начале строк не теряются
+        self.assertEqual((sink.stats.connections, len(sink.messages)), (1, 3))
+        self.assertTrue(all(b"\r\n.line with dot\r\n" in data for _, _, data in sink.messages))
+        self.assertEqual((stats.commands, stats.round_trips), (12, 6))
+
+
+class AsyncSMTPClientTestCase(SimpleTestCase):
+    """Тесты асинхронного SMTP клиента движка async."""
+
+    def setUp(self):
+        self.sink = SMTPSink(keep_messages=True).start()
+        self.addCleanup(self.sink.stop)
+
+    def smtp_client(self, **options) -> AsyncSMTPClient:
+        return AsyncSMTPClient(self.sink.host, self.sink.port, timeout=5, **options)
+
+    async def test_closes_on_failed_connect(self):
+        client = self.smtp_client(use_tls=True)  # тестовый сервер не поддерживает STARTTLS
+        with self.assertRaises(smtplib.SMTPNotSupportedError):
+            await client.connect()
+        self.assertFalse(client.is_connected)
+        client = self.smtp_client(username="user", password="secret")
+        writers = []
+
+        async def fail_login():
+            writers.append(client._writer)
+            raise smtplib.SMTPAuthenticationError(535, b"Authentication failed")
+
+        with patch.object(client, "_login", side_effect=fail_login):
+            with self.assertRaises(smtplib.SMTPAuthenticationError):
+                await client.connect()
+        self.assertFalse(client.is_connected)
+        self.assertTrue(writers[0].is_closing())
+
+    async def test_pipelining(self):
+        for pipelining, round_trips in ((True, 2), (False, 6)):
+            with self.subTest(pipelining=pipelining):
+                stats = SMTPRoundTrips()
+                client = self.smtp_client(pipelining=pipelining, stats=stats)
+                await client.connect()
+                try:
+                    refused = await client.sendmail(
+                        FROM_EMAIL, ["a@example.com", "bad@example.com", "c@example.com"], MESSAGE
+                    )
+                finally:
+                    await client.quit()
+                self.assertEqual(list(refused), ["bad@example.com"])
+                self.assertEqual((stats.commands, stats.round_trips), (6, round_trips))
+                self.assertIn(b"\r\n.line with dot\r\n", self.sink.messages[-1][2])
+
+    async def test_pool_resend_before_data(self):
+        pool = AsyncSMTPConnectionPool(1, host=self.sink.host, port=self.sink.port, timeout=5)
+        for pipelining in (True, False):
+            with self.subTest(pipelining=pipelining):
+                self.sink.pipelining = pipelining
+                self.sink.reset_stats()
+                with self.assertRaises(smtplib.SMTPServerDisconnected) as error:  # обрыв до DATA - повтор
+                    await pool.send(FROM_EMAIL, ["drop@ex.com"], MESSAGE)
+                self.assertNotIsInstance(error.exception, SMTPDataDisconnected)
+                self.assertEqual(self.sink.stats.drops, 2)
+                self.sink.drop = 1.0  # обрыв после текста письма - без повтора
+                with self.assertRaises(SMTPDataDisconnected):
+                    await pool.send(FROM_EMAIL, ["user@ex.com"], MESSAGE)
+                self.sink.drop = 0.0
+                self.assertEqual(self.sink.stats.drops, 3)
+        await pool.close_all()
+
+
+class DeliveryEnginesTestCase(TestCase):
+    """Тесты отправки рассылки от начала до конца через тестовый SMTP сервер."""
+
+    def setUp(self):
+        self.sink = SMTPSink().start()
+        self.addCleanup(self.sink.stop)
+        sink_context = use_sink(self.sink)
+        sink_context.__enter__()
+        self.addCleanup(sink_context.__exit__, None, None, None)
+        message = Message.objects.create(subject="Тема {{ full_name }}", body="Здравствуйте, {{ full_name }}!")
+        self.mailing = Mailing.objects.create(message=message)
+        emails = [f"user{number}@ex{number % 3}.com" for number in range(20)] + ["bad@ex.com", "temp@ex.com"]
+        self.mailing.recipients.set(
+            Recipient.objects.create(email=email, full_name=f"Получатель {number}")
+            for number, email in enumerate(emails)
+        )
+
+    def deliver(self, engine) -> None:
+        report = engine.deliver(
+            recipients=MailingService.get_recipients(self.mailing),
+            subject=self.mailing.message.subject,
+            body=self.mailing.message.body,
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            mailing=self.mailing,
+        )
+        self.assertEqual((report.sent, report.failed), (20, 2))
+        self.assertEqual(self.sink.stats.recipients, 20)
+        self.assertEqual(SendingAttempt.objects.filter(mailing=self.mailing, status="success").count(), 20)
+        self.assertEqual(SendingAttempt.objects.filter(mailing=self.mailing, status="fail").count(), 2)
+
+    def test_threaded_engine(self):
+        pool = SMTPConnectionPool(size=2, host=self.sink.host, port=self.sink.port, timeout=5)
+        self.addCleanup(pool.close_all)
+        self.deliver(ThreadedDeliveryEngine(workers=2, pool=pool))
+        self.assertEqual(self.sink.stats.connections, 2)
+
+    def test_threaded_workers(self):
+        pool = SMTPConnectionPool(size=2, host=self.sink.host, port=self.sink.port, timeout=5)
+        self.addCleanup(pool.close_all)
+        with patch.object(settings, "MAILING_WORKERS", 6):
+            engine = ThreadedDeliveryEngine(pool=pool, queue_size=1)
+        # за потоком закреплено соединение: потоков не больше, чем соединений в пуле, очередь не меньше потоков
+        self.assertEqual((engine.workers, engine.queue_size), (2, 2))
+        engine = ThreadedDeliveryEngine(workers=6, connection_per_worker=False, pool=pool)
+        self.assertEqual(engine.workers, 6)  # потоки берут соединение из пула на каждое письмо
+        self.deliver(engine)
+        self.assertEqual(self.sink.stats.connections, 2)
+
+    def test_async_engine(self):
+        self.deliver(AsyncDeliveryEngine(concurrency=4))
+
+    def test_pool_resend_before_data(self):
+        pool = SMTPConnectionPool(size=1, host=self.sink.host, port=self.sink.port, timeout=5)
+        self.addCleanup(pool.close_all)
+        for pipelining in (True, False):
+            with self.subTest(pipelining=pipelining):
+                self.sink.pipelining = pipelining
+                self.sink.reset_stats()
+                # обрыв на RCPT TO - до DATA: письмо повторяется через новое соединение
+                with self.assertRaises(smtplib.SMTPServerDisconnected) as error:
+                    pool.send(FROM_EMAIL, ["drop@ex.com"], MESSAGE)
+                self.assertNotIsInstance(error.exception, SMTPDataDisconnected)
+                self.assertEqual(self.sink.stats.drops, 2)
+                # обрыв после текста письма: сервер мог принять письмо, повтора нет
+                self.sink.drop = 1.0
+                with self.assertRaises(SMTPDataDisconnected):
+                    pool.send(FROM_EMAIL, ["user@ex.com"], MESSAGE)
+                self.sink.drop = 0.0
+                self.assertEqual(self.sink.stats.drops, 3)
+                result = batch_results([{"id": 1, "email": "user@ex.com"}], exc_info=SMTPDataDisconnected("drop"))
+                self.assertTrue(is_transient_failure(result[0].status, result[0].code))  # повтор по расписанию
+
+    def test_stream_recipients(self):
+        recipients = MailingService.get_recipients(self.mailing)
+        with patch.object(settings, "MAILING_RECIPIENTS_CHUNK_SIZE", 5), CaptureQueriesContext(connection) as queries:
+            rows = stream_recipients(recipients)
+            first = next(rows)
+            self.assertEqual(len(queries), 1)
+            rest = list(rows)
+        self.assertEqual(len(queries), 1)  # один запрос, строки читаются порциями
+        self.assertEqual(len(rest) + 1, 22)
+        self.assertLessEqual({"id", "email"}, first.keys())
+        self.assertIsNone(recipients._result_cache)  # QuerySet не держит все строки в памяти
+        rows = [{"id": 1, "email": "user@ex.com"}]
+        self.assertIs(stream_recipients(rows), rows)
+
+    def test_send_messages(self):
+        for engine in MailingService.ENGINES:
+            with self.subTest(engine=engine):
+                SendingAttempt.objects.all().delete()
+                self.sink.reset_stats()
+                report = MailingService.send_messages(
+                    recipients=MailingService.get_recipients(self.mailing),
+                    message=self.mailing.message,
+                    mailing=self.mailing,
+                    engine=engine,
+                )
+                self.assertEqual((report.sent, report.failed), (20, 2))
+                self.assertEqual(self.sink.stats.messages, 20)
+
+    def test_send_mailing_command(self):
+        for engine in MailingService.ENGINES:
+            with self.subTest(engine=engine):
+                SendingAttempt.objects.all().delete()
+                Mailing.objects.filter(pk=self.mailing.pk).update(sent_count=0, failed_count=0)
+                self.sink.reset_stats()
+                out = StringIO()
+                call_command("send_mailing", self.mailing.pk, "--engine", engine, stdout=out)
+                self.assertEqual((self.sink.stats.messages, self.sink.stats.recipients), (20, 20))
+                self.assertIn("Отправлено: 20, не отправлено: 2.", out.getvalue())
+                self.assertIn("Проблема с получателем bad@ex.com", out.getvalue())
+                attempts = SendingAttempt.objects.filter(mailing=self.mailing)
+                self.assertEqual(attempts.filter(status="success").count(), 20)
+                self.assertEqual(
+                    set(attempts.filter(status="fail").values_list("recipient__email", flat=True)),
+                    {"bad@ex.com", "temp@ex.com"},
+                )
+                mailing = Mailing.objects.get(pk=self.mailing.pk)
+                self.assertEqual((mailing.sent_count, mailing.failed_count), (20, 2))
+                self.assertEqual(mailing.lease_owner, "")  # аренда освобождена после отправки
+
+    def test_mail_backend(self):
+        self.addCleanup(reset_connection_pool)
+        with patch.object(settings, "EMAIL_BACKEND", "django.core.mail.backends.locmem.EmailBackend"):
+            for engine in MailingService.ENGINES:
+                with self.subTest(engine=engine):
+                    mail.outbox = []
+                    reset_connection_pool()
+                    report = MailingService.send_messages(
+                        recipients=MailingService.get_recipients(self.mailing),
+                        message=self.mailing.message,
+                        mailing=self.mailing,
+                        engine=engine,
+                    )
+                    self.assertEqual((report.sent, report.failed), (22, 0))
+                    self.assertEqual(self.sink.stats.messages, 0)  # письма не ушли на SMTP сервер
+                    email = next(item for item in mail.outbox if item.to == ["user1@ex1.com"])
+                    self.assertEqual(email.subject, "Тема Получатель 1")
+                    self.assertEqual(email.extra_headers["X-Mailing-Id"], str(self.mailing.pk))
+
+    def test_run_mailing_progress(self):
+        cache.clear()
+        MailingService.run_mailing(self.mailing)
+        progress = get_progress(self.mailing.pk)
+        self.assertEqual((progress["sent"], progress["failed"], progress["total"]), (20, 2, 22))
+        self.assertTrue(progress["finished"])
+        self.assertEqual(Mailing.objects.get(pk=self.mailing.pk).status, "done")
+
+    def test_resume(self):
+        recipients = list(self.mailing.recipients.order_by("id"))
+        SendingAttempt.objects.bulk_create(  # прошлый запуск доставлен всем, кроме двух последних
+            SendingAttempt(mailing=self.mailing, recipient=recipient, status="success")
+            for recipient in recipients[:20]
+        )
+        SendingAttempt.objects.update(created_at=timezone.now() - timedelta(days=1))
+        MailingService.begin_run(self.mailing)
+        SendingAttempt.objects.bulk_create(  # текущий запуск прерван после пяти получателей
+            SendingAttempt(mailing=self.mailing, recipient=recipient, status="success") for recipient in recipients[:5]
+        )
+        self.assertEqual(MailingService.get_recipients(self.mailing, resume=True).count(), 17)
+        call_command("send_mailing", self.mailing.pk, "--resume", stdout=StringIO())
+        self.assertEqual(self.sink.stats.recipients, 15)
+        self.assertEqual(Mailing.objects.get(pk=self.mailing.pk).run_started_at, self.mailing.run_started_at)
+
+    def test_take_over_recurring(self):
+        recipients = list(self.mailing.recipients.order_by("id"))
+        SendingAttempt.objects.bulk_create(  # прошлый запуск повторяющейся рассылки
+            SendingAttempt(mailing=self.mailing, recipient=recipient, status="success")
+            for recipient in recipients[:20]
+        )
+        SendingAttempt.objects.update(created_at=timezone.now() - timedelta(days=1))
+        Mailing.objects.filter(pk=self.mailing.pk).update(
+            status="launched",
+            repeat="daily",
+            run_started_at=timezone.now() - timedelta(minutes=5),
+            lease_owner="node-1",
+            lease_expires_at=timezone.now() - timedelta(seconds=1),
+        )
+        SendingAttempt.objects.bulk_create(  # node-1 упал после пяти получателей
+            SendingAttempt(mailing=self.mailing, recipient=recipient, status="success") for recipient in recipients[:5]
+        )
+        self.mailing.refresh_from_db()
+        report = MailingService.run_mailing(self.mailing, owner="node-2")
+        self.assertEqual((report.sent, report.failed), (15, 2))
+
+    def test_mailing_counters(self):
+        stale = Mailing.objects.get(pk=self.mailing.pk)  # форма открыта до отправки
+        MailingService.run_mailing(self.mailing)
+        data = {"message": stale.message_id, "recipients": list(stale.recipients.values_list("pk", flat=True))}
+        form = MailingForm(data={**data, "rate_limit": 5}, instance=stale)
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()  # сохранение формы не затирает счетчики отправки
+        mailing = Mailing.objects.get(pk=self.mailing.pk)
+        self.assertEqual((mailing.rate_limit, mailing.status), (5, "done"))
+        self.assertEqual((mailing.total_count, mailing.sent_count, mailing.failed_count), (22, 20, 2))
+        self.assertIsNotNone(mailing.last_attempt_at)
+        mailing.sent_count = 0
+        mailing.save()  # обычное сохранение модели записывает все поля
+        self.assertEqual(Mailing.objects.get(pk=mailing.pk).sent_count, 0)
+        Mailing.objects.filter(pk=mailing.pk).update(total_count=0, sent_count=0, failed_count=0)
+        call_command("repair_mailing_counters", stdout=StringIO())
+        mailing.refresh_from_db()
+        self.assertEqual((mailing.total_count, mailing.sent_count, mailing.failed_count), (22, 20, 2))
+        Mailing.objects.filter(pk=mailing.pk).update(rate_limit=None)
+        mailing.refresh_from_db()
+        MailingService.run_mailing(mailing)  # следующий запуск: счетчики относятся к текущему запуску
+        self.assertEqual(SendingAttempt.objects.filter(mailing=mailing, status="success").count(), 40)
+        for _ in range(2):
+            mailing.refresh_from_db()
+            self.assertEqual((mailing.total_count, mailing.sent_count, mailing.failed_count), (22, 20, 2))
+            call_command("repair_mailing_counters", stdout=StringIO())
+
+    def test_total_count(self):
+        recipient = Recipient.objects.create(email="new@ex.com")
+        self.mailing.recipients.add(recipient)
+        self.assertEqual(Mailing.objects.get(pk=self.mailing.pk).total_count, 23)
+        self.mailing.recipients.remove(*self.mailing.recipients.exclude(pk=recipient.pk)[:3])
+        self.assertEqual(Mailing.objects.get(pk=self.mailing.pk).total_count, 20)
+        recipient.mailings.clear()  # со стороны получателя
+        self.assertEqual(Mailing.objects.get(pk=self.mailing.pk).total_count, 19)
+        recipient.mailings.add(self.mailing)
+        self.assertEqual(Mailing.objects.get(pk=self.mailing.pk).total_count, 20)
+        self.mailing.recipients.clear()
+        self.assertEqual(Mailing.objects.get(pk=self.mailing.pk).total_count, 0)
+
+    def test_circuit_breaker_pause(self):
+        pool = SMTPConnectionPool(size=2, host=self.sink.host, port=self.sink.port, timeout=5)
+        self.addCleanup(pool.close_all)
+        engines = {
+            "threaded": lambda breaker: ThreadedDeliveryEngine(
+                workers=2, queue_size=2, pool=pool, circuit_breaker=breaker
+            ),
+            "async": lambda breaker: AsyncDeliveryEngine(concurrency=2, circuit_breaker=breaker),
+        }
+        for name, make_engine in engines.items():
+            with self.subTest(engine=name):
+                self.sink.drop = 1.0  # SMTP сервер обрывает соединение после каждого письма
+                breaker = CircuitBreaker("sink", error_rate=0.5, window=4, min_calls=4, open_time=0.2, probes=2)
+
+                def on_result(result: DeliveryResult) -> None:
+                    if breaker.state != CLOSED:
+                        self.sink.drop = 0.0  # SMTP сервер восстановился во время паузы
+
+                report = make_engine(breaker).deliver(
+                    recipients=MailingService.get_recipients(self.mailing),
+                    subject=self.mailing.message.subject,
+                    body=self.mailing.message.body,
+                    from_email=settings.DEFAULT_FROM_EMAIL,
+                    mailing=self.mailing,
+                    on_result=on_result,
+                )
+                self.assertEqual((breaker.opened, breaker.state), (1, CLOSED))
+                self.assertGreater(report.paused, 0)
+                self.assertEqual(report.total, 22)
+                self.assertLess(report.failed, 10)
+
+    def test_send_messages_batch(self):
+        self.mailing.message.subject = self.mailing.message.body = "Новости"
+        self.mailing.batch_send = True
+        for engine in MailingService.ENGINES:
+            with self.subTest(engine=engine):
+                SendingAttempt.objects.all().delete()
+                self.sink.reset_stats()
+                report = MailingService.send_messages(
+                    recipients=MailingService.get_recipients(self.mailing),
+                    message=self.mailing.message,
+                    mailing=self.mailing,
+                    engine=engine,
+                )
+                self.assertEqual((report.sent, report.failed), (20, 2))
+                self.assertEqual(self.sink.stats.recipients, 20)
+                self.assertLess(self.sink.stats.messages, 20)
+                # со ссылками отписки письмо у каждого получателя свое
+                SendingAttempt.objects.all().delete()
+                self.sink.reset_stats()
+                with patch.object(settings, "MAILING_UNSUBSCRIBE_BASE_URL", "https://example.com"):
+                    MailingService.send_messages(
+                        recipients=MailingService.get_recipients(self.mailing),
+                        message=self.mailing.message,
+                        mailing=self.mailing,
+                        engine=engine,
+                    )
+                self.assertEqual(self.sink.stats.messages, 20)
+
+    def test_batch_refused_recipients(self):
+        emails = ["bad@batch.com", "temp@batch.com"] + [f"user{number}@batch.com" for number in range(6)]
+        self.mailing.recipients.set(Recipient.objects.create(email=email) for email in emails)
+        engines = {
+            "threaded": lambda: ThreadedDeliveryEngine(workers=2, rcpt_batch_size=4),
+            "async": lambda: AsyncDeliveryEngine(concurrency=2, rcpt_batch_size=4),
+        }
+        for name, make_engine in engines.items():
+            with self.subTest(engine=name):
+                self.sink.reset_stats()
+                codes = {}
+                report = make_engine().deliver(
+                    recipients=MailingService.get_recipients(self.mailing),
+                    subject="Новости",
+                    body="Текст",
+                    from_email=FROM_EMAIL,
+                    mailing=self.mailing,
+                    on_result=lambda result: codes.update({result.recipient: result.code}),
+                )
+                # две транзакции по 4 получателя, отказ отдельным адресам записан только им
+                self.assertEqual((report.sent, report.failed, self.sink.stats.messages), (6, 2, 2))
+                self.assertEqual(
+                    (codes["bad@batch.com"], codes["temp@batch.com"], codes["user0@batch.com"]), (550, 451, None)
+                )
+
+    def test_throttled_domain(self):
+        self.addCleanup(RateLimiter._local_buckets.clear)
+        emails = [f"user{number}@slow.com" for number in range(12)] + [f"user{number}@fast.com" for number in range(4)]
+        self.mailing.recipients.set(Recipient.objects.create(email=email) for email in emails)
+        options = {
+            "MAILING_DOMAIN_LIMITS": "slow.com=0/20",
+            "MAILING_RATE_BURST": 1,
+            "MAILING_RECIPIENTS_CHUNK_SIZE": 4,
+        }
+        for engine in MailingService.ENGINES:
+            with self.subTest(engine=engine), patch.multiple(settings, **options):
+                RateLimiter._local_buckets.clear()
+                domains = []
+                report = MailingService.send_messages(
+                    recipients=MailingService.get_recipients(self.mailing),
+                    message=self.mailing.message,
+                    mailing=self.mailing,
+                    on_result=lambda result: domains.append(recipient_domain(result.recipient)),
+                    engine=engine,
+                )
+                self.assertEqual(report.sent, 16)
+                # окно из 4 получателей занял slow.com(20 писем в секунду): fast.com отправлен, не дожидаясь slow.com
+                self.assertLess(max(index for index, domain in enumerate(domains) if domain == "fast.com"), 8)
+
+    def test_stale_cancel_flag(self):
+        with patch.object(settings, "CACHE_ENABLED", True):
+            request_cancel(self.mailing.pk)  # флаг прошлого отключения, рассылка снова включена
+            call_command("send_mailing", self.mailing.pk, stdout=StringIO())
+            cache.clear()
+        self.assertEqual(self.sink.stats.recipients, 20)
+
+    def test_suppressed_recipients(self):
+        SuppressionFilter.reset()
+        self.addCleanup(SuppressionFilter.reset)
+        suppress(["USER1@ex1.com", "user2@ex2.com"], reason="bounce")
+        for engine in MailingService.ENGINES:
+            with self.subTest(engine=engine):
+                SendingAttempt.objects.all().delete()
+                self.sink.reset_stats()
+                report = MailingService.send_messages(
+                    recipients=MailingService.get_recipients(self.mailing),
+                    message=self.mailing.message,
+                    mailing=self.mailing,
+                    engine=engine,
+                )
+                self.assertEqual((report.sent, report.failed, report.suppressed), (18, 4, 2))
+                self.assertEqual(self.sink.stats.recipients, 18)
+                self.assertEqual(SendingAttempt.objects.filter(answer=SUPPRESSED_ANSWER).count(), 2)
+
+
+class MessageTemplateTestCase(SimpleTestCase):
+    """Тесты письма рассылки, закодированного один раз: заголовки получателя добавляются к готовым байтам."""
+
+    def test_encoded_once(self):
+        with patch("client_connect.delivery.EmailMessage", wraps=EmailMessage) as email_message:
+            template = MessageTemplate(
+                "Новости", "Текст письма\n.строка с точкой", FROM_EMAIL, headers={"X-Mailing-Id": "7"}
+            )
+            first, second = template.render("user1@example.com"), template.render("Получатель <user2@example.com>")
+        email_message.assert_called_once()
+        self.assertEqual(first.partition(b"\r\n\r\n")[2], second.partition(b"\r\n\r\n")[2])
+        messages = [message_from_bytes(raw, policy=policy.default) for raw in (first, second)]
+        self.assertEqual(messages[0]["To"], "user1@example.com")
+        self.assertEqual(messages[1]["To"].addresses[0].display_name, "Получатель")
+        self.assertNotEqual(messages[0]["Message-ID"], messages[1]["Message-ID"])
+        for message in messages:
+            self.assertEqual((message["Subject"], message["X-Mailing-Id"]), ("Новости", "7"))
+            self.assertEqual(message.get_content().splitlines(), ["Текст письма", ".строка с точкой"])
+            self.assertEqual(len(message.get_all("To")), 1)
+
+    def test_personalized_part(self):
+        template = MessageTemplate("Новости", "Здравствуйте, {{ full_name }}!", FROM_EMAIL)
+        raw = template.render("user@example.com", {"email": "user@example.com", "full_name": "Иван"})
+        message = message_from_bytes(raw, policy=policy.default)
+        self.assertEqual(message["Content-Transfer-Encoding"], "quoted-printable")
+        self.assertEqual(message.get_content().strip(), "Здравствуйте, Иван!")
+        self.assertEqual(message["Subject"], "Новости")  # тема без подстановок закодирована один раз
+
+
+class PersonalizationTestCase(TestCase):
+    """Тесты подстановок данных получателя: пустое Ф.И.О., неизвестные подстановки в форме сообщения."""
+
+    def test_missing_full_name(self):
+        text = PersonalizedText("Здравствуйте, {{ full_name }}! Ваш адрес {{email}}, {{ phone }}")
+        self.assertEqual(text.fields, ("full_name", "email"))
+        for context in ({"email": "user@example.com"}, {"email": "user@example.com", "full_name": None}):
+            with self.subTest(context=context):
+                # неизвестная подстановка остается в тексте как есть
+                self.assertEqual(text.render(context), "Здравствуйте, ! Ваш адрес user@example.com, {{ phone }}")
+        self.assertTrue(PersonalizedText("Текст {{ phone }}").is_static)
+
+    def test_blank_full_name(self):
+        template = MessageTemplate("Тема {{ full_name }}", "Здравствуйте, {{ full_name }}!", FROM_EMAIL)
+        for full_name in ("", "   ", None):
+            with self.subTest(full_name=full_name):
+                row = {"email": "user@example.com", "full_name": full_name}
+                message = message_from_bytes(template.render("user@example.com", row), policy=policy.default)
+                self.assertEqual(message["Subject"].strip(), "Тема")
+                self.assertEqual(message.get_content().strip(), f"Здравствуйте, {full_name or ''}!")
+
+    def test_message_form(self):
+        form = MessageForm(data={"subject": "Привет, {{ name }}", "body": "{{ full_name }}: {{ phone }}, {{ code }}"})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors["subject"], ["Неизвестные подстановки: name"])
+        self.assertEqual(form.errors["body"], ["Неизвестные подстановки: code, phone"])
+        form = MessageForm(data={"subject": "Привет, {{ full_name }}", "body": "{{ email }} {{ unsubscribe_url }}"})
+        self.assertTrue(form.is_valid())
+
+
+class SuppressionFilterTestCase(TestCase):
+    """Тесты фильтра Блума списка исключений: без пропусков, доля ложных срабатываний, дочитывание."""
+
+    def setUp(self):
+        SuppressionFilter.reset()
+        self.addCleanup(SuppressionFilter.reset)
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(1000, 0.001)
+        for number in range(1000):
+            bloom.add(f"user{number}@example.com")
+        self.assertTrue(all(f"user{number}@example.com" in bloom for number in range(1000)))
+        false_positives = sum(f"other{number}@example.com" in bloom for number in range(20000))
+        self.assertLess(false_positives, 100)
+
+    def test_refresh(self):
+        self.assertEqual(find_suppressed(["user@example.com"]), set())
+        Suppression.objects.create(email="User@Example.com")  # исключение другого процесса
+        self.assertEqual(find_suppressed(["user@example.com"]), set())  # фильтр еще не дочитан
+        SuppressionFilter.get().refresh(force=True)
+        self.assertEqual(find_suppressed(["USER@example.com", "other@example.com"]), {"user@example.com"})
+        Suppression.objects.all().delete()
+        self.assertEqual(find_suppressed(["user@example.com"]), set())  # ложное срабатывание отсеяно запросом
+
+
+class BounceIngestTestCase(TestCase):
+    """Тесты обработки уведомлений о недоставке: разбор DSN, результаты доставки, исключения, повторный запуск."""
+
+    def setUp(self):
+        SuppressionFilter.reset()
+        self.addCleanup(SuppressionFilter.reset)
+        self.mailing = Mailing.objects.create(message=Message.objects.create(subject="Тема", body="Текст"))
+        recipients = [Recipient.objects.create(email=f"user{number}@ex.com") for number in range(3)]
+        SendingAttempt.objects.bulk_create(
+            SendingAttempt(status="success", answer="", mailing=self.mailing, recipient=recipient)
+            for recipient in recipients
+        )
+        Mailing.objects.filter(pk=self.mailing.pk).update(total_count=3, sent_count=3)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_parse_dsn(self):
+        records = parse_dsn(make_dsn("1", self.mailing.pk, ("User0@ex.com", "failed", "5.1.1")))
+        self.assertEqual(len(records), 1)
+        self.assertEqual(
+            (records[0].email, records[0].status, records[0].mailing_id), ("User0@ex.com", "5.1.1", self.mailing.pk)
+        )
+        self.assertEqual(records[0].diagnostic, "550 5.1.1 mailbox unavailable")
+        self.assertTrue(records[0].is_hard)
+        self.assertIsNone(parse_dsn(MESSAGE))
+
+    def test_ingest_mbox(self):
+        path = os.path.join(self.directory.name, "bounces.mbox")
+        with open(path, "wb") as file:
+            for message in (
+                make_dsn(
+                    "1", self.mailing.pk, ("User0@ex.com", "failed", "5.1.1"), ("user1@ex.com", "delayed", "4.4.1")
+                ),
+                make_dsn("2", self.mailing.pk, ("user2@ex.com", "failed", "5.7.1")),
+                MESSAGE,
+            ):
+                file.write(b"From MAILER-DAEMON Fri Oct 16 10:00:00 2026\n" + message + b"\n")
+        for _ in range(2):  # повторный запуск ничего не меняет
+            call_command("ingest_bounces", path, stdout=StringIO())
+            attempts = dict(SendingAttempt.objects.values_list("recipient__email", "status"))
+            self.assertEqual(attempts, {"user0@ex.com": "fail", "user1@ex.com": "success", "user2@ex.com": "fail"})
+            mailing = Mailing.objects.get(pk=self.mailing.pk)
+            self.assertEqual((mailing.sent_count, mailing.failed_count), (1, 2))
+            self.assertEqual(list(Suppression.objects.values_list("email", flat=True)), ["user0@ex.com"])
+            self.assertEqual(Bounce.objects.count(), 3)
+
+    def test_bounce_counters(self):
+        user0, user1 = Recipient.objects.filter(email__in=("user0@ex.com", "user1@ex.com")).order_by("email")
+        SendingAttempt.objects.create(status="fail", answer="451", mailing=self.mailing, recipient=user1)
+        SendingAttempt.objects.filter(status="fail").update(created_at=timezone.now() + timedelta(minutes=1))
+        Mailing.objects.filter(pk=self.mailing.pk).update(sent_count=1, failed_count=1)  # счетчики разошлись
+        records = [
+            BounceRecord(str(number), recipient.email, "failed", "5.1.1", "", mailing_id=self.mailing.pk)
+            for number, recipient in enumerate((user0, user1))
+        ]
+        self.assertEqual(fail_attempts(records), 2)
+        mailing = Mailing.objects.get(pk=self.mailing.pk)
+        # sent_count не уходит ниже нуля, user1 уже считался неотправленным по более поздней попытке
+        self.assertEqual((mailing.sent_count, mailing.failed_count), (0, 2))
+
+    def test_ingest_maildir(self):
+        for number, folder in enumerate(("new", "cur")):
+            os.makedirs(os.path.join(self.directory.name, folder))
+            with open(os.path.join(self.directory.name, folder, f"{number}.mx"), "wb") as file:
+                file.write(make_dsn(str(number), self.mailing.pk, (f"user{number}@ex.com", "failed", "5.1.1")))
+        totals = ingest_mailbox(self.directory.name, batch_size=1)
+        self.assertEqual((totals["messages"], totals["new"], totals["updated"], totals["suppressed"]), (2, 2, 2, 2))
+
+
+class FakeRedis:
+    """Списки Redis в памяти для буфера отписок: RPUSH, LLEN, LRANGE, LMOVE, DEL, транзакция и блокировка."""
+
+    def __init__(self):
+        self.lists = defaultdict(list)
+        self.locked = threading.Lock()
+
+    def rpush(self, key: str, *values) -> int:
+        self.lists[key].extend(value.encode() for value in values)
+        return len(self.lists[key])
+
+    def llen(self, key: str) -> int:
+        return len(self.lists[key])
+
+    def lrange(self, key: str, start: int, end: int) -> list:
+        return self.lists[key][start:][: None if end == -1 else end + 1 - start]
+
+    def lmove(self, source: str, destination: str, src: str, dest: str):
+        if self.lists[source]:
+            self.lists[destination].append(self.lists[source].pop(0))
+
+    def delete(self, key: str) -> None:
+        self.lists.pop(key, None)
+
+    def pipeline(self, transaction: bool = True) -> "FakeRedis":
+        return self
+
+    def execute(self) -> None:
+        pass
+
+    def lock(self, name: str, timeout: float, blocking: bool) -> "FakeRedis":
+        return self
+
+    def acquire(self) -> bool:
+        return self.locked.acquire(blocking=False)
+
+    def release(self) -> None:
+        self.locked.release()
+
+
+class UnsubscribeTestCase(TestCase):
+    """Тесты отписки: подписанные токены, заголовки List-Unsubscribe, буфер отписок с записью пачками."""
+
+    def setUp(self):
+        SuppressionFilter.reset()
+        self.addCleanup(SuppressionFilter.reset)
+        patcher = patch.object(settings, "MAILING_UNSUBSCRIBE_BATCH_SIZE", 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_token(self):
+        token = make_token(7, "user@example.com")
+        self.assertEqual(read_token(token), (7, "user@example.com"))
+        for forged in (token[:-1] + ("A" if token[-1] != "A" else "B"), "user@example.com"):
+            with self.assertRaises(signing.BadSignature):
+                read_token(forged)
+
+    def test_token_expiry(self):
+        token = make_token(7, "user@example.com")
+        with patch("django.core.signing.time.time", return_value=time.time() + 91 * 24 * 3600):
+            with self.assertRaises(signing.SignatureExpired):
+                read_token(token)
+            url = reverse("client_connect:unsubscribe", args=[token])
+            self.assertEqual(self.client.post(url, {"List-Unsubscribe": "One-Click"}).status_code, 400)
+        with patch.object(settings, "MAILING_UNSUBSCRIBE_MAX_AGE_DAYS", 1):
+            self.assertEqual(read_token(token), (7, "user@example.com"))
+        self.assertFalse(Suppression.objects.exists())
+
+    def test_csrf(self):
+        client = Client(enforce_csrf_checks=True)
+        url = reverse("client_connect:unsubscribe", args=[make_token(7, "user1@example.com")])
+        # кнопка страницы - обычная форма с CSRF токеном, в один клик почтовый клиент отписывает без токена
+        self.assertEqual(client.post(url).status_code, 403)
+        self.assertFalse(Suppression.objects.exists())
+        page = client.get(url)
+        self.assertEqual(client.post(url, {"csrfmiddlewaretoken": page.context["csrf_token"]}).status_code, 200)
+        url = reverse("client_connect:unsubscribe", args=[make_token(7, "user2@example.com")])
+        self.assertEqual(client.post(url, {"List-Unsubscribe": "One-Click"}).status_code, 200)
+        self.assertEqual(Suppression.objects.count(), 2)
+
+    def test_headers(self):
+        self.assertIsNone(unsubscribe_links(7))  # без адреса сайта письма без ссылок отписки
+        self.assertNotIn(b"List-Unsubscribe", MessageTemplate("Тема", "Текст", FROM_EMAIL).render("user@example.com"))
+        with patch.object(settings, "MAILING_UNSUBSCRIBE_BASE_URL", "https://example.com"):
+            link = unsubscribe_links(7)
+        template = MessageTemplate("Тема", "Отписаться: {{ unsubscribe_url }}", FROM_EMAIL, unsubscribe=link)
+        message = message_from_bytes(template.render("user@example.com"))
+        self.assertEqual(message["List-Unsubscribe"], f"<{link('user@example.com')}>")
+        self.assertEqual(message["List-Unsubscribe-Post"], "List-Unsubscribe=One-Click")
+        self.assertIn(link("user@example.com"), message.get_payload(decode=True).decode())
+        # ссылка отписки у каждого получателя своя: письмо со ссылками пачкой не отправляется
+        self.assertFalse(MessageTemplate("Тема", "Текст", FROM_EMAIL, unsubscribe=link).is_batchable)
+        self.assertTrue(MessageTemplate("Тема", "Текст", FROM_EMAIL).is_batchable)
+
+    def test_one_click(self):
+        url = reverse("client_connect:unsubscribe", args=[make_token(7, "User1@example.com")])
+        self.assertEqual(self.client.get(url).status_code, 200)  # переход по ссылке не отписывает
+        self.assertEqual(self.client.post(url, {"List-Unsubscribe": "One-Click"}).status_code, 200)
+        # без Redis отписка сразу в БД: буфер в памяти процесса терялся бы при перезапуске
+        self.assertEqual(list(Suppression.objects.values_list("email", flat=True)), ["user1@example.com"])
+        self.client.post(reverse("client_connect:unsubscribe", args=[make_token(8, "user2@example.com")]))
+        emails = set(Suppression.objects.values_list("email", flat=True))
+        self.assertEqual(emails, {"user1@example.com", "user2@example.com"})
+        forged = reverse("client_connect:unsubscribe", args=[make_token(7, "user1@example.com") + "x"])
+        self.assertEqual(self.client.post(forged).status_code, 400)
+
+    def use_redis(self) -> "FakeRedis":
+        """Буфер отписок в FakeRedis вместо Redis кеша."""
+        client = FakeRedis()
+        for patcher in (
+            patch("client_connect.unsubscribe.redis_client", return_value=client),
+            patch.object(settings, "CACHE_ENABLED", True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        return client
+
+    def test_buffer(self):
+        client = self.use_redis()
+        for number in range(3):
+            UnsubscribeBuffer.add(7, f"user{number}@example.com")
+        # буфер из 2 отписок записан одной пачкой, третья ждет исполнителя run_mail_worker
+        self.assertEqual(Suppression.objects.count(), 2)
+        self.assertEqual(len(client.lists[cache.make_key(BUFFER_KEY)]), 1)
+        call_command("run_mail_worker", "--once", "--no-retries", stdout=StringIO())
+        self.assertEqual(Suppression.objects.count(), 3)
+        self.assertEqual(UnsubscribeBuffer.flush(), 0)
+
+    def test_flush_failure(self):
+        client = self.use_redis()
+        with patch.object(settings, "MAILING_UNSUBSCRIBE_BATCH_SIZE", 10):
+            UnsubscribeBuffer.add(7, "user1@example.com")
+            UnsubscribeBuffer.add(8, "user2@example.com")
+        with patch("client_connect.unsubscribe.suppress", side_effect=[1, RuntimeError("db")]):
+            with self.assertRaises(RuntimeError):
+                UnsubscribeBuffer.flush()
+        # пачка осталась в списке обрабатываемых до записи в БД и записывается следующим flush
+        self.assertEqual(len(client.lists[cache.make_key(PROCESSING_KEY)]), 2)
+        UnsubscribeBuffer.add(9, "user3@example.com")
+        out = StringIO()
+        call_command("flush_unsubscribes", stdout=out)
+        self.assertIn("3", out.getvalue())
+        emails = set(Suppression.objects.values_list("email", flat=True))
+        self.assertEqual(emails, {"user1@example.com", "user2@example.com", "user3@example.com"})
+        self.assertFalse(client.lists[cache.make_key(PROCESSING_KEY)])
+
+
+class RelayPoolTestCase(TestCase):
+    """Тесты отправки через группу SMTP серверов: распределение по весам, переход на другой сервер."""
+
+    def setUp(self):
+        self.addCleanup(CircuitBreaker._breakers.clear)
+        self.sinks = [SMTPSink().start() for _ in range(2)]
+        for sink in self.sinks:
+            self.addCleanup(sink.stop)
+        message = Message.objects.create(subject="Тема", body="Текст")
+        self.mailing = Mailing.objects.create(message=message)
+        self.mailing.recipients.set(Recipient.objects.create(email=f"user{number}@ex.com") for number in range(40))
+
+    def use_sinks(self, **options) -> None:
+        sink_context = use_sink(*self.sinks, **options)
+        sink_context.__enter__()
+        self.addCleanup(sink_context.__exit__, None, None, None)
+
+    def test_weighted(self):
+        self.use_sinks(weights=[3, 1], balancing="weighted")
+        pool = get_connection_pool()
+        for number in range(8):
+            pool.send(FROM_EMAIL, [f"user{number}@ex.com"], MESSAGE)
+        self.assertEqual([sink.stats.messages for sink in self.sinks], [6, 2])
+        self.assertEqual([stats["sent"] for stats in pool.relay_stats().values()], [6, 2])
+
+    def test_least_outstanding(self):
+        relays = [Relay(RelayConfig("a", 25, weight=2), pool=None), Relay(RelayConfig("b", 25), pool=None)]
+        balancer = RelayBalancer(relays, "least_outstanding")
+        chosen = [balancer.choose().name for _ in range(3)]
+        self.assertEqual(chosen, ["a:25", "b:25", "a:25"])
+        balancer.release(relays[0])
+        balancer.release(relays[0])
+        self.assertEqual(balancer.choose().name, "a:25")
+
+    def test_no_failover_after_data(self):
+        for sink in self.sinks:
+            sink.drop = 1.0  # SMTP серверы обрывают соединение после текста письма
+        self.use_sinks()
+        with self.assertRaises(SMTPDataDisconnected):
+            get_connection_pool().send(FROM_EMAIL, ["user@ex.com"], MESSAGE)
+        self.assertEqual(sum(sink.stats.drops for sink in self.sinks), 1)  # письмо не передано другому серверу
+
+    def test_failover(self):
+        self.sinks[0].stop()  # первый SMTP сервер недоступен
+        self.use_sinks()
+        for engine in MailingService.ENGINES:
+            with self.subTest(engine=engine):
+                self.sinks[1].reset_stats()
+                report = MailingService.send_messages(
+                    recipients=MailingService.get_recipients(self.mailing),
+                    message=self.mailing.message,
+                    mailing=self.mailing,
+                    engine=engine,
+                )
+                self.assertEqual((report.sent, report.failed), (40, 0))
+                self.assertEqual(self.sinks[1].stats.messages, 40)
+                down, up = report.relays.values()
+                self.assertGreater(down["errors"], 0)
+                self.assertEqual((down["sent"], up["sent"]), (0, 40))
+
+
+class CircuitBreakerTestCase(SimpleTestCase):
+    """Тесты автоматического выключателя SMTP сервера: размыкание, пробные отправки, восстановление."""
+
+    def setUp(self):
+        self.breaker = CircuitBreaker("relay", error_rate=0.5, window=4, min_calls=4, open_time=0.05, probes=2)
+
+    def record(self, *codes) -> None:
+        for code in codes:
+            status = "success" if code == 250 else "fail"
+            self.breaker.start()
+            self.breaker.record([DeliveryResult("user@example.com", status, "", code=None if code == 250 else code)])
+
+    def test_opens_on_relay_errors(self):
+        self.record(250, 550, 550, 550)  # отказы получателям не размыкают выключатель
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.record(None, 421)
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertGreater(self.breaker.wait_time(), 0)
+
+    def test_half_open_probes(self):
+        self.record(None, None, None, None)
+        time.sleep(0.05)
+        self.assertEqual(self.breaker.wait_time(), 0)
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.record(250)
+        self.breaker.start()
+        self.assertGreater(self.breaker.wait_time(), 0)  # все пробные отправки начаты
+        self.record(None)
+        self.assertEqual((self.breaker.state, self.breaker.opened), (OPEN, 2))
+        time.sleep(0.05)
+        self.breaker.wait_time()
+        self.record(250, 250)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+
+class FakeClock:
+    """Часы для корзины токенов и периодических проверок: время идет только при ожидании(sleep) и вызове advance."""
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.slept.append(seconds)
+        self.advance(seconds)
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class RateLimiterTestCase(SimpleTestCase):
+    """Тесты ограничителя скорости: пополнение корзины токенов, ожидание токена, адаптация скорости."""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = patch("client_connect.rate_limit.time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_refill(self):
+        bucket = TokenBucket("relay", rate=4, capacity=2)
+        self.assertEqual((bucket.take(), bucket.take()), (0, 0))  # всплеск до capacity
+        self.assertEqual(bucket.take(), 0.25)
+        self.clock.advance(0.125)
+        self.assertEqual(bucket.take(), 0.125)  # накоплено полтокена
+        self.clock.advance(0.125)
+        self.assertEqual(bucket.take(), 0)
+        self.clock.advance(60)  # токенов не больше capacity
+        self.assertEqual((bucket.take(), bucket.take()), (0, 0))
+        self.assertGreater(bucket.take(), 0)
+
+    def test_acquire_blocks(self):
+        limiter = RateLimiter([TokenBucket("relay", rate=10, capacity=1), TokenBucket("mailing", rate=4, capacity=1)])
+        for _ in range(3):
+            limiter.acquire()
+        # первое письмо без ожидания, дальше скорость задает самая медленная корзина: 4 письма в секунду
+        self.assertAlmostEqual(sum(self.clock.slept), 0.5)
+        self.assertAlmostEqual(self.clock.now - 1000.0, 0.5)
+
+    def test_adaptive_rate(self):
+        bucket = TokenBucket("relay", rate=10)
+        limiter = RateLimiter([bucket])
+        with patch.multiple(settings, MAILING_RATE_BACKOFF=0.5, MAILING_RATE_MIN=3):
+            limiter.record(421)
+            self.assertEqual(bucket.rate(), 5)
+            limiter.record(451)
+            self.assertEqual(bucket.rate(), 3)  # не ниже MAILING_RATE_MIN
+            limiter.record(550)  # отказ получателю скорость не снижает
+            self.assertAlmostEqual(bucket.rate(), 3.1)
+            for _ in range(100):
+                limiter.record(None)
+        self.assertEqual(bucket.rate(), 10)  # не выше настроенной
+
+
+class DomainLanesTestCase(SimpleTestCase):
+    """Тесты очередей доменов: обслуживание по кругу, ограничения доменов, чтение вперед при ожидании доменов."""
+
+    def setUp(self):
+        self.addCleanup(RateLimiter._local_buckets.clear)
+        self.clock = FakeClock()
+        patcher = patch("client_connect.rate_limit.time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_lanes(self, rows: dict, **options) -> DomainLanes:
+        lanes = DomainLanes(**{"concurrency": 0, "rate": 0, "limits": {}, **options})
+        for domain, count in rows.items():
+            for number in range(count):
+                lanes.add({"id": lanes.buffered + 1, "email": f"user{number}@{domain}"})
+        return lanes
+
+    def domains(self, lanes: DomainLanes, count: int) -> list:
+        domains = []
+        for _ in range(count):
+            lane, _, _ = lanes.next_batch()
+            domains.append(lane.domain)
+            lanes.release(lane, [])
+        return domains
+
+    def test_round_robin(self):
+        lanes = self.make_lanes({"gmail.com": 4, "mail.ru": 2, "ya.ru": 1})
+        # крупный домен не занимает отправки подряд, пока у других доменов есть получатели
+        self.assertEqual(
+            self.domains(lanes, 7), ["gmail.com", "mail.ru", "ya.ru", "gmail.com", "mail.ru", "gmail.com", "gmail.com"]
+        )
+        self.assertEqual((lanes.buffered, lanes.next_batch()), (0, (None, [], None)))
+
+    def test_concurrency(self):
+        lanes = self.make_lanes({"gmail.com": 3, "mail.ru": 1}, limits={"gmail.com": (1, 0)})
+        gmail, _, _ = lanes.next_batch()
+        self.assertEqual(lanes.next_batch()[0].domain, "mail.ru")  # gmail.com занят своей отправкой
+        self.assertEqual(lanes.next_batch(), (None, [], None))  # ждать завершения отправок
+        lanes.release(gmail, [])
+        self.assertEqual(lanes.next_batch()[0], gmail)
+
+    def test_rate(self):
+        lanes = self.make_lanes({"gmail.com": 3, "mail.ru": 2}, limits={"gmail.com": (0, 2)})
+        self.assertEqual(self.domains(lanes, 4), ["gmail.com", "mail.ru", "gmail.com", "mail.ru"])
+        self.assertEqual(lanes.next_batch(), (None, [], 0.5))  # корзина gmail.com пуста, других доменов нет
+        self.clock.advance(0.5)
+        self.assertEqual(lanes.next_batch()[0].domain, "gmail.com")
+
+    def test_read_ahead(self):
+        lanes = self.make_lanes({"gmail.com": 4}, limits={"gmail.com": (1, 0)}, window=4, max_buffered=10)
+        lanes.next_batch()
+        self.assertEqual(lanes.next_batch(), (None, [], None))
+        self.assertTrue(lanes.read_ahead())  # окно занял один ожидающий домен: читать следующих получателей
+        self.assertEqual(lanes.limit, 8)
+        self.assertTrue(lanes.read_ahead())
+        self.assertEqual(lanes.limit, 10)
+        self.assertFalse(lanes.read_ahead())  # не больше max_buffered
+        lanes.add({"id": 5, "email": "user@mail.ru"})
+        self.assertEqual(lanes.next_batch()[0].domain, "mail.ru")
+        self.assertEqual(lanes.limit, 4)  # в очередях меньше окна
+
+
+class MailingLeaseTestCase(TransactionTestCase):
+    """Тесты аренды рассылки: одна аренда на рассылку, продление, перехват истекшей аренды."""
+
+    def setUp(self):
+        self.mailing = Mailing.objects.create(message=Message.objects.create(subject="Тема", body="Текст"))
+
+    def test_single_owner(self):
+        lease = acquire_lease(self.mailing.pk, "node-1")
+        self.assertFalse(lease.taken_over)
+        self.assertIsNone(acquire_lease(self.mailing.pk, "node-2"))
+        self.assertIsNotNone(acquire_lease(self.mailing.pk, "node-1"))
+        release_lease(lease)
+        self.assertFalse(acquire_lease(self.mailing.pk, "node-2").taken_over)
+
+    def test_take_over_expired(self):
+        lease = acquire_lease(self.mailing.pk, "node-1")
+        Mailing.objects.filter(pk=self.mailing.pk).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertTrue(acquire_lease(self.mailing.pk, "node-2").taken_over)
+        self.assertFalse(renew_lease(lease))
+
+    def test_heartbeat_lost(self):
+        lease = acquire_lease(self.mailing.pk, "node-1", ttl=0.3)
+        with LeaseHeartbeat(lease) as heartbeat:
+            Mailing.objects.filter(pk=self.mailing.pk).update(lease_owner="node-2")
+            time.sleep(0.3)
+            self.assertTrue(heartbeat.lost)
+            self.assertTrue(CancellationToken(self.mailing.pk).is_cancelled())
+        self.assertFalse(CancellationToken(self.mailing.pk).is_cancelled())
+
+    def test_mailing_lease(self):
+        with mailing_lease(self.mailing.pk, "node-1"):
+            with self.assertRaises(MailingLeaseError):
+                with mailing_lease(self.mailing.pk, "node-2"):
+                    pass
+        self.assertEqual(Mailing.objects.get(pk=self.mailing.pk).lease_owner, "")
+
+
+class ThreadContext:
+    """
+    Контекст multiprocessing для тестов: части рассылки отправляются по очереди в потоке, с тестовой БД процесса
+    (SQLite в памяти блокирует таблицы при одновременной записи из нескольких соединений).
+    """
+
+    Manager = staticmethod(multiprocessing.Manager)
+
+    @staticmethod
+    def Pool(processes: int, **options) -> multiprocessing.pool.ThreadPool:
+        return multiprocessing.pool.ThreadPool(1, **options)
+
+
+class ShardingTestCase(TransactionTestCase):
+    """Тесты отправки рассылки частями в нескольких процессах: деление получателей, остановка всех частей."""
+
+    def setUp(self):
+        message = Message.objects.create(subject="Тема", body="Текст")
+        self.mailing = Mailing.objects.create(message=message)
+        self.mailing.recipients.set(Recipient.objects.create(email=f"user{number}@ex.com") for number in range(10))
+
+    def test_build_shards(self):
+        recipient_ids = set(self.mailing.recipients.values_list("id", flat=True))
+        for processes, parts in ((3, 3), (20, 10)):
+            shards = build_shards([self.mailing], processes, shard_by="recipients")
+            self.assertEqual(len(shards), parts)
+            covered = []
+            for shard in shards:
+                recipients = self.mailing.recipients.all()
+                if shard.id_from is not None:
+                    recipients = recipients.filter(id__gte=shard.id_from)
+                if shard.id_to is not None:
+                    recipients = recipients.filter(id__lt=shard.id_to)
+                covered += recipients.values_list("id", flat=True)
+            self.assertEqual(sorted(covered), sorted(recipient_ids))  # части не пересекаются и покрывают всех
+        other = Mailing.objects.create(message=self.mailing.message)
+        self.assertEqual(len(build_shards([self.mailing, other], 4, shard_by="mailing")), 2)
+        with self.assertRaises(ValueError):
+            build_shards([self.mailing], 2, shard_by="domain")
+
+    def test_send_parallel(self):
+        sink = SMTPSink().start()
+        self.addCleanup(sink.stop)
+        with use_sink(sink), patch("multiprocessing.get_context", return_value=ThreadContext):
+            call_command(
+                "send_mailing", self.mailing.pk, "--processes", "3", "--shard-by", "recipients", stdout=StringIO()
+            )
+        self.assertEqual(sink.stats.recipients, 10)
+        self.assertEqual(SendingAttempt.objects.filter(mailing=self.mailing, status="success").count(), 10)
+        self.assertEqual(self.mailing.sending_attempts.values("recipient").distinct().count(), 10)
+
+    def test_send_all_sendable(self):
+        for status in ("disable", "done", "scheduled"):  # без первичного ключа такие рассылки не отправляются
+            other = Mailing.objects.create(message=self.mailing.message, status=status)
+            other.recipients.set(self.mailing.recipients.all())
+        sink = SMTPSink().start()
+        self.addCleanup(sink.stop)
+        for options in ((), ("--processes", "2")):
+            with self.subTest(options=options):
+                sink.reset_stats()
+                with use_sink(sink), patch("multiprocessing.get_context", return_value=ThreadContext):
+                    call_command("send_mailing", *options, stdout=StringIO())
+                self.assertEqual(sink.stats.recipients, 10)
+                self.assertEqual(set(SendingAttempt.objects.values_list("mailing", flat=True)), {self.mailing.pk})
+
+    def test_shared_cancel(self):
+        shared = {}  # словарь multiprocessing.Manager, общий для родителя и дочерних процессов
+        share_cancels(shared)
+        self.addCleanup(share_cancels, None)
+        cancel_local(self.mailing.pk)  # родитель потерял аренду рассылки
+        self.assertEqual(shared, {self.mailing.pk: True})
+        with patch("client_connect.cancellation._local_cancels", set()):  # дочерний процесс видит только общий
+            self.assertTrue(CancellationToken(self.mailing.pk).is_cancelled())
+        clear_local_cancel(self.mailing.pk)
+        self.assertEqual(shared, {})
+        self.assertFalse(CancellationToken(self.mailing.pk).is_cancelled())
+
+
+class MailingCancelTestCase(TestCase):
+    """Тесты отключения рассылки с флагом отмены в кеше(CACHE_ENABLED): отключение, снятие флага при запуске."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        patcher = patch.object(settings, "CACHE_ENABLED", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = CustomUser.objects.create_user(username="owner", email="owner@example.com", password="password")
+        message = Message.objects.create(subject="Тема", body="Текст", owner=self.user)
+        self.mailing = Mailing.objects.create(message=message, owner=self.user)
+
+    def test_cancel_mailing(self):
+        job = MailingJobService.enqueue(self.mailing)
+        MailingService.cancel_mailing(self.mailing)
+        job.refresh_from_db()
+        self.assertEqual((self.mailing.status, job.status), ("disable", "failed"))
+        Mailing.objects.filter(pk=self.mailing.pk).update(status="launched")
+        self.assertTrue(CancellationToken(self.mailing.pk).is_cancelled())  # флаг в кеше, БД не запрашивается
+
+    def test_begin_run(self):
+        MailingService.cancel_mailing(self.mailing)
+        MailingService.begin_run(self.mailing, resume=True)
+        self.assertTrue(CancellationToken(self.mailing.pk).is_cancelled())  # рассылка все еще отключена
+        self.mailing.status = "created"  # рассылка снова включена
+        self.mailing.save(update_fields=["status"])
+        MailingService.begin_run(self.mailing, resume=True)
+        self.assertFalse(CancellationToken(self.mailing.pk).is_cancelled())
+
+    def test_disable_view(self):
+        url = reverse("client_connect:mailing_disable", args=[self.mailing.pk])
+        self.assertEqual(self.client.post(url).status_code, 302)  # вход
+        self.assertFalse(CancellationToken(self.mailing.pk).is_cancelled())
+        self.user.user_permissions.add(Permission.objects.get(codename="can_disable_send"))
+        self.client.force_login(self.user)
+        self.assertRedirects(
+            self.client.post(url), reverse("client_connect:mailings_list"), fetch_redirect_response=False
+        )
+        self.assertEqual(Mailing.objects.get(pk=self.mailing.pk).status, "disable")
+        self.assertTrue(CancellationToken(self.mailing.pk).is_cancelled())
+
+    def test_token_checks_cache_periodically(self):
+        token = CancellationToken(self.mailing.pk, check_every=3, check_interval=3600)
+        self.assertFalse(token.is_cancelled())
+        request_cancel(self.mailing.pk)
+        self.assertEqual([token.is_cancelled() for _ in range(3)], [False, False, True])  # раз в check_every писем
+        clear_cancel(self.mailing.pk)
+        self.assertTrue(token.is_cancelled())  # отмена запоминается
+
+    def test_token_checks_status_without_flag(self):
+        clock = FakeClock()
+        token = CancellationToken(self.mailing.pk, check_every=1, check_interval=3600, db_check_interval=10)
+        with patch("client_connect.cancellation.time", clock):
+            self.assertFalse(token.is_cancelled())
+            Mailing.objects.filter(pk=self.mailing.pk).update(status="disable")  # в обход update_status
+            self.assertFalse(token.is_cancelled())  # статус в БД проверяется реже флага
+            clock.advance(10)
+            self.assertTrue(token.is_cancelled())
+
+
+class MailingJobTestCase(TestCase):
+    """Тесты очереди заданий рассылки: постановка, выдача исполнителям, выполнение, брошенные задания."""
+
+    def setUp(self):
+        self.mailing = Mailing.objects.create(message=Message.objects.create(subject="Тема", body="Текст"))
+
+    def test_enqueue(self):
+        job = MailingJobService.enqueue(self.mailing, engine="async")
+        self.assertEqual(MailingJobService.enqueue(self.mailing), job)  # задание уже ожидает исполнителя
+        MailingJobService.claim("node-1")
+        self.assertEqual(MailingJobService.enqueue(self.mailing), job)  # и выполняется
+        MailingJob.objects.filter(pk=job.pk).update(status="done")
+        self.assertNotEqual(MailingJobService.enqueue(self.mailing), job)
+        self.assertEqual(MailingJob.objects.filter(status="queued").count(), 1)
+
+    def test_claim(self):
+        other = Mailing.objects.create(message=self.mailing.message)
+        first = MailingJobService.enqueue(self.mailing)
+        second = MailingJobService.enqueue(other)
+        acquire_lease(other.pk, "cli")  # рассылку отправляет команда send_mailing
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(MailingJobService.claim("node-1"), first)
+        if connection.features.has_select_for_update_skip_locked:  # PostgreSQL
+            self.assertTrue(
+                any("FOR UPDATE OF" in query["sql"] and "SKIP LOCKED" in query["sql"] for query in queries)
+            )
+        self.assertIsNone(MailingJobService.claim("node-2"))  # одно задание не выдается двум исполнителям
+        release_lease(Lease(other.pk, "cli", 60, timezone.now()))
+        job = MailingJobService.claim("node-2")
+        self.assertEqual((job, job.status, job.worker, job.attempts), (second, "running", "node-2", 1))
+        self.assertIsNone(MailingJobService.claim("node-3"))
+
+    def test_execute_failure(self):
+        MailingJobService.enqueue(self.mailing)
+        job = MailingJobService.claim("node-1")
+        with patch.object(MailingService, "run_mailing", side_effect=RuntimeError("SMTP недоступен")):
+            self.assertIsNone(MailingJobService.execute(job))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), ("failed", "SMTP недоступен"))
+        self.assertIsNotNone(job.finished_at)
+        # задание забрал другой исполнитель: результат устаревшего исполнителя не записывается
+        MailingJobService.enqueue(self.mailing)
+        stale = MailingJobService.claim("node-1")
+        MailingJob.objects.filter(pk=stale.pk).update(worker="node-2", attempts=2)
+        with patch.object(MailingService, "run_mailing", side_effect=RuntimeError("SMTP недоступен")):
+            MailingJobService.execute(stale)
+        stale.refresh_from_db()
+        self.assertEqual((stale.status, stale.worker), ("running", "node-2"))
+
+    def test_abandoned_job(self):
+        MailingJobService.enqueue(self.mailing)
+        job = MailingJobService.claim("node-1")
+        self.assertIsNone(MailingJobService.claim("node-2"))  # аренда рассылки у node-1
+        release_lease(Lease(self.mailing.pk, "node-1", 60, timezone.now()))
+        self.assertIsNone(MailingJobService.claim("node-2"))  # аренды нет, но задание начато недавно
+        MailingJob.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(minutes=5))
+        job = MailingJobService.claim("node-2")
+        self.assertEqual((job.worker, job.attempts, job.resume), ("node-2", 2, True))
+        self.assertEqual(MailingJobService.enqueue(self.mailing), job)
+
+    def test_interrupted_job(self):
+        MailingJobService.enqueue(self.mailing)
+        job = MailingJobService.claim("node-1")
+        with patch.object(MailingService, "send_messages", side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                MailingJobService.execute(job)
+        job = MailingJobService.claim("node-2")  # исполнитель остановлен: задание снова в очереди
+        self.assertEqual((job.worker, job.attempts, job.resume), ("node-2", 2, True))
+
+
+class DeliveryRetryTestCase(TestCase):
+    """Тесты повторной отправки после временных ошибок: расписание, отправка под арендой, страница повторов."""
+
+    def setUp(self):
+        self.sink = SMTPSink().start()
+        self.addCleanup(self.sink.stop)
+        sink_context = use_sink(self.sink)
+        sink_context.__enter__()
+        self.addCleanup(sink_context.__exit__, None, None, None)
+        patcher = patch.multiple(
+            settings, MAILING_RETRY_MAX_ATTEMPTS=3, MAILING_RETRY_BASE_DELAY=60, MAILING_RETRY_MAX_DELAY=200
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = CustomUser.objects.create_user(username="owner", email="owner@example.com", password="password")
+        message = Message.objects.create(subject="Тема", body="Текст", owner=self.user)
+        self.mailing = Mailing.objects.create(message=message, owner=self.user)
+        self.user1 = Recipient.objects.create(email="user1@ex.com")
+        self.temp = Recipient.objects.create(email="temp@ex.com")
+
+    def test_failed_count(self):
+        def failed(recipient: Recipient) -> DeliveryResult:
+            return DeliveryResult(recipient.email, "fail", "451", recipient.pk, code=451)
+
+        save_attempts([failed(self.temp), failed(self.user1)], self.mailing)
+        save_attempts([failed(self.temp)], self.mailing)  # повторная неудача того же получателя
+        save_attempts([DeliveryResult("temp@ex.com", "success", "250", self.temp.pk)], self.mailing)
+        save_attempts([DeliveryResult("gone@ex.com", "fail", "550", code=550)], self.mailing)  # получатель удален
+        mailing = Mailing.objects.get(pk=self.mailing.pk)
+        self.assertEqual((mailing.sent_count, mailing.failed_count), (1, 2))
+        Mailing.objects.filter(pk=mailing.pk).update(
+            sent_count=0, failed_count=0, lease_owner="node-1", run_started_at=timezone.now() - timedelta(minutes=1)
+        )
+        MailingService.recount_counters(Mailing.objects.filter(pk=mailing.pk))
+        mailing.refresh_from_db()
+        self.assertEqual((mailing.sent_count, mailing.failed_count), (1, 2))
+        progress = run_progress(mailing.pk)
+        self.assertEqual((progress["sent"], progress["failed"]), (1, 2))
+        Mailing.objects.filter(pk=mailing.pk).update(failed_count=0)
+        save_attempts([DeliveryResult("user1@ex.com", "success", "250", self.user1.pk)], self.mailing)
+        mailing.refresh_from_db()
+        self.assertEqual((mailing.sent_count, mailing.failed_count), (2, 0))  # счетчик не уходит ниже нуля
+
+    def test_retry_delay(self):
+        with patch("client_connect.retries.random.uniform", side_effect=lambda low, high: high):
+            self.assertEqual([retry_delay(attempts) for attempts in range(1, 5)], [60, 120, 200, 200])
+        for attempts in range(1, 5):
+            self.assertTrue(30 <= retry_delay(attempts) <= 200)  # разброс от половины задержки
+
+    def test_schedule_retries(self):
+        now = timezone.now()
+        failed = DeliveryResult("temp@ex.com", "fail", "451", recipient_id=self.temp.pk, code=451)
+        with patch("client_connect.retries.random.uniform", side_effect=lambda low, high: high):
+            for attempts, delay in ((1, 60), (2, 120)):
+                schedule_retries([failed], self.mailing, now=now)
+                retry = DeliveryRetry.objects.get(recipient=self.temp)
+                self.assertEqual((retry.attempts, retry.next_attempt_at), (attempts, now + timedelta(seconds=delay)))
+            schedule_retries([failed], self.mailing, now=now)
+        self.assertFalse(DeliveryRetry.objects.exists())  # MAILING_RETRY_MAX_ATTEMPTS попыток исчерпано
+        schedule_retries([failed], self.mailing, now=now)
+        schedule_retries([DeliveryResult("temp@ex.com", "fail", "550", self.temp.pk, code=550)], self.mailing)
+        self.assertFalse(DeliveryRetry.objects.exists())  # постоянная ошибка отменяет повтор
+        schedule_retries([failed], self.mailing, now=now)
+        schedule_retries([DeliveryResult("temp@ex.com", "success", "250", self.temp.pk)], self.mailing)
+        self.assertFalse(DeliveryRetry.objects.exists())
+
+    def test_run_due(self):
+        now = timezone.now()
+        for recipient in (self.user1, self.temp):
+            DeliveryRetry.objects.create(mailing=self.mailing, recipient=recipient, next_attempt_at=now)
+        acquire_lease(self.mailing.pk, "node-1")  # рассылку отправляет другой исполнитель
+        self.assertEqual(DeliveryRetryService.run_due(owner="node-2").total, 0)
+        self.assertEqual(self.sink.stats.recipients, 0)
+        release_lease(Lease(self.mailing.pk, "node-1", 60, now))
+        report = DeliveryRetryService.run_due(owner="node-2")
+        self.assertEqual((report.sent, report.failed), (1, 1))
+        retry = DeliveryRetry.objects.get()
+        self.assertEqual((retry.recipient, retry.attempts), (self.temp, 2))
+        self.assertGreater(retry.next_attempt_at, timezone.now())
+        self.mailing.refresh_from_db()
+        self.assertEqual(self.mailing.lease_owner, "")  # аренда освобождена после отправки повторов
+        # аренду забрали между выборкой и отправкой: повторы возвращаются в расписание без отправки
+        DeliveryRetry.objects.update(next_attempt_at=now)
+        with patch("client_connect.services.acquire_lease", return_value=None):
+            self.assertEqual(DeliveryRetryService.run_due(owner="node-2").total, 0)
+        self.assertLessEqual(DeliveryRetry.objects.get().next_attempt_at, timezone.now())
+
+    def test_retries_view(self):
+        url = reverse("client_connect:mailing_retries", args=[self.mailing.pk])
+        self.assertEqual(self.client.get(url).status_code, 403)  # без входа
+        now = timezone.now()
+        DeliveryRetry.objects.create(
+            mailing=self.mailing, recipient=self.temp, next_attempt_at=now + timedelta(hours=1)
+        )
+        DeliveryRetry.objects.create(mailing=self.mailing, recipient=self.user1, next_attempt_at=now)
+        self.client.force_login(self.user)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([retry.recipient for retry in response.context["retries"]], [self.user1, self.temp])
+        self.assertEqual(response.context["max_attempts"], 3)
+        self.assertContains(response, "temp@ex.com")
+
+
+class MailingSchedulerTestCase(TestCase):
+    """Тесты планировщика рассылок: время следующего повтора, очередь запусков, постановка в очередь заданий."""
+
+    def setUp(self):
+        self.now = timezone.now().replace(microsecond=0)
+        self.message = Message.objects.create(subject="Тема", body="Текст")
+
+    def schedule(self, start_time, repeat: str = "") -> Mailing:
+        return Mailing.objects.create(message=self.message, status="scheduled", start_time=start_time, repeat=repeat)
+
+    def test_next_run_time(self):
+        start = self.now.replace(hour=10, minute=0, second=0)
+        hour, day = timedelta(hours=1), timedelta(days=1)
+        self.assertEqual(next_run_time(start, "hourly", start - hour), start)  # время еще не наступило
+        self.assertEqual(next_run_time(start, "hourly", start), start + hour)
+        self.assertEqual(next_run_time(start, "hourly", start + 2.5 * hour), start + 3 * hour)
+        self.assertEqual(
+            next_run_time(start, "daily", start + 3 * day + hour), start + 4 * day
+        )  # пропуски не догоняются
+        self.assertEqual(next_run_time(start, "weekly", start + day), start + 7 * day)
+
+    def test_pop_due(self):
+        past = self.schedule(self.now - timedelta(minutes=1))
+        soon = self.schedule(self.now + timedelta(seconds=30))
+        self.schedule(self.now + timedelta(hours=1))  # позже следующего обновления
+        Mailing.objects.create(message=self.message, start_time=self.now - timedelta(minutes=1))  # не запланирована
+        scheduler = MailingScheduler(poll_interval=60)
+        self.assertTrue(scheduler.needs_refresh(self.now))
+        scheduler.refresh(self.now)
+        self.assertEqual(scheduler.pop_due(self.now), [past.pk])
+        self.assertEqual(scheduler.wait_time(self.now), 30)  # до ближайшего запуска
+        self.assertEqual(scheduler.pop_due(self.now + timedelta(seconds=30)), [soon.pk])
+        self.assertEqual(scheduler.wait_time(self.now + timedelta(seconds=30)), 30)  # до обновления расписания
+        self.assertFalse(scheduler.needs_refresh(self.now + timedelta(seconds=59)))
+        self.assertTrue(scheduler.needs_refresh(self.now + timedelta(seconds=60)))
+
+    def test_run_scheduler(self):
+        once = self.schedule(self.now - timedelta(minutes=1))
+        daily = self.schedule(self.now - timedelta(days=2, minutes=1), repeat="daily")
+        future = self.schedule(self.now + timedelta(hours=1))
+        call_command("run_scheduler", "--once", stdout=StringIO())
+        call_command("run_scheduler", "--once", stdout=StringIO())  # наступившие рассылки не ставятся дважды
+        self.assertEqual(
+            sorted(MailingJob.objects.values_list("mailing_id", "status")), [(once.pk, "queued"), (daily.pk, "queued")]
+        )
+        once.refresh_from_db()
+        daily.refresh_from_db()
+        future.refresh_from_db()
+        self.assertEqual(once.status, "created")
+        self.assertEqual((daily.status, daily.start_time), ("scheduled", self.now + timedelta(days=1, minutes=-1)))
+        self.assertEqual(future.status, "scheduled")
+
+
+class MailingProgressTestCase(TestCase):
+    """Тесты счетчиков прогресса рассылки и потока событий Server-Sent Events."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username="owner", email="owner@example.com", password="password")
+        message = Message.objects.create(subject="Тема", body="Текст", owner=self.user)
+        self.mailing = Mailing.objects.create(message=message, owner=self.user)
+        self.url = reverse("client_connect:mailing_progress", args=[self.mailing.pk])
+
+    def record(self, sent: int, failed: int) -> None:
+        results = [DeliveryResult(f"user{number}@example.com", "success", "OK") for number in range(sent)]
+        results += [DeliveryResult(f"bad{number}@example.com", "fail", "550") for number in range(failed)]
+        record_progress(self.mailing.pk, results)
+
+    def test_counters(self):
+        self.assertIsNone(get_progress(self.mailing.pk))
+        start_progress(self.mailing.pk, 10)
+        self.record(3, 1)
+        progress = get_progress(self.mailing.pk)
+        self.assertEqual((progress["sent"], progress["failed"], progress["remaining"]), (3, 1, 6))
+        self.assertFalse(progress["finished"])
+        finish_progress(self.mailing.pk)
+        self.record(5, 0)  # повторная отправка после завершения не учитывается
+        progress = get_progress(self.mailing.pk)
+        self.assertEqual((progress["sent"], progress["finished"]), (3, True))
+
+    def test_stream(self):
+        start_progress(self.mailing.pk, 10)
+        self.record(4, 2)
+        finish_progress(self.mailing.pk)
+        self.client.force_login(self.user)
+        response = self.client.get(self.url)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        content = b"".join(response.streaming_content).decode()
+        self.assertIn("event: progress", content)
+        self.assertIn('"sent": 4, "failed": 2, "total": 10, "remaining": 4, "finished": true', content)
+
+    def test_progress_without_shared_cache(self):
+        Mailing.objects.filter(pk=self.mailing.pk).update(  # счетчики в памяти другого процесса(run_mail_worker)
+            total_count=10,
+            sent_count=2,
+            failed_count=1,
+            run_started_at=timezone.now() - timedelta(minutes=1),
+            lease_owner="worker-1",
+        )
+        with patch.object(settings, "CACHE_ENABLED", False), CaptureQueriesContext(connection) as queries:
+            event, _, finished = progress_event(self.mailing.pk)
+        self.assertEqual(len(queries), 1)  # одно чтение строки рассылки, без журнала доставки
+        self.assertIn('"sent": 2, "failed": 1, "total": 10, "remaining": 7, "finished": false', event)
+        self.assertFalse(finished)
+
+    async def test_async_stream_not_sending(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(self.url)
+        content = "".join([chunk.decode() async for chunk in response.streaming_content])
+        self.assertIn('"status": "created", "waiting": false, "finished": true', content)
+
+    def test_detail_opens_stream_while_sending(self):
+        url = reverse("client_connect:mailing_detail", args=[self.mailing.pk])
+        self.client.force_login(self.user)
+        self.assertNotContains(self.client.get(url), "EventSource")  # рассылка не отправляется
+        job = MailingJobService.enqueue(self.mailing)
+        self.assertContains(self.client.get(url), "EventSource")  # задание ждет исполнителя
+        job.delete()
+        Mailing.objects.filter(pk=self.mailing.pk).update(status="launched")
+        self.assertContains(self.client.get(url), "EventSource")
+
+    def test_login_required(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
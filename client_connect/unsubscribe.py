@@ -0,0 +1,142 @@
+import json
+from collections import defaultdict
+from datetime import timedelta
+from typing import Callable, Optional
+
+import redis
+from django.core import signing
+from django.core.cache import cache
+from django.urls import reverse
+
+from client_connect.cache_client import redis_client
+from client_connect.suppression import suppress
+from config import settings
+
+UNSUBSCRIBE_SALT = "client_connect.unsubscribe"
+BUFFER_KEY = "mailing:unsubscribe:buffer"
+PROCESSING_KEY = "mailing:unsubscribe:processing"
+FLUSH_LOCK_KEY = "mailing:unsubscribe:flush"
+FLUSH_LOCK_TTL = 300  # блокировка процесса, упавшего во время записи, снимается через 5 минут
+
+
+def make_token(mailing_pk: int, email: str) -> str:
+    """
+    Подписанный токен отписки получателя рассылки(HMAC с SECRET_KEY и временем подписи): ID рассылки и адрес
+    проверяются по подписи, без запроса к БД.
+    :param mailing_pk: ID рассылки.
+    :param email: Адрес получателя.
+    :return: Токен для адреса отписки.
+    """
+    return signing.TimestampSigner(salt=UNSUBSCRIBE_SALT).sign_object([mailing_pk, email])
+
+
+def read_token(token: str) -> tuple:
+    """
+    Проверяет подпись и срок действия токена отписки(MAILING_UNSUBSCRIBE_MAX_AGE_DAYS дней с отправки письма).
+    :param token: Токен из адреса отписки.
+    :return: (ID рассылки, адрес получателя)
+    :raise signing.SignatureExpired: Если срок действия токена истек.
+    :raise signing.BadSignature: Если токен подделан или поврежден.
+    """
+    max_age = timedelta(days=settings.MAILING_UNSUBSCRIBE_MAX_AGE_DAYS)
+    try:
+        mailing_pk, email = signing.TimestampSigner(salt=UNSUBSCRIBE_SALT).unsign_object(token, max_age=max_age)
+    except (TypeError, ValueError):
+        raise signing.BadSignature("Неверный токен отписки")
+    return int(mailing_pk), str(email)
+
+
+def unsubscribe_links(mailing_pk: int) -> Optional[Callable[[str], str]]:
+    """
+    Функция адреса отписки для получателей рассылки(заголовок List-Unsubscribe, подстановка {{ unsubscribe_url }}).
+    :param mailing_pk: ID рассылки.
+    :return: Функция адрес получателя -> адрес отписки, None - ссылки отключены(MAILING_UNSUBSCRIBE_BASE_URL пуст).
+    """
+    base_url = settings.MAILING_UNSUBSCRIBE_BASE_URL.rstrip("/")
+    if not base_url:
+        return None
+
+    def link(email: str) -> str:
+        return base_url + reverse("client_connect:unsubscribe", args=[make_token(mailing_pk, email)])
+
+    return link
+
+
+class UnsubscribeBuffer:
+    """
+    Буфер отписок с отложенной записью: отписка по ссылке не пишет в БД, а попадает в буфер,
+    буфер записывается в список исключений(Suppression) пачками - одна вставка на рассылку в пачке.
+    Буфер - список в Redis кеша Django(CACHE_ENABLED), общий для всех процессов веб-сервера и переживающий
+    их перезапуск.
+    Пачка записывается, когда в буфере MAILING_UNSUBSCRIBE_BATCH_SIZE отписок, остальное - исполнителем
+    run_mail_worker раз в MAILING_UNSUBSCRIBE_FLUSH_INTERVAL секунд или командой flush_unsubscribes.
+    Пачка атомарно переносится(LMOVE) из буфера в список обрабатываемых отписок и удаляется из него только после
+    записи в БД: отписки, которые не удалось записать(ошибка, падение процесса), записываются следующим flush.
+    Без CACHE_ENABLED буфера нет: отписка сразу записывается в список исключений, иначе отписки в памяти
+    процесса терялись бы при его перезапуске.
+    Методы:
+        add(mailing_pk: int, email: str) -> None:
+            Добавляет отписку в буфер, при заполнении буфера записывает пачки(без CACHE_ENABLED - сразу в БД).
+        flush() -> int:
+            Записывает все отписки из буфера в список исключений.
+    """
+
+    @classmethod
+    def add(cls, mailing_pk: int, email: str) -> None:
+        """
+        Добавляет отписку в буфер, при заполнении буфера записывает пачки.
+        Без CACHE_ENABLED отписка записывается в список исключений сразу.
+        :param mailing_pk: ID рассылки.
+        :param email: Адрес получателя.
+        """
+        if not settings.CACHE_ENABLED:
+            suppress([email], reason="unsubscribe", comment=f"Отписка от рассылки {mailing_pk}")
+            return
+        size = redis_client().rpush(cache.make_key(BUFFER_KEY), json.dumps([mailing_pk, email]))
+        if size >= settings.MAILING_UNSUBSCRIBE_BATCH_SIZE:
+            cls.flush()
+
+    @classmethod
+    def flush(cls) -> int:
+        """
+        Записывает все отписки из буфера в список исключений пачками по MAILING_UNSUBSCRIBE_BATCH_SIZE.
+        Сначала записываются отписки, оставшиеся в списке обрабатываемых после неудачного flush.
+        Одновременно записывает только один процесс(блокировка в Redis), остальные сразу возвращают 0.
+        :return: Количество записанных отписок.
+        """
+        if not settings.CACHE_ENABLED:
+            return 0
+        client = redis_client()
+        lock = client.lock(cache.make_key(FLUSH_LOCK_KEY), timeout=FLUSH_LOCK_TTL, blocking=False)
+        if not lock.acquire():
+            return 0
+        try:
+            flushed = 0
+            while entries := cls._claim(client, settings.MAILING_UNSUBSCRIBE_BATCH_SIZE):
+                emails = defaultdict(set)
+                for entry in entries:
+                    mailing_pk, email = json.loads(entry)
+                    emails[mailing_pk].add(email)
+                # повторная запись после сбоя безопасна: адреса, уже внесенные в список исключений, пропускаются
+                for mailing_pk, group in emails.items():
+                    suppress(group, reason="unsubscribe", comment=f"Отписка от рассылки {mailing_pk}")
+                client.delete(cache.make_key(PROCESSING_KEY))
+                flushed += len(entries)
+            return flushed
+        finally:
+            lock.release()
+
+    @staticmethod
+    def _claim(client: redis.Redis, count: int) -> list:
+        """
+        Переносит из буфера в список обрабатываемых до count отписок одной транзакцией(LMOVE) и возвращает
+        список обрабатываемых. Непустой список обрабатываемых остался от неудачного flush и возвращается как есть.
+        """
+        processing = cache.make_key(PROCESSING_KEY)
+        if not client.llen(processing):
+            pipeline = client.pipeline(transaction=True)
+            for _ in range(count):
+                pipeline.lmove(cache.make_key(BUFFER_KEY), processing, "LEFT", "RIGHT")
+            pipeline.execute()
+        entries = client.lrange(processing, 0, -1)
+        return [entry.decode() if isinstance(entry, bytes) else entry for entry in entries]
@@ -2,10 +2,11 @@ from django.urls import path
 
 from client_connect.apps import ClientConnectConfig
 
-from .views import (HomeViews, MailingCreateView, MailingDeleteView, MailingDetailView, MailingSendDisableView,
-                    MailingSendView, MailingsListView, MailingUpdateView, MessageCreateView, MessageDeleteView,
-                    MessageDetailView, MessagesListView, MessageUpdateView, RecipientCreateView, RecipientDeleteView,
-                    RecipientDetailView, RecipientsListViews, RecipientUpdateView, SendingAttemptsListView)
+from .views import (HomeViews, MailingCreateView, MailingDeleteView, MailingDetailView, MailingProgressView,
+                    MailingRetriesView, MailingSendDisableView, MailingSendView, MailingsListView, MailingUpdateView,
+                    MessageCreateView, MessageDeleteView, MessageDetailView, MessagesListView, MessageUpdateView,
+                    RecipientCreateView, RecipientDeleteView, RecipientDetailView, RecipientsListViews,
+                    RecipientUpdateView, SendingAttemptsListView, UnsubscribeView)
 
 app_name = ClientConnectConfig.name
 
@@ -31,6 +32,10 @@ urlpatterns = [
     path("mailing/<int:pk>/delete/", MailingDeleteView.as_view(), name="mailing_delete"),
     path("mailing/<int:pk>/send/", MailingSendView.as_view(), name="mailing_send"),
     path("mailing/<int:pk>/disable/", MailingSendDisableView.as_view(), name="mailing_disable"),
+    path("mailing/<int:pk>/retries/", MailingRetriesView.as_view(), name="mailing_retries"),
+    path("mailing/<int:pk>/progress/", MailingProgressView.as_view(), name="mailing_progress"),
     # адреса работы с рассылкой(SendingAttempt)
     path("sending_attempts/", SendingAttemptsListView.as_view(), name="sending_attempts_list"),
+    # отписка получателя по ссылке из письма
+    path("unsubscribe/<str:token>/", UnsubscribeView.as_view(), name="unsubscribe"),
 ]
@@ -1,18 +1,30 @@
 from typing import Optional, Type
 
+from asgiref.sync import sync_to_async
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
+from django.contrib.auth.views import redirect_to_login
+from django.core import signing
+from django.core.handlers.asgi import ASGIRequest
 from django.db import models
-from django.db.models import QuerySet
+from django.db.models import QuerySet, Sum
 from django.forms.forms import BaseForm
-from django.http import Http404, HttpRequest, HttpResponse, HttpResponseBase, HttpResponseForbidden
-from django.shortcuts import get_object_or_404, redirect
+from django.http import (Http404, HttpRequest, HttpResponse, HttpResponseBase, HttpResponseForbidden,
+                         StreamingHttpResponse)
+from django.middleware.csrf import CsrfViewMiddleware
+from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse_lazy
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import DetailView, ListView, TemplateView, View
 from django.views.generic.edit import CreateView, DeleteView, UpdateView
 
+from config import settings
+
 from .forms import MailingForm, MessageForm, RecipientForm
 from .models import Mailing, Message, Recipient, SendingAttempt
-from .services import AccessControlService, DecoratorsService, MailingService
+from .progress import aprogress_stream, progress_stream
+from .services import AccessControlService, DecoratorsService, MailingJobService, MailingService
+from .unsubscribe import UnsubscribeBuffer, read_token
 
 # определяем декоратор кеширования, если кеш включен накладывает декоратор, если нет, отдает обычный результат класса
 cache_decorator = DecoratorsService.get_cache_decorator()
@@ -308,6 +320,7 @@ class SendingAttemptsListView(BaseListView, ListView):
             Пользователь видит только свои рассылки
         get_context_data(self, **kwargs) -> dict:
             Добавления в контекст информации: всего попыток, удачных попыток, неудачных попыток и процентное содержание
+            (по счетчикам рассылок)
         get_permission_name(self) -> str:
             Метод для передачи названия доступа в родительский класс BaseLoginView:
             "client_connect.can_list_sending_attempts"
@@ -336,9 +349,15 @@ class SendingAttemptsListView(BaseListView, ListView):
         """
 
         context = super().get_context_data(**kwargs)
-        send_all = len(self.get_queryset().all())
-        send_success = len(self.get_queryset().filter(status="success"))
-        send_fail = len(self.get_queryset().filter(status="fail"))
+        user = self.request.user
+        mailings = Mailing.objects.all()
+        if not (user.has_perm("client_connect.can_list_sending_attempts") or user.is_superuser):
+            mailings = mailings.filter(owner=user)
+        # счетчики рассылок вместо подсчета строк журнала доставки
+        counters = mailings.aggregate(send_success=Sum("sent_count"), send_fail=Sum("failed_count"))
+        send_success = counters["send_success"] or 0
+        send_fail = counters["send_fail"] or 0
+        send_all = send_success + send_fail
         if send_success:
             success_rate = round((send_success / send_all * 100), 2)
         else:
@@ -578,7 +597,7 @@ class MailingCreateView(BaseCreateView):
         message = form.save()
         user = self.request.user
         message.owner = user
-        message.save()
+        message.save(update_fields=["owner"])
         return super().form_valid(form)
 
     def get_form(self, form_class: Optional[BaseForm] = None) -> BaseForm:
@@ -603,6 +622,8 @@ class MailingDetailView(BaseLoginView, DetailView):
     """
     Представление отвечающее за детальную информацию о рассылки
     Методы:
+        get_context_data(self, **kwargs) -> dict:
+            Добавления в контекст признака отправки: поток прогресса открывается только во время отправки
         get_permission_name(self) -> str:
             Метод для передачи названия доступа в родительский класс BaseLoginView: "client_connect.delete_message"
     """
@@ -611,6 +632,44 @@ class MailingDetailView(BaseLoginView, DetailView):
     template_name = "client_connect/mailing/mailing_detail.html"
     context_object_name = "mailing"
 
+    def get_context_data(self, **kwargs) -> dict:
+        """
+        Добавления в контекст признака отправки(sending): рассылка запущена или ее задание ждет исполнителя
+        в очереди. Поток прогресса(Server-Sent Events) открывается только во время отправки, иначе страница
+        не держит соединение, которое опрашивает БД.
+        """
+        context = super().get_context_data(**kwargs)
+        context["sending"] = (
+            self.object.status == "launched" or self.object.jobs.filter(status__in=("queued", "running")).exists()
+        )
+        return context
+
+    def get_permission_name(self) -> str:
+        """Метод для передачи названия доступа в родительский класс BaseLoginView: "client_connect.view_mailing"""
+        return "client_connect.view_mailing"
+
+
+class MailingRetriesView(BaseLoginView, DetailView):
+    """
+    Представление отвечающее за список запланированных повторных отправок рассылки
+    Методы:
+        get_context_data(self, **kwargs) -> dict:
+            Добавления в контекст повторов рассылки в порядке времени следующей попытки
+        get_permission_name(self) -> str:
+            Метод для передачи названия доступа в родительский класс BaseLoginView: "client_connect.view_mailing"
+    """
+
+    model = Mailing
+    template_name = "client_connect/mailing/mailing_retries.html"
+    context_object_name = "mailing"
+
+    def get_context_data(self, **kwargs) -> dict:
+        """Добавления в контекст повторов рассылки в порядке времени следующей попытки"""
+        context = super().get_context_data(**kwargs)
+        context["retries"] = self.object.retries.select_related("recipient").order_by("next_attempt_at")
+        context["max_attempts"] = settings.MAILING_RETRY_MAX_ATTEMPTS
+        return context
+
     def get_permission_name(self) -> str:
         """Метод для передачи названия доступа в родительский класс BaseLoginView: "client_connect.view_mailing"""
         return "client_connect.view_mailing"
@@ -676,14 +735,15 @@ class HomeViews(LoginRequiredMixin, TemplateView):
     Представление для отображения информации о рассылках
     Методы:
         get_context_data(self, **kwargs) -> dict:
-            Заносит в контекст все рассылки, рассылки со статусом 'запущено' и уникальных получателей.
+            Заносит в контекст все рассылки, рассылки со статусом 'запущено', уникальных получателей
+            и итоги отправки по счетчикам рассылок.
             Для пользователя не входящего в группы и не являющего супер пользователем выводит только свои данные.
     """
 
     template_name = "client_connect/home.html"
 
     def get_context_data(self, **kwargs) -> dict:
-        """Заносит в контекст все рассылки, рассылки со статусом 'запущено' и уникальных получателей"""
+        """Заносит в контекст все рассылки, рассылки со статусом 'запущено', уникальных получателей и итоги отправки"""
 
         context = super().get_context_data(**kwargs)
         user = self.request.user
@@ -701,18 +761,58 @@ class HomeViews(LoginRequiredMixin, TemplateView):
                 "mailings": mailings,
                 "start_mailings": start_mailings,
                 "recipients": recipients,
+                "delivery": mailings.aggregate(sent=Sum("sent_count"), failed=Sum("failed_count")),
             }
         )
 
         return context
 
 
+class MailingProgressView(View):
+    """
+    Представление отвечающее за поток прогресса отправки рассылки(Server-Sent Events)
+    Методы:
+        get(self, request: HttpRequest, pk: int) -> HttpResponseBase:
+            Асинхронная обработка гет запроса: поток событий с количеством отправленных, не отправленных
+            и оставшихся писем и текущей скоростью отправки.
+    """
+
+    async def get(self, request: HttpRequest, pk: int) -> HttpResponseBase:
+        """
+        Асинхронная обработка гет запроса: поток событий с количеством отправленных, не отправленных
+        и оставшихся писем и текущей скоростью отправки.
+        Данные берутся из счетчиков прогресса(Redis при CACHE_ENABLED), журнал доставки не пересчитывается.
+        Под ASGI поток не занимает поток сервера, под WSGI(runserver) - занимает на время отправки.
+        :param request: HTTP-запрос
+        :param pk: Первичный ключ рассылки
+        :return: Поток событий text/event-stream
+        :raise Http404: Если рассылка не найдена.
+        """
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        mailing = await Mailing.objects.select_related("owner").filter(pk=pk).afirst()
+        if mailing is None:
+            raise Http404("Рассылка не найдена")
+        access_response = await sync_to_async(AccessControlService.authorize_access)(
+            user=user, obj=mailing, permission_name="client_connect.view_mailing"
+        )
+        if access_response is not None:
+            return access_response
+
+        stream = aprogress_stream(pk) if isinstance(request, ASGIRequest) else progress_stream(pk)
+        response = StreamingHttpResponse(stream, content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"  # без буферизации в nginx
+        return response
+
+
 class MailingSendView(BaseLoginView, View):
     """
     Представление отвечающее за отправку рассылки
     Методы:
         post(self, request: HttpRequest, pk: int) -> HttpResponse:
-            Обработка пост запроса запуска рассылки.
+            Обработка пост запроса запуска рассылки: постановка рассылки в очередь заданий.
         get_permission_name(self) -> str:
             Метод для передачи названия доступа в родительский класс BaseLoginView: "client_connect.change_mailing
     """
@@ -722,19 +822,21 @@ class MailingSendView(BaseLoginView, View):
     def post(self, request: HttpRequest, pk: int) -> HttpResponse:
         """
         Обработка пост запроса запуска рассылки.
+        Рассылка ставится в очередь заданий и отправляется исполнителем(run_mail_worker), ответ возвращается сразу.
+        Поле формы engine выбирает движок отправки('threaded' или 'async'), по умолчанию MAILING_ENGINE.
+        Поле формы resume продолжает рассылку с места остановки, пропуская получателей с доставленным письмом.
         :param request: HTTP-запрос
         :param pk: Первичный ключ рассылки
         :return: Переход на список рассылок
         """
+        engine = request.POST.get("engine") or None  # движок отправки, по умолчанию из настроек
+        if engine is not None and engine not in MailingService.ENGINES:
+            return HttpResponse("Неизвестный движок отправки", status=400)
         mailing = get_object_or_404(Mailing, pk=pk)  # получаем объект рассылки
-        MailingService.update_status(mailing, "launched")
-        message = get_object_or_404(Message, pk=mailing.message.pk)  # получаем объект сообщения из объекта рассылки
-        recipients = mailing.recipients.all()  # получаем объекты получателей из объекта рассылки
-        recipient_list = [recipient.email for recipient in recipients]
-        if not recipient_list:
+        if not mailing.recipients.exists():
             return HttpResponse("Список получателей пуст")
-        MailingService.send_messages(recipients=recipient_list, message=message, mailing=mailing)
-        MailingService.update_status(mailing, "done")
+        resume = request.POST.get("resume") == "1"  # продолжить с места остановки
+        MailingJobService.enqueue(mailing, engine=engine, resume=resume)  # отправку выполнит команда run_mail_worker
         return redirect("client_connect:mailings_list")
 
     def get_permission_name(self) -> str:
@@ -755,11 +857,66 @@ class MailingSendDisableView(LoginRequiredMixin, PermissionRequiredMixin, View):
 
     def post(self, request: HttpRequest, pk: int) -> HttpResponse:
         """
-        Обработка пост запроса запуска рассылки.
+        Обработка пост запроса отключения рассылки.
+        Идущая отправка останавливается в течение MAILING_CANCEL_CHECK_INTERVAL секунд, задания из очереди снимаются.
         :param request: HTTP-запрос
         :param pk: Первичный ключ рассылки
         :return: Переход на список рассылок
         """
         mailing = get_object_or_404(Mailing, pk=pk)  # получаем объект рассылки
-        MailingService.update_status(mailing, "disable")
+        MailingService.cancel_mailing(mailing)  # идущая отправка остановится во всех процессах
         return redirect("client_connect:mailings_list")
+
+
+@method_decorator(csrf_exempt, name="dispatch")  # почтовые клиенты отправляют отписку в один клик без CSRF токена
+class UnsubscribeView(View):
+    """
+    Представление отвечающее за отписку получателя по ссылке из письма, без авторизации.
+    Рассылка и адрес берутся из подписанного токена ссылки, БД при проверке не запрашивается.
+    Методы:
+        get(self, request: HttpRequest, token: str) -> HttpResponse:
+            Обработка гет запроса: страница подтверждения отписки.
+        post(self, request: HttpRequest, token: str) -> HttpResponse:
+            Обработка пост запроса: отписка в один клик(List-Unsubscribe-Post) или кнопкой страницы.
+    """
+
+    template_name = "client_connect/unsubscribe.html"
+
+    def get(self, request: HttpRequest, token: str) -> HttpResponse:
+        """
+        Обработка гет запроса: страница подтверждения отписки.
+        Переход по ссылке не отписывает: ссылки в письмах открывают и антивирусные сканеры.
+        :param request: HTTP-запрос
+        :param token: Подписанный токен отписки
+        :return: Страница с кнопкой отписки, 400 - неверный или просроченный токен
+        """
+        try:
+            _, email = read_token(token)
+        except signing.SignatureExpired:
+            return HttpResponse("Срок действия ссылки отписки истек", status=400)
+        except signing.BadSignature:
+            return HttpResponse("Неверная ссылка отписки", status=400)
+        return render(request, self.template_name, {"email": email, "done": False})
+
+    def post(self, request: HttpRequest, token: str) -> HttpResponse:
+        """
+        Обработка пост запроса: отписка в один клик(List-Unsubscribe-Post) или кнопкой страницы.
+        Отписка в один клик принимается без CSRF токена, кнопка страницы проверяет CSRF токен формы.
+        Отписка добавляется в буфер(UnsubscribeBuffer) и записывается в список исключений пачкой,
+        без CACHE_ENABLED - сразу.
+        :param request: HTTP-запрос
+        :param token: Подписанный токен отписки
+        :return: Страница с подтверждением отписки, 400 - неверный или просроченный токен, 403 - неверный CSRF токен
+        """
+        if request.POST.get("List-Unsubscribe") != "One-Click":
+            rejected = CsrfViewMiddleware(lambda _: None).process_view(request, None, (), {})
+            if rejected is not None:
+                return rejected
+        try:
+            mailing_pk, email = read_token(token)
+        except signing.SignatureExpired:
+            return HttpResponse("Срок действия ссылки отписки истек", status=400)
+        except signing.BadSignature:
+            return HttpResponse("Неверная ссылка отписки", status=400)
+        UnsubscribeBuffer.add(mailing_pk, email)
+        return render(request, self.template_name, {"email": email, "done": True})
@@ -121,14 +121,75 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 AUTH_USER_MODEL = "users.CustomUser"
 
-EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+# Почтовый бэкенд: SMTP - рассылки идут через пулы SMTP соединений, иначе(console, locmem) - через бэкенд
+EMAIL_BACKEND = os.getenv("EMAIL_BACKEND", "django.core.mail.backends.smtp.EmailBackend")
 EMAIL_HOST = os.getenv("EMAIL_HOST")
-EMAIL_PORT = os.getenv("EMAIL_PORT")
+EMAIL_PORT = int(os.getenv("EMAIL_PORT") or 25)  # порт по умолчанию, как в Django
 EMAIL_USE_TLS = True if os.getenv("EMAIL_USE_TLS") == "True" else False
 EMAIL_USE_SSL = True if os.getenv("EMAIL_USE_SSL") == "True" else False
 EMAIL_HOST_USER = os.getenv("EMAIL_HOST_USER")
 EMAIL_HOST_PASSWORD = os.getenv("EMAIL_HOST_PASSWORD")
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
+EMAIL_TIMEOUT = int(os.getenv("EMAIL_TIMEOUT", 30))
+
+# Пул SMTP соединений для рассылок
+EMAIL_POOL_SIZE = int(os.getenv("EMAIL_POOL_SIZE", 4))
+EMAIL_POOL_NOOP_INTERVAL = int(os.getenv("EMAIL_POOL_NOOP_INTERVAL", 30))
+EMAIL_PIPELINING = os.getenv("EMAIL_PIPELINING", "True") == "True"
+
+# Несколько SMTP серверов: 'адрес:порт=вес/соединений,...', пусто - только EMAIL_HOST
+EMAIL_RELAYS = os.getenv("EMAIL_RELAYS", "")
+EMAIL_RELAY_BALANCING = os.getenv("EMAIL_RELAY_BALANCING", "weighted")
+
+# Движок отправки рассылок
+MAILING_ENGINE = os.getenv("MAILING_ENGINE", "threaded")
+MAILING_WORKERS = int(os.getenv("MAILING_WORKERS", 4))
+MAILING_QUEUE_SIZE = int(os.getenv("MAILING_QUEUE_SIZE", 100))
+MAILING_CONNECTION_PER_WORKER = False if os.getenv("MAILING_CONNECTION_PER_WORKER") == "False" else True
+MAILING_ATTEMPTS_BATCH_SIZE = int(os.getenv("MAILING_ATTEMPTS_BATCH_SIZE", 100))
+MAILING_RECIPIENTS_CHUNK_SIZE = int(os.getenv("MAILING_RECIPIENTS_CHUNK_SIZE", 2000))
+MAILING_RCPT_BATCH_SIZE = int(os.getenv("MAILING_RCPT_BATCH_SIZE", 50))
+MAILING_DOMAIN_CONCURRENCY = int(os.getenv("MAILING_DOMAIN_CONCURRENCY", 20))
+MAILING_DOMAIN_RATE_LIMIT = float(os.getenv("MAILING_DOMAIN_RATE_LIMIT", 0))
+MAILING_DOMAIN_LIMITS = os.getenv("MAILING_DOMAIN_LIMITS", "")
+MAILING_DOMAIN_BUFFER_SIZE = int(os.getenv("MAILING_DOMAIN_BUFFER_SIZE", 20000))
+MAILING_ASYNC_CONCURRENCY = int(os.getenv("MAILING_ASYNC_CONCURRENCY", 100))
+MAILING_WORKER_POLL_INTERVAL = float(os.getenv("MAILING_WORKER_POLL_INTERVAL", 5))
+MAILING_SCHEDULER_POLL_INTERVAL = float(os.getenv("MAILING_SCHEDULER_POLL_INTERVAL", 30))
+MAILING_LEASE_TTL = float(os.getenv("MAILING_LEASE_TTL", 60))
+MAILING_PROGRESS_INTERVAL = float(os.getenv("MAILING_PROGRESS_INTERVAL", 1))
+MAILING_CANCEL_CHECK_EVERY = int(os.getenv("MAILING_CANCEL_CHECK_EVERY", 50))
+MAILING_CANCEL_CHECK_INTERVAL = float(os.getenv("MAILING_CANCEL_CHECK_INTERVAL", 1))
+MAILING_CANCEL_DB_CHECK_INTERVAL = float(os.getenv("MAILING_CANCEL_DB_CHECK_INTERVAL", 10))
+
+# Ограничение скорости отправки(писем в секунду), общее для всех процессов при CACHE_ENABLED
+MAILING_RELAY_RATE_LIMIT = float(os.getenv("MAILING_RELAY_RATE_LIMIT", 0))
+MAILING_RATE_BURST = float(os.getenv("MAILING_RATE_BURST", 0))
+MAILING_RATE_BACKOFF = float(os.getenv("MAILING_RATE_BACKOFF", 0.5))
+MAILING_RATE_MIN = float(os.getenv("MAILING_RATE_MIN", 0.5))
+
+# Повторная отправка после временных ошибок SMTP сервера(4xx, обрыв соединения)
+MAILING_RETRY_MAX_ATTEMPTS = int(os.getenv("MAILING_RETRY_MAX_ATTEMPTS", 5))
+MAILING_RETRY_BASE_DELAY = int(os.getenv("MAILING_RETRY_BASE_DELAY", 60))
+MAILING_RETRY_MAX_DELAY = int(os.getenv("MAILING_RETRY_MAX_DELAY", 3600))
+MAILING_RETRY_BATCH_SIZE = int(os.getenv("MAILING_RETRY_BATCH_SIZE", 100))
+
+# Автоматический выключатель: пауза отправки при недоступности SMTP сервера(обрывы, таймауты, ответ 421)
+MAILING_CIRCUIT_ERROR_RATE = float(os.getenv("MAILING_CIRCUIT_ERROR_RATE", 0.5))
+MAILING_CIRCUIT_WINDOW = int(os.getenv("MAILING_CIRCUIT_WINDOW", 50))
+MAILING_CIRCUIT_MIN_CALLS = int(os.getenv("MAILING_CIRCUIT_MIN_CALLS", 10))
+MAILING_CIRCUIT_OPEN_TIME = float(os.getenv("MAILING_CIRCUIT_OPEN_TIME", 30))
+MAILING_CIRCUIT_PROBES = int(os.getenv("MAILING_CIRCUIT_PROBES", 3))
+
+# Список исключений: адреса, на которые письма не отправляются(фильтр Блума в памяти процесса)
+MAILING_SUPPRESSION_REFRESH = float(os.getenv("MAILING_SUPPRESSION_REFRESH", 60))
+MAILING_SUPPRESSION_FALSE_POSITIVE = float(os.getenv("MAILING_SUPPRESSION_FALSE_POSITIVE", 0.001))
+
+# Отписка в один клик: подписанные ссылки в письмах, отписки записываются в список исключений пачками
+MAILING_UNSUBSCRIBE_BASE_URL = os.getenv("MAILING_UNSUBSCRIBE_BASE_URL", "")
+MAILING_UNSUBSCRIBE_BATCH_SIZE = int(os.getenv("MAILING_UNSUBSCRIBE_BATCH_SIZE", 500))
+MAILING_UNSUBSCRIBE_FLUSH_INTERVAL = float(os.getenv("MAILING_UNSUBSCRIBE_FLUSH_INTERVAL", 5))
+MAILING_UNSUBSCRIBE_MAX_AGE_DAYS = float(os.getenv("MAILING_UNSUBSCRIBE_MAX_AGE_DAYS", 90))
 
 LOGIN_URL = "users:login"
 LOGIN_REDIRECT_URL = "client_connect:home"